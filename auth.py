@@ -1,20 +1,157 @@
+"""Authentification : comptes utilisateurs (table users) ou mot de passe partagé.
+
+Chaque compte a un rôle : « admin » (accès complet) ou « user », limité aux prestations
+de son prestataire (filtre ajouté par database.py à chaque requête). Les mots de passe
+sont hachés avec scrypt et un sel aléatoire. Après LOCK_AFTER échecs consécutifs, le
+compte est bloqué LOCK_SECONDS secondes, durée qui double à chaque nouvel échec ; la
+session qui multiplie les échecs, quel que soit le nom saisi, est freinée de la même façon.
+
+Tant qu'aucun compte n'existe, l'ancien fonctionnement est gardé : le secret APP_PASSWORD
+(s'il est défini) donne un accès administrateur, le temps de créer les comptes dans
+Admin > Utilisateurs ou en ligne de commande :
+
+    python auth.py alice --provider "Alice Martin"
+    python auth.py admin --role admin
+"""
+import argparse
+import base64
+import functools
+import getpass
+import hashlib
+import hmac
+import os
+from datetime import datetime, timedelta
+
 import streamlit as st
 
+import database as db
+
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1  # ~16 Mo et quelques dizaines de ms par essai
+LOCK_AFTER = 5
+LOCK_SECONDS = 30
+MAX_LOCK_SECONDS = 15 * 60
+ROLES = ("user", "admin")
+
+# --- Mots de passe ---
+def hash_password(password):
+    """Hash scrypt salé, au format scrypt$n$r$p$sel$hash (base64)."""
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    b64 = lambda b: base64.b64encode(b).decode()
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${b64(salt)}${b64(digest)}"
+
+def verify_password(password, stored):
+    """Compare en temps constant ; les paramètres scrypt sont relus dans le hash stocké."""
+    try:
+        scheme, n, r, p, salt, digest = stored.split("$")
+        if scheme != "scrypt":
+            return False
+        expected = base64.b64decode(digest)
+        actual = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p),
+                                dklen=len(expected))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+@functools.cache
+def _dummy_hash():
+    """Hash de référence : un nom inconnu coûte le même calcul qu'un mauvais mot de passe."""
+    return hash_password(os.urandom(8).hex())
+
+def _lock_delay(failures):
+    """Durée du blocage après `failures` échecs consécutifs (0 avant LOCK_AFTER)."""
+    if failures < LOCK_AFTER:
+        return timedelta(0)
+    return timedelta(seconds=min(LOCK_SECONDS * 2 ** (failures - LOCK_AFTER), MAX_LOCK_SECONDS))
+
+# --- Session ---
+def current_user():
+    """Compte connecté : {username, provider, role}, ou None."""
+    return st.session_state.get(db.SESSION_USER_KEY)
+
+def is_admin():
+    user = current_user()
+    return user is not None and user["role"] == "admin"
+
+def logout():
+    st.session_state.pop(db.SESSION_USER_KEY, None)
+
+def _login(username, provider, role):
+    st.session_state[db.SESSION_USER_KEY] = {"username": username, "provider": provider, "role": role}
+
 def check_password():
     """Retourne True si l'authentification est réussie, sinon False."""
-    app_pwd = st.secrets.get("APP_PASSWORD", None)
-    if not app_pwd:
+    if current_user() is not None:
         return True
+    if db.count_users() == 0:
+        return _check_app_password()
+    return _login_form()
 
-    if st.session_state.get("auth_ok", False):
+def _check_app_password():
+    """Ancien mode, sans comptes : mot de passe partagé APP_PASSWORD, accès administrateur."""
+    app_pwd = st.secrets.get("APP_PASSWORD", None)
+    if not app_pwd:
+        _login("admin", None, "admin")
         return True
 
     pwd = st.text_input("Mot de passe", type="password")
     if pwd == "":
         return False
-    if pwd == app_pwd:
-        st.session_state["auth_ok"] = True
+    if hmac.compare_digest(pwd.encode(), str(app_pwd).encode()):
+        _login("admin", None, "admin")
         return True
     else:
         st.error("Mot de passe incorrect.")
-        return False
\ No newline at end of file
+        return False
+
+def _login_form():
+    with st.form("login"):
+        username = st.text_input("Utilisateur").strip()
+        password = st.text_input("Mot de passe", type="password")
+        submitted = st.form_submit_button("Se connecter", type="primary")
+    if not submitted or not username:
+        return False
+
+    now = datetime.now()
+    session_blocked = st.session_state.get("login_blocked_until")
+    if session_blocked is not None and session_blocked > now:
+        st.error(f"Trop d'essais : réessayez dans {int((session_blocked - now).total_seconds()) + 1} s.")
+        return False
+
+    user = db.load_user(username)
+    if user is not None and user["locked_until"] is not None and user["locked_until"] > now:
+        st.error(f"Trop d'essais : réessayez dans {int((user['locked_until'] - now).total_seconds()) + 1} s.")
+        return False
+
+    if verify_password(password, user["password_hash"] if user else _dummy_hash()) and user is not None:
+        if user["failed_logins"]:
+            db.record_login_success(username)
+        st.session_state.pop("login_failures", None)
+        st.session_state.pop("login_blocked_until", None)
+        _login(user["username"], user["provider"], user["role"])
+        st.rerun()
+
+    failures = db.record_login_failure(username) if user is not None else 0
+    if _lock_delay(failures):
+        db.lock_user(username, now + _lock_delay(failures))
+    session_failures = st.session_state.get("login_failures", 0) + 1
+    st.session_state.login_failures = session_failures
+    if _lock_delay(session_failures):
+        st.session_state.login_blocked_until = now + _lock_delay(session_failures)
+    st.error("Utilisateur ou mot de passe incorrect.")
+    return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crée un compte ou change son mot de passe")
+    parser.add_argument("username")
+    parser.add_argument("--provider", help="Prestataire du compte (obligatoire pour le rôle user)")
+    parser.add_argument("--role", choices=ROLES, default="user")
+    args = parser.parse_args()
+    if args.role == "user" and not args.provider:
+        parser.error("--provider est obligatoire pour un compte user")
+
+    password = getpass.getpass("Mot de passe : ")
+    if len(password) < 8 or password != getpass.getpass("Confirmation : "):
+        raise SystemExit("Mot de passe trop court (8 caractères minimum) ou confirmation différente.")
+    db.save_user(args.username, args.provider, args.role, password_hash=hash_password(password))
+    print(f"Compte {args.username} ({args.role}) enregistré.")
@@ -0,0 +1,9 @@
+"""Banc d'essai de database.py sur un Postgres local rempli de données synthétiques.
+
+    python -m benchmarks.seed --rows 100000 --reset     # génère les données
+    python -m benchmarks.run --output bench.json        # mesure chaque fonction
+    python -m benchmarks.compare base.json bench.json   # signale les ralentissements
+
+La connexion est celle de l'application (.streamlit/secrets.toml) : elle doit
+pointer vers une base locale jetable (voir seed.ensure_local_database).
+"""
@@ -0,0 +1,58 @@
+"""Compare deux fichiers de résultats de benchmarks.run et signale les ralentissements.
+
+Une mesure régresse si sa médiane dépasse celle de la référence de plus de
+--threshold (20 % par défaut) et d'au moins --min-ms (bruit des petites requêtes).
+Code de sortie 1 s'il y a au moins une régression.
+
+    python -m benchmarks.compare baseline.json bench.json
+"""
+import argparse
+import json
+import sys
+
+def compare(baseline, current, threshold=0.2, min_ms=2.0):
+    """Retourne les lignes (nom, référence, actuel, ratio, statut) des mesures communes."""
+    rows = []
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            rows.append((name, None, cur["median_ms"], None, "nouveau"))
+            continue
+        ratio = cur["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+        if ratio > 1 + threshold and cur["median_ms"] - base["median_ms"] >= min_ms:
+            status = "RÉGRESSION"
+        elif ratio < 1 - threshold and base["median_ms"] - cur["median_ms"] >= min_ms:
+            status = "amélioration"
+        else:
+            status = "="
+        rows.append((name, base["median_ms"], cur["median_ms"], ratio, status))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare des résultats de benchmark")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--min-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    if baseline["meta"].get("backend") != current["meta"].get("backend"):
+        print(f"Attention : moteurs différents ({baseline['meta'].get('backend')} vs {current['meta'].get('backend')})")
+    if baseline["meta"].get("prestations") != current["meta"].get("prestations"):
+        print(f"Attention : volumes différents ({baseline['meta'].get('prestations')} vs {current['meta'].get('prestations')} prestations)")
+
+    rows = compare(baseline, current, args.threshold, args.min_ms)
+    for name, base, cur, ratio, status in rows:
+        base_txt = f"{base:10.2f}" if base is not None else " " * 10
+        ratio_txt = f"x{ratio:5.2f}" if ratio is not None else " " * 6
+        print(f"{name:<70} {base_txt} {cur:10.2f} {ratio_txt}  {status}")
+    regressions = [r for r in rows if r[4] == "RÉGRESSION"]
+    print(f"{len(regressions)} régression(s) sur {len(rows)} mesure(s).")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
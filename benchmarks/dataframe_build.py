@@ -0,0 +1,96 @@
+"""Compare la construction du DataFrame des prestations : ancien chemin (un dict par ligne)
+contre le chemin colonne par colonne de database._prestations_dataframe.
+
+Les lignes sont générées en mémoire sous la forme renvoyée par psycopg2 (Decimal et None
+pour l'ancien SELECT, float et '' pour PRESTATION_SELECT), sans base de données.
+
+    python -m benchmarks.dataframe_build --rows 10000 100000 1000000
+"""
+import argparse
+import gc
+import json
+import pickle
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from time import perf_counter
+
+import pandas as pd
+
+import database as db
+
+DESCRIPTIONS = ["Réunion de suivi", "Analyse TVA", "Clôture mensuelle", "Déplacement client", "Support comptable", ""]
+
+def legacy_dataframe(rows):
+    """Construction d'origine de load_prestations_filtered (avant le passage en colonnes)."""
+    data = []
+    for r in rows:
+        data.append({
+            "ID": r[0], "Prestataire": r[1] or "", "Client": r[2], "Tâche": r[3], "Description": r[4] or "",
+            "Début": r[5], "Fin": r[6], "Heures": float(r[7]), "Tarif €/h": float(r[8]), "Total €": float(r[9]),
+            "Facturée": bool(r[10]), "Réf facture": r[11] or "", "Date facturation": r[12],
+        })
+    if not data:
+        return pd.DataFrame(columns=db.PRESTATION_COLUMNS)
+    return pd.DataFrame(data)
+
+def synthetic_rows(n, seed=42):
+    """Retourne (lignes_ancien_format, lignes_nouveau_format) pour n prestations."""
+    rng = random.Random(seed)
+    providers = [f"Prestataire {i}" for i in range(8)]
+    clients = [f"Client {i:03d}" for i in range(150)]
+    tasks = {"Analyse": 75, "Consultance": 90, "Déplacement": 50, "Administration": 60}
+    origin = datetime(2019, 1, 1, 8)
+    legacy, columnar = [], []
+    for i in range(1, n + 1):
+        task = rng.choice(list(tasks))
+        start = origin + timedelta(minutes=15 * rng.randrange(0, 250_000))
+        hours = round(rng.uniform(0.25, 8), 2)
+        rate = tasks[task]
+        total = round(hours * rate, 2)
+        invoiced = rng.random() < 0.7
+        ref = f"2024-{rng.randrange(1, 400):04d}" if invoiced else None
+        inv_at = start + timedelta(days=30) if invoiced else None
+        desc = rng.choice(DESCRIPTIONS) + (f" #{i}" if rng.random() < 0.5 else "")
+        prov, cli = rng.choice(providers), clients[min(int(rng.paretovariate(1.2)) - 1, 149)]
+        end = start + timedelta(hours=hours)
+        legacy.append((i, prov, cli, task, desc or None, start, end, Decimal(str(hours)), Decimal(rate),
+                       Decimal(str(total)), invoiced, ref, inv_at))
+        columnar.append((i, prov, cli, task, desc, start, end, hours, float(rate), total, invoiced, ref or "", inv_at))
+    return legacy, columnar
+
+def measure(build, rows):
+    gc.collect()
+    t0 = perf_counter()
+    df = build(rows)
+    elapsed = perf_counter() - t0
+    return {
+        "seconds": round(elapsed, 3),
+        "memory_mb": round(df.memory_usage(deep=True).sum() / 2**20, 1),
+        "pickle_mb": round(len(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)) / 2**20, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--json", action="store_true", help="Sortie JSON au lieu du tableau")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.rows:
+        legacy_rows, columnar_rows = synthetic_rows(n)
+        results.append({"rows": n, "legacy": measure(legacy_dataframe, legacy_rows),
+                        "columnar": measure(db._prestations_dataframe, columnar_rows)})
+        del legacy_rows, columnar_rows
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'lignes':>9} | {'ancien s':>8} {'Mo':>7} {'pickle':>7} | {'colonnes s':>10} {'Mo':>7} {'pickle':>7}")
+    for r in results:
+        a, b = r["legacy"], r["columnar"]
+        print(f"{r['rows']:>9} | {a['seconds']:>8} {a['memory_mb']:>7} {a['pickle_mb']:>7} | "
+              f"{b['seconds']:>10} {b['memory_mb']:>7} {b['pickle_mb']:>7}")
+
+if __name__ == "__main__":
+    main()
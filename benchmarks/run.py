@@ -0,0 +1,244 @@
+"""Mesure chaque fonction publique de database.py et écrit les résultats en JSON.
+
+Les caches de l'application sont contournés (appel de la fonction d'origine) pour
+mesurer la base et la construction des DataFrames, pas le cache. Les IDs mesurés sont
+tirés avec une graine fixe (--sample-seed) et les saisies tombent à des dates fixes :
+deux exécutions sur le même jeu mesurent les mêmes lignes. Les écritures (insert,
+facturation, timers, suppression) modifient les données : passez --seed-rows pour
+repartir d'un jeu identique à chaque exécution. Celles qui ne se répètent pas à
+l'identique (facturation, timers) remettent leurs lignes en place avant chaque essai,
+hors mesure.
+
+    python -m benchmarks.run --seed-rows 1000000 --output bench.json
+    python -m benchmarks.run --only "page|summarize" --output bench.json
+"""
+import argparse
+import inspect
+import json
+import platform
+import random
+import re
+import statistics
+import subprocess
+from datetime import datetime, time, timedelta
+from time import perf_counter
+
+import pandas as pd
+
+import database as db
+import migrations
+from benchmarks import seed as seeding
+
+def _raw(func):
+    """Fonction d'origine, sans le cache (st.cache_data ou cache des requêtes) ni la mesure perf."""
+    return inspect.unwrap(func)
+
+def _rows(result):
+    """Lignes lues ou écrites, None si le résultat n'en compte pas (heures et montant d'une
+    saisie, booléen d'un timer, instantané des référentiels)."""
+    if isinstance(result, pd.Series):  # une prestation (load_prestation)
+        return 1
+    if isinstance(result, tuple) and result and isinstance(result[0], pd.DataFrame):  # page et curseurs
+        return len(result[0])
+    if isinstance(result, dict) and "dry_run" in result:  # rapport d'import
+        return result["valid"] if result["dry_run"] else result["inserted"]
+    if isinstance(result, dict) and "count" in result:  # summarize_prestations
+        return result["count"]
+    if isinstance(result, (pd.DataFrame, list, dict)):
+        return len(result)
+    if isinstance(result, int) and not isinstance(result, bool):  # lignes écrites
+        return result
+    return None
+
+def _sample(cur, sql, n=None):
+    cur.execute(sql, (n,) if n is not None else None)
+    return [r[0] for r in cur.fetchall()] if n is not None else cur.fetchone()
+
+def _filter_label(filters):
+    used = [f"{k}={v}" if k == "invoiced" else k for k, v in filters.items() if v is not None]
+    return ",".join(used) or "aucun"
+
+def _execute(sql, params):
+    """Écriture directe, hors fonctions mesurées (remise en place entre deux essais)."""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+        conn.commit()
+    db.clear_prestations_cache()
+
+def _uninvoice(condition, params):
+    _execute("UPDATE prestations SET invoiced = false, invoice_ref = NULL, invoiced_at = NULL"
+             f" WHERE invoiced AND {condition};", params)
+
+def build_benchmarks(sample_seed=42):
+    """Liste des (nom, fonction sans argument, répétitions[, préparation hors mesure])."""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            # Dernière prestation ; pas de ORDER BY start_at DESC LIMIT 1 : DuckDB 1.5 n'y renvoie
+            # aucune ligne après un DELETE massif (--seed-rows).
+            provider, client, task, day = _sample(
+                cur, "SELECT provider, client, task, start_at::date FROM prestations"
+                     " WHERE start_at = (SELECT MAX(start_at) FROM prestations) ORDER BY id LIMIT 1;")
+            cur.execute("SELECT id FROM prestations ORDER BY id;")
+            all_ids = [r[0] for r in cur.fetchall()]
+            to_delete = _sample(cur, "SELECT id FROM prestations ORDER BY id DESC LIMIT %s;", 10_000)
+    ids_100k = random.Random(sample_seed).sample(all_ids, min(100_000, len(all_ids)))
+    ids_10k, ids_1k = ids_100k[:10_000], ids_100k[:1_000]
+    rate = db.load_tasks().get(task, 75.0)
+    slot = datetime.combine(day + timedelta(days=1), time(9))  # après les données générées
+
+    benches = [
+        ("load_reference", db._load_reference, 20),
+        ("reference_data[check]", lambda: db.reference_data(check=True), 20),
+        ("load_clients", db.load_clients, 20),
+        ("load_tasks", db.load_tasks, 20),
+        ("load_providers", db.load_providers, 20),
+        ("load_all_clients", db.load_all_clients, 20),
+        ("load_all_tasks", db.load_all_tasks, 20),
+        ("load_all_providers", db.load_all_providers, 20),
+    ]
+    sample = (provider, client, task, day - timedelta(days=90), day)
+    for filters in migrations._filter_combinations(sample):
+        label = _filter_label(filters)
+        benches.append((f"load_prestations_filtered[{label}]",
+                        lambda f=filters: _raw(db.load_prestations_filtered)(**f), 3))
+    for filters in (dict(invoiced=False), dict(invoiced=None), dict(client=client, invoiced=None),
+                    dict(provider=provider, start_date=day - timedelta(days=365), end_date=day, invoiced=None)):
+        label = _filter_label(filters)
+        benches.append((f"load_prestations_page[{label}]", lambda f=filters: _raw(db.load_prestations_page)(**f), 10))
+        benches.append((f"summarize_prestations[{label}]", lambda f=filters: _raw(db.summarize_prestations)(**f), 10))
+
+    for by in (("client",), ("task",), ("provider",), ("month", "invoiced"), ("week", "invoiced")):
+        for label, period in (("tout", {}), ("1 an", dict(start_date=day - timedelta(days=365), end_date=day))):
+            benches.append((f"aggregate_prestations[{','.join(by)};{label}]",
+                            lambda b=by, p=period: _raw(db.aggregate_prestations)(b, **p), 10))
+
+    for query in ("audit", "réunion TVA", "trésor"):  # mot courant, deux mots, mot partiel
+        for filters in (dict(invoiced=False), dict(invoiced=None)):
+            benches.append((f"search_prestations[{query};{_filter_label(filters)}]",
+                            lambda q=query, f=filters: db.search_prestations(q, f), 10))
+
+    def point_lookup():
+        db._forget_prestations(ids_1k[:1])
+        return db.load_prestation(ids_1k[0])
+
+    def batch_lookup():
+        db._forget_prestations(ids_1k)
+        return db.load_prestations_by_ids(ids_1k)
+
+    def insert():
+        return db.insert_prestation(provider, client, task, "benchmark", slot, slot + timedelta(hours=1), rate)
+
+    target = db.load_prestation(ids_1k[0])
+
+    def update():  # mêmes valeurs à chaque essai : la ligne ne dérive pas
+        return db.update_prestation(ids_1k[0], target["Prestataire"], target["Client"], target["Tâche"],
+                                    target["Description"], target["Début"], target["Fin"], float(target["Tarif €/h"]))
+
+    billing_period = (day - timedelta(days=30), day)
+    billing_condition = "start_at >= %s AND start_at < %s"
+    billing_params = [billing_period[0], billing_period[1] + timedelta(days=1)]
+    start_timer = lambda: db.start_timer(provider, client, task, "benchmark", rate, slot)
+    cancel_timer = lambda: db.cancel_timer(provider)
+
+    import_df = pd.DataFrame({"Prestataire": provider, "Client": client, "Tâche": task,
+                              "Début": pd.date_range("2030-01-01 09:00", periods=10_000, freq="h")})
+    import_df["Fin"] = import_df["Début"] + pd.Timedelta(minutes=45)
+
+    benches += [
+        ("load_prestation", point_lookup, 50),
+        ("load_prestations_by_ids[1k]", batch_lookup, 10),
+        ("insert_prestation", insert, 50),
+        ("update_prestation", update, 50),
+        ("add_or_reactivate_client", lambda: db.add_or_reactivate_client(client), 20),
+        ("add_or_reactivate_provider", lambda: db.add_or_reactivate_provider(provider), 20),
+        ("upsert_task", lambda: db.upsert_task(task, rate), 20),
+        ("find_overlaps[1 jour]", lambda: db.find_overlaps(provider, datetime.combine(day, time(8)),
+                                                            datetime.combine(day, time(18))), 50),
+        ("overlap_report[tout]", lambda: db.overlap_report(), 3),
+        ("overlap_report[provider;1 an]", lambda: db.overlap_report(provider, day - timedelta(days=365), day), 10),
+        ("load_timers", db.load_timers, 50, start_timer),
+        ("start_timer", start_timer, 50, cancel_timer),
+        ("stop_timer", lambda: db.stop_timer(provider, slot + timedelta(hours=1)), 20, start_timer),
+        ("cancel_timer", cancel_timer, 50, start_timer),
+        ("import_prestations[10k,dry_run]", lambda: db.import_prestations(import_df, dry_run=True), 3),
+        ("import_prestations[10k]", lambda: db.import_prestations(import_df), 1),
+        ("preview_billing_run[30 j]", lambda: db.preview_billing_run(*billing_period), 10,
+         lambda: _uninvoice(billing_condition, billing_params)),
+        ("run_billing[30 j]", lambda: db.run_billing(*billing_period, prefix="BENCH-"), 3,
+         lambda: _uninvoice(billing_condition, billing_params)),
+        ("mark_prestations_invoiced[10k]", lambda: db.mark_prestations_invoiced(ids_10k, "BENCH"), 3,
+         lambda: _uninvoice("id = ANY(%s)", [ids_10k])),
+        ("mark_prestations_invoiced[100k]", lambda: db.mark_prestations_invoiced(ids_100k, "BENCH"), 1,
+         lambda: _uninvoice("id = ANY(%s)", [ids_100k])),
+        ("delete_prestations[10k]", lambda: db.delete_prestations(to_delete), 1),
+    ]
+    return benches
+
+def run(benches, only=None, repeat=None):
+    results = {}
+    for name, func, n, *setup in benches:
+        if only and not re.search(only, name):
+            continue
+        timings, rows = [], None
+        for _ in range(repeat or n):
+            for prepare in setup:
+                prepare()
+            t0 = perf_counter()
+            result = func()
+            timings.append((perf_counter() - t0) * 1000)
+            rows = _rows(result)
+        timings.sort()
+        results[name] = {
+            "repeat": len(timings),
+            "min_ms": round(timings[0], 3),
+            "median_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        }
+        count = ""
+        if rows is not None:  # pas de compte pour les heures, booléens et référentiels
+            results[name]["rows"] = rows
+            count = f"  ({rows} lignes)"
+        print(f"{name:<70} {results[name]['median_ms']:>10.2f} ms{count}", flush=True)
+    return results
+
+def metadata(sample_seed):
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version(), (SELECT COUNT(*) FROM prestations);")
+            server_version, prestations = cur.fetchone()
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "backend": db.dialect(),
+        "server": server_version,
+        "prestations": prestations,
+        "sample_seed": sample_seed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai de database.py")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--seed-rows", type=int, help="Régénère ce nombre de prestations avant de mesurer")
+    parser.add_argument("--only", help="Expression régulière sur le nom des mesures")
+    parser.add_argument("--repeat", type=int, help="Impose le nombre de répétitions")
+    parser.add_argument("--sample-seed", type=int, default=42, help="Graine du tirage des IDs mesurés")
+    parser.add_argument("--allow-remote", action="store_true")
+    args = parser.parse_args()
+
+    seeding.ensure_local_database(args.allow_remote)
+    if args.seed_rows:
+        seeding.seed(args.seed_rows, reset=True)
+    meta = metadata(args.sample_seed)
+    results = run(build_benchmarks(args.sample_seed), only=args.only, repeat=args.repeat)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, ensure_ascii=False)
+    print(f"Résultats écrits dans {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Remplit une base locale avec des prestations synthétiques aux distributions réalistes.
+
+Quelques gros clients concentrent l'essentiel des heures (loi de Zipf), chaque client
+est suivi par un ou deux prestataires, les prestations tombent en semaine entre 8 h
+et 18 h par pas de 15 minutes, leur durée suit une loi log-normale et tout ce qui a
+plus de deux mois est facturé. Les dates sont comptées à rebours depuis une date de
+référence fixe (--anchor) : même graine, même jeu de données, quel que soit le jour.
+
+    python -m benchmarks.seed --rows 1000000 --reset
+"""
+import argparse
+import io
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import database as db
+import migrations
+
+PROVIDERS = [f"Prestataire {i:02d}" for i in range(12)]
+CLIENTS = [f"Client {i:03d}" for i in range(300)]
+TASKS = {"Analyse": 75.0, "Consultance": 90.0, "Déplacement": 50.0, "Administration": 60.0,
+         "Formation": 80.0, "Audit": 110.0, "Clôture": 95.0, "Support": 65.0}
+TASK_WEIGHTS = [0.25, 0.25, 0.1, 0.1, 0.05, 0.1, 0.1, 0.05]
+WORDS = ["réunion", "suivi", "TVA", "bilan", "clôture", "audit", "paie", "fiscalité", "contrôle", "rapport",
+         "budget", "trésorerie", "déclaration", "analyse", "inventaire", "consolidation", "facturation", "contrat"]
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+CHUNK_ROWS = 200_000
+ANCHOR = datetime(2026, 1, 5)  # dernier jour couvert (exclu)
+COPY_COLUMNS = "provider, client, task, description, start_at, end_at, hours, rate, total, invoiced, invoice_ref, invoiced_at"
+
+def ensure_local_database(allow_remote=False):
+    """Refuse de toucher une base distante : le seed vide les tables."""
+    if db.dialect() == "duckdb":  # fichier local
+        return
+    host = str(st.secrets["DB_HOST"])
+    if not (allow_remote or host in LOCAL_HOSTS or host.startswith("/")):
+        raise SystemExit(f"DB_HOST={host!r} n'est pas local ; utilisez --allow-remote si c'est voulu.")
+
+def prestation_chunk(rng, n, years, anchor):
+    """Génère n prestations synthétiques (DataFrame aux colonnes de COPY_COLUMNS)."""
+    weights = 1.0 / np.arange(1, len(CLIENTS) + 1) ** 1.1
+    client_idx = rng.choice(len(CLIENTS), size=n, p=weights / weights.sum())
+    provider_idx = (client_idx + rng.integers(0, 2, size=n)) % len(PROVIDERS)
+    task_idx = rng.choice(len(TASKS), size=n, p=TASK_WEIGHTS)
+
+    first_day = np.datetime64(anchor.date() - timedelta(days=365 * years))
+    business_days = np.busday_count(first_day, np.datetime64(anchor.date()))
+    days = np.busday_offset(first_day, rng.integers(0, business_days, size=n), roll="forward")
+    starts = days.astype("datetime64[m]") + np.timedelta64(8 * 60, "m") + (rng.integers(0, 40, size=n) * 15).astype("timedelta64[m]")
+    minutes = np.clip(np.round(rng.lognormal(np.log(90), 0.6, size=n) / 15) * 15, 15, 600).astype(np.int64)
+
+    rates = np.array(list(TASKS.values()))[task_idx]
+    hours = np.round(minutes / 60, 2)
+    invoiced = starts < np.datetime64(anchor - timedelta(days=60), "m")
+    months = pd.Series(starts.astype("datetime64[M]").astype(str))
+    words = np.array(WORDS)[rng.integers(0, len(WORDS), size=(n, 3))]
+
+    return pd.DataFrame({
+        "provider": np.array(PROVIDERS)[provider_idx],
+        "client": np.array(CLIENTS)[client_idx],
+        "task": np.array(list(TASKS))[task_idx],
+        "description": pd.Series(words[:, 0]) + " " + words[:, 1] + " " + words[:, 2],
+        "start_at": starts,
+        "end_at": starts + minutes.astype("timedelta64[m]"),
+        "hours": hours,
+        "rate": rates,
+        "total": np.round(hours * rates, 2),
+        "invoiced": invoiced,
+        "invoice_ref": (months + "-" + pd.Series(client_idx).astype(str)).where(invoiced),
+        "invoiced_at": pd.Series(starts + np.timedelta64(30 * 24 * 60, "m")).where(invoiced),
+    })
+
+def seed(rows, reset=False, years=5, random_seed=42, anchor=ANCHOR):
+    """Crée le schéma, les référentiels et `rows` prestations. Retourne la durée en secondes."""
+    t0 = perf_counter()
+    migrations.apply_migrations()
+    rng = np.random.default_rng(random_seed)
+    duckdb = db.dialect() == "duckdb"
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            if reset and duckdb:
+                for table in ("prestations", "prestations_tombstones", "clients", "tasks", "providers"):
+                    cur.execute(f"DELETE FROM {table};")
+            elif reset:
+                cur.execute("TRUNCATE prestations, prestations_tombstones, clients, tasks, providers RESTART IDENTITY;")
+            cur.executemany("INSERT INTO clients (name) VALUES (%s) ON CONFLICT (name) DO NOTHING;", [(c,) for c in CLIENTS])
+            cur.executemany("INSERT INTO providers (name) VALUES (%s) ON CONFLICT (name) DO NOTHING;", [(p,) for p in PROVIDERS])
+            cur.executemany("INSERT INTO tasks (name, rate) VALUES (%s, %s) ON CONFLICT (name) DO NOTHING;", list(TASKS.items()))
+            db._bump_catalog(cur)
+            done = 0
+            while done < rows:
+                n = min(CHUNK_ROWS, rows - done)
+                chunk = prestation_chunk(rng, n, years, anchor)
+                if duckdb:
+                    conn.register("chunk", chunk)
+                    cur.execute(f"INSERT INTO prestations ({COPY_COLUMNS}) SELECT {COPY_COLUMNS} FROM chunk;")
+                    conn.unregister("chunk")
+                else:
+                    buf = io.StringIO()
+                    chunk.to_csv(buf, sep="\t", header=False, index=False, na_rep="\\N")
+                    buf.seek(0)
+                    cur.copy_expert(f"COPY prestations ({COPY_COLUMNS}) FROM STDIN", buf)
+                done += n
+                print(f"  {done}/{rows} prestations", flush=True)
+            cur.execute("ANALYZE prestations;")
+        conn.commit()
+    db.clear_prestations_cache()
+    return perf_counter() - t0
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère des données de test dans une base locale")
+    parser.add_argument("--rows", type=int, default=100_000, help="Nombre de prestations (10k à 5M)")
+    parser.add_argument("--years", type=int, default=5, help="Période couverte")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--anchor", type=date.fromisoformat, default=ANCHOR.date(),
+                        help="Date de référence (AAAA-MM-JJ) : fin de la période générée")
+    parser.add_argument("--reset", action="store_true", help="Vide les tables avant de générer")
+    parser.add_argument("--allow-remote", action="store_true")
+    args = parser.parse_args()
+
+    ensure_local_database(args.allow_remote)
+    seconds = seed(args.rows, reset=args.reset, years=args.years, random_seed=args.seed,
+                   anchor=datetime.combine(args.anchor, datetime.min.time()))
+    print(f"{args.rows} prestations générées en {seconds:.1f} s")
+
+if __name__ == "__main__":
+    main()
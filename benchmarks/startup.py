@@ -0,0 +1,106 @@
+"""Mesure le démarrage à froid : imports de l'application puis premier affichage de main.py.
+
+Chaque essai tourne dans un nouveau processus Python (modules et caches vides).
+`-X importtime` donne le coût cumulé de chaque paquet importé par l'application (main.py
+et les modules qu'il charge après l'en-tête ; streamlit est déjà chargé par le serveur,
+il n'est pas compté). AppTest exécute ensuite main.py comme une première session
+(imports, bootstrap et page par défaut), puis comme une seconde session du même processus.
+La session est ouverte en administrateur, sans passer par le formulaire de connexion.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --json > startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+RENDER_SCRIPT = """
+import json, sys
+from time import perf_counter
+from streamlit.testing.v1 import AppTest
+
+def session():
+    at = AppTest.from_file(sys.argv[1], default_timeout=300)
+    at.session_state["auth_user"] = {"username": "admin", "provider": None, "role": "admin"}
+    t0 = perf_counter()
+    at.run()
+    if at.exception:
+        raise SystemExit(at.exception[0].value)
+    return (perf_counter() - t0) * 1000
+
+cold = session()
+warm = session()
+import perf
+print(json.dumps({"cold_session_ms": cold, "warm_session_ms": warm, **perf.startup_times()}))
+"""
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    return env
+
+# Modules de premier niveau chargés au démarrage : main.py, puis ceux qu'il importe après
+# l'affichage de l'en-tête (main() et bootstrap()).
+APP_MODULES = ("main", "views", "migrations")
+
+def import_times():
+    """Durée (ms) des imports de l'application et coût cumulé de chaque paquet de premier niveau."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import streamlit; import " + ", ".join(APP_MODULES)],
+                          capture_output=True, text=True, env=_env(), check=True)
+    packages, total = {}, 0.0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        top_level, name = not name.startswith("  "), name.strip()
+        if not cumulative.strip().isdigit():
+            continue
+        if top_level and name in APP_MODULES:
+            total += int(cumulative) / 1000
+        elif "." not in name:
+            packages[name] = int(cumulative) / 1000
+    packages.pop("streamlit", None)
+    return total, packages
+
+def render_times():
+    """Premier affichage d'une session, à froid puis à chaud, et étapes notées par perf.py."""
+    proc = subprocess.run([sys.executable, "-W", "ignore", "-c", RENDER_SCRIPT, str(ROOT / "main.py")],
+                          capture_output=True, text=True, env=_env(), check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Nombre de processus mesurés (médiane)")
+    parser.add_argument("--top", type=int, default=12, help="Paquets les plus coûteux affichés")
+    parser.add_argument("--json", action="store_true", help="Sortie JSON au lieu du tableau")
+    args = parser.parse_args()
+
+    imports = [import_times() for _ in range(args.runs)]
+    renders = [render_times() for _ in range(args.runs)]
+    packages = {name: statistics.median(run[1].get(name, 0.0) for run in imports) for name in imports[0][1]}
+    results = {
+        "app_imports_ms": round(statistics.median(run[0] for run in imports), 1),
+        **{key: round(statistics.median(r[key] for r in renders if key in r), 1) for key in renders[0]},
+        "packages_ms": {name: round(ms, 1) for name, ms in sorted(packages.items(), key=lambda p: -p[1])[:args.top]},
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'imports application':<32} {results['app_imports_ms']:>9.1f} ms")
+    for key, label in [("bootstrap", "bootstrap (1 fois par processus)"), ("cold_session_ms", "1re session (à froid)"),
+                       ("warm_session_ms", "session suivante (à chaud)")]:
+        if key in results:
+            print(f"{label:<32} {results[key]:>9.1f} ms")
+    print("\nPaquets les plus coûteux à l'import (cumulé) :")
+    for name, ms in results["packages_ms"].items():
+        print(f"  {name:<30} {ms:>9.1f} ms")
+
+if __name__ == "__main__":
+    main()
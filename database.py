@@ -1,45 +1,423 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import unicodedata
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from time import monotonic, perf_counter
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+import numpy as np
 import pandas as pd
 import streamlit as st
 from datetime import datetime, time
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-# --- Connexion ---
-def get_connection():
+import perf
+from query_cache import QueryCache, query_scopes
+
+# --- Pool de connexions ---
+class _PooledConnection(psycopg2.extensions.connection):
+    """Connexion du pool, avec l'heure de sa dernière utilisation (son ouverture au départ)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_used = monotonic()
+
+class ConnectionPool:
+    """Pool de connexions PostgreSQL partagé par toutes les sessions du processus.
+
+    Un des deux magasins de connexions possibles, avec storage.DuckDBStore (voir storage.py).
+
+    Les connexions sont vérifiées (SELECT 1) avant d'être prêtées si elles sont
+    restées inactives plus de `check_after` secondes depuis leur dernier prêt ou leur
+    ouverture, et remplacées si elles sont mortes. Quand toutes les connexions sont
+    prises, l'appelant attend qu'une se libère (au plus `timeout` secondes).
+    """
+
+    dialect = "postgres"
+
+    def __init__(self, minconn, maxconn, timeout=30.0, check_after=30.0, **conn_kwargs):
+        self.minconn, self.maxconn = minconn, maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, connection_factory=_PooledConnection, **conn_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._counters = {"checkouts": 0, "waits": 0, "timeouts": 0, "reconnects": 0, "in_use": 0}
+
+    def _checkout(self):
+        t0 = perf_counter()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counters["waits"] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise psycopg2.pool.PoolError("Aucune connexion disponible dans le pool.")
+        try:
+            conn = self._get_live_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._counters["checkouts"] += 1
+            self._counters["in_use"] += 1
+            self._latencies.append(perf_counter() - t0)
+        return conn
+
+    def _get_live_connection(self):
+        """Connexion qui répond. Après un redémarrage de la base ou une coupure réseau, toutes
+        les connexions inactives peuvent être mortes : elles sont jetées une à une, jusqu'à
+        une qui répond ou, quand il n'en reste plus, une connexion neuve (non vérifiée)."""
+        while True:
+            conn = self._pool.getconn()
+            if not conn.closed and (monotonic() - conn.last_used <= self.check_after or self._ping(conn)):
+                return conn
+            self._discard(conn)
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _discard(self, conn):
+        """Ferme une connexion morte ; la suivante sera ouverte à la demande."""
+        self._pool.putconn(conn, close=True)
+        with self._lock:
+            self._counters["reconnects"] += 1
+
+    def _checkin(self, conn, broken=False):
+        discard = broken or bool(conn.closed)
+        conn.last_used = monotonic()
+        try:
+            self._pool.putconn(conn, close=discard)
+        finally:
+            with self._lock:
+                self._counters["in_use"] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Prête une connexion : commit en sortie normale, rollback sur exception."""
+        conn = self._checkout()
+        broken = False
+        try:
+            with conn:
+                yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._checkin(conn, broken)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            latencies = sorted(self._latencies)
+        data.update({"min": self.minconn, "max": self.maxconn})
+        if latencies:
+            data["checkout_ms_p50"] = round(latencies[len(latencies) // 2] * 1000, 2)
+            data["checkout_ms_p95"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2)
+            data["checkout_ms_max"] = round(latencies[-1] * 1000, 2)
+        return data
+
+    def close(self):
+        self._pool.closeall()
+
+def _connection_params():
+    """Paramètres de connexion lus dans st.secrets (partagés par le pool et l'écoute NOTIFY)."""
+    return dict(
+        host=st.secrets["DB_HOST"],
+        port=st.secrets.get("DB_PORT", "5432"),
+        dbname=st.secrets["DB_NAME"],
+        user=st.secrets["DB_USER"],
+        password=st.secrets["DB_PASSWORD"],
+        sslmode=st.secrets.get("DB_SSLMODE", "require"),
+        connect_timeout=10,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3,
+    )
+
+@st.cache_resource(show_spinner=False)
+def _get_pool():
     try:
-        return psycopg2.connect(
-            host=st.secrets["DB_HOST"],
-            port=st.secrets.get("DB_PORT", "5432"),
-            dbname=st.secrets["DB_NAME"],
-            user=st.secrets["DB_USER"],
-            password=st.secrets["DB_PASSWORD"],
-            sslmode="require",
+        if st.secrets.get("DB_BACKEND", "postgres") == "duckdb":
+            import storage
+            return storage.DuckDBStore(st.secrets.get("DB_PATH", "pointage.duckdb"))
+        # psycopg2 ferme les connexions rendues au-delà de minconn : on en garde assez
+        # pour les lectures simultanées de prefetch.py, sans reconnexion à chaque page
+        return ConnectionPool(
+            minconn=int(st.secrets.get("DB_POOL_MIN", 4)),
+            maxconn=int(st.secrets.get("DB_POOL_MAX", 10)),
+            timeout=float(st.secrets.get("DB_POOL_TIMEOUT", 30)),
+            check_after=float(st.secrets.get("DB_POOL_CHECK_AFTER", 30)),
+            cursor_factory=perf.TimedCursor,
+            **_connection_params(),
         )
     except Exception as e:
         st.error("Erreur de connexion à la base de données.")
         st.exception(e)
         raise
 
-# --- Clients ---
-@st.cache_data(ttl=60)
-def load_clients():
+# --- Connexion ---
+def get_connection():
+    """Emprunte une connexion au pool (à utiliser avec `with`)."""
+    return _get_pool().connection()
+
+def pool_stats():
+    """Statistiques du pool : connexions prêtées, attentes, latence d'emprunt."""
+    return _get_pool().stats()
+
+def dialect():
+    """Moteur utilisé : "postgres" ou "duckdb" (secret DB_BACKEND)."""
+    return _get_pool().dialect
+
+# Erreurs d'une base injoignable (réseau coupé, pool saturé), que l'appelant peut choisir d'ignorer
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, psycopg2.pool.PoolError, TimeoutError)
+
+# --- Portée de la session (comptes, voir auth.py) ---
+# Un compte « user » ne voit et ne modifie que les prestations de son prestataire : le filtre
+# est ajouté ici, à chaque requête, et fait partie des clés du cache des requêtes. Les
+# administrateurs, comme le code hors session (CLI, benchmarks, threads de synchronisation),
+# ont un accès complet.
+SESSION_USER_KEY = "auth_user"
+_provider_scope = contextvars.ContextVar("provider_scope")
+
+def session_provider():
+    """Prestataire auquel la session courante est limitée, ou None pour un accès complet."""
+    try:
+        return _provider_scope.get()
+    except LookupError:
+        pass
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    user = st.session_state.get(SESSION_USER_KEY)
+    if user is None:
+        raise PermissionError("Session non authentifiée.")
+    return None if user["role"] == "admin" else user["provider"]
+
+def bind_scope(func):
+    """Fige la portée de la session pour `func`, appelée plus tard hors du script (téléchargement différé)."""
+    scope = session_provider()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _provider_scope.set(scope)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _provider_scope.reset(token)
+    return wrapper
+
+def require_admin():
+    """Refuse l'opération (facturation, import, référentiels, comptes) à un compte limité."""
+    if session_provider() is not None:
+        raise PermissionError("Opération réservée aux administrateurs.")
+
+def _check_provider(provider):
+    """Refuse d'encoder ou de lire les créneaux d'un autre prestataire que celui de la session."""
+    scope = session_provider()
+    if scope is not None and provider != scope:
+        raise PermissionError(f"Ce compte est limité au prestataire {scope}.")
+
+def _scope_condition(column="provider"):
+    """Condition SQL ajoutée aux écritures par ID : (" AND ...", paramètres), vide pour un accès complet."""
+    scope = session_provider()
+    return ("", []) if scope is None else (f" AND {column} = %s", [scope])
+
+# --- Comptes utilisateurs (voir auth.py) ---
+USER_COLUMNS = ["Utilisateur", "Prestataire", "Rôle", "Actif", "Échecs", "Bloqué jusqu'à"]
+
+@perf.timed("db")
+def count_users():
+    """Nombre de comptes actifs (0 : authentification par APP_PASSWORD, voir auth.py)."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM users WHERE active;")
+            return cur.fetchone()[0]
+
+@perf.timed("db")
+def load_user(username):
+    """Compte actif `username` : dict avec le hash du mot de passe et l'état du blocage, ou None."""
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT name FROM clients WHERE active = true ORDER BY name;")
+            cur.execute(
+                "SELECT username, password_hash, provider, role, failed_logins, locked_until FROM users WHERE username = %s AND active;",
+                (username,),
+            )
+            row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip(("username", "password_hash", "provider", "role", "failed_logins", "locked_until"), row))
+
+@perf.timed("db")
+def load_users():
+    require_admin()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT username, COALESCE(provider, ''), role, active, failed_logins, locked_until FROM users ORDER BY username;")
             rows = cur.fetchall()
-    return [r[0] for r in rows]
+    return pd.DataFrame(rows, columns=USER_COLUMNS)
 
-@st.cache_data(ttl=60)
-def load_all_clients():
+@perf.timed("db")
+def save_user(username, provider, role, active=True, password_hash=None):
+    """Crée ou met à jour un compte ; sans `password_hash`, le mot de passe existant est gardé.
+
+    Retourne False si le compte n'existe pas et qu'aucun mot de passe n'est fourni.
+    """
+    require_admin()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if password_hash is None:
+                cur.execute(
+                    "UPDATE users SET provider = %s, role = %s, active = %s WHERE username = %s RETURNING id;",
+                    (provider or None, role, active, username),
+                )
+            else:
+                cur.execute(
+                    """
+                    INSERT INTO users (username, password_hash, provider, role, active) VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (username) DO UPDATE
+                    SET password_hash = EXCLUDED.password_hash, provider = EXCLUDED.provider, role = EXCLUDED.role,
+                        active = EXCLUDED.active, failed_logins = 0, locked_until = NULL
+                    RETURNING id
+                    """,
+                    (username, password_hash, provider or None, role, active),
+                )
+            saved = cur.fetchone() is not None
+        conn.commit()
+    return saved
+
+@perf.timed("db")
+def record_login_failure(username):
+    """Compte un échec de connexion. Retourne le nombre d'échecs consécutifs (0 si le compte n'existe pas)."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE users SET failed_logins = failed_logins + 1 WHERE username = %s RETURNING failed_logins;", (username,))
+            row = cur.fetchone()
+        conn.commit()
+    return row[0] if row else 0
+
+@perf.timed("db")
+def lock_user(username, until):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE users SET locked_until = %s WHERE username = %s;", (until, username))
+        conn.commit()
+
+@perf.timed("db")
+def record_login_success(username):
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT id, name, active FROM clients ORDER BY name;")
+            cur.execute("UPDATE users SET failed_logins = 0, locked_until = NULL WHERE username = %s;", (username,))
+        conn.commit()
+
+# --- Référentiels (clients, tâches, prestataires) ---
+# Un seul instantané immuable, partagé par toutes les sessions du processus, chargé en une
+# requête. Il n'est rechargé que si `catalog_state.version` a changé (incrémentée par
+# trigger sous PostgreSQL, par _bump_catalog sous DuckDB), vérifié au plus toutes les
+# REFERENCE_CHECK_INTERVAL secondes ; une écriture locale le recharge aussitôt.
+REFERENCE_CHECK_INTERVAL = 2.0
+
+class ReferenceData:
+    """Instantané des référentiels. Ne pas modifier : il est partagé."""
+
+    __slots__ = ("version", "clients", "tasks", "providers", "client_names", "task_rates", "provider_names")
+
+    def __init__(self, version, clients, tasks, providers):
+        self.version = version
+        self.clients = clients  # ((id, nom, actif), ...) triés par nom
+        self.tasks = tasks  # ((id, nom, tarif, actif), ...)
+        self.providers = providers
+        self.client_names = tuple(name for _, name, active in clients if active)
+        self.task_rates = {name: rate for _, name, rate, active in tasks if active}
+        self.provider_names = tuple(name for _, name, active in providers if active)
+
+_reference = None
+_reference_checked = 0.0
+_reference_lock = threading.Lock()
+
+def _load_reference():
+    """Lit les trois référentiels et la version du catalogue en une requête."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT 'version', version, NULL, NULL::float8, NULL::boolean FROM catalog_state"
+                " UNION ALL SELECT 'client', id, name, NULL, active FROM clients"
+                " UNION ALL SELECT 'task', id, name, rate::float8, active FROM tasks"
+                " UNION ALL SELECT 'provider', id, name, NULL, active FROM providers;"
+            )
             rows = cur.fetchall()
-    data = []
-    for cid, name, active in rows:
-        data.append({"ID": cid, "Nom": name, "Actif": bool(active)})
-    return pd.DataFrame(data)
+    version = next((rid for kind, rid, *_ in rows if kind == "version"), 0)
+    by_name = lambda r: r[1]
+    return ReferenceData(
+        version,
+        tuple(sorted(((rid, name, bool(active)) for kind, rid, name, _, active in rows if kind == "client"), key=by_name)),
+        tuple(sorted(((rid, name, rate, bool(active)) for kind, rid, name, rate, active in rows if kind == "task"), key=by_name)),
+        tuple(sorted(((rid, name, bool(active)) for kind, rid, name, _, active in rows if kind == "provider"), key=by_name)),
+    )
+
+@perf.timed("db", cached=True)
+def reference_data(check=False):
+    """Instantané courant des référentiels ; `check` force la vérification de la version."""
+    global _reference, _reference_checked
+    current = _reference
+    if current is not None and not check and monotonic() - _reference_checked < REFERENCE_CHECK_INTERVAL:
+        return current
+    with _reference_lock:
+        if _reference is not None and not check and monotonic() - _reference_checked < REFERENCE_CHECK_INTERVAL:
+            return _reference
+        if _reference is not None:
+            try:
+                with get_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT version FROM catalog_state;")
+                        row = cur.fetchone()
+            except CONNECTION_ERRORS:  # base injoignable : dernier instantané, nouvel essai au prochain intervalle
+                _reference_checked = monotonic()
+                return _reference
+            if row is not None and row[0] == _reference.version:
+                _reference_checked = monotonic()
+                return _reference
+        _reference = _load_reference()
+        _reference_checked = monotonic()
+        return _reference
+
+def _bump_catalog(cur):
+    """Signale une modification des référentiels (DuckDB ; PostgreSQL le fait par trigger)."""
+    if dialect() == "duckdb":
+        cur.execute("UPDATE catalog_state SET version = version + 1;")
 
+def _after_catalog_write():
+    global _reference_checked
+    _reference_checked = 0.0  # prochaine lecture : vérification de la version
+    reference_data()
+
+# --- Clients ---
+def load_clients():
+    return list(reference_data().client_names)
+
+def load_all_clients():
+    return pd.DataFrame([{"ID": cid, "Nom": name, "Actif": active} for cid, name, active in reference_data().clients])
+
+@perf.timed("db")
 def add_or_reactivate_client(name: str):
+    require_admin()
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
@@ -49,29 +427,22 @@ def add_or_reactivate_client(name: str):
                 """,
                 (name,),
             )
+            _bump_catalog(cur)
         conn.commit()
+    _after_catalog_write()
 
 # --- Tâches ---
-@st.cache_data(ttl=60)
 def load_tasks():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT name, rate FROM tasks WHERE active = true ORDER BY name;")
-            rows = cur.fetchall()
-    return {name: float(rate) for name, rate in rows}
+    return dict(reference_data().task_rates)
 
-@st.cache_data(ttl=60)
 def load_all_tasks():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, name, rate, active FROM tasks ORDER BY name;")
-            rows = cur.fetchall()
-    data = []
-    for tid, name, rate, active in rows:
-        data.append({"ID": tid, "Tâche": name, "Tarif €/h": float(rate), "Actif": bool(active)})
-    return pd.DataFrame(data)
+    return pd.DataFrame([
+        {"ID": tid, "Tâche": name, "Tarif €/h": rate, "Actif": active} for tid, name, rate, active in reference_data().tasks
+    ])
 
+@perf.timed("db")
 def upsert_task(name: str, rate: float):
+    require_admin()
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
@@ -81,8 +452,11 @@ def upsert_task(name: str, rate: float):
                 """,
                 (name, rate),
             )
+            _bump_catalog(cur)
         conn.commit()
+    _after_catalog_write()
 
+@perf.timed("db")
 def ensure_default_tasks():
     with get_connection() as conn:
         with conn.cursor() as cur:
@@ -95,41 +469,61 @@ def ensure_default_tasks():
                         "INSERT INTO tasks (name, rate, active) VALUES (%s, %s, true) ON CONFLICT (name) DO NOTHING;",
                         (name, rate),
                     )
+                _bump_catalog(cur)
         conn.commit()
+    if count == 0:
+        _after_catalog_write()
 
 # --- Prestataires ---
-@st.cache_data(ttl=60)
 def load_providers():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT name FROM providers WHERE active = true ORDER BY name;")
-            rows = cur.fetchall()
-    return [r[0] for r in rows]
+    scope = session_provider()
+    return [scope] if scope is not None else list(reference_data().provider_names)
 
-@st.cache_data(ttl=60)
 def load_all_providers():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, name, active FROM providers ORDER BY name;")
-            rows = cur.fetchall()
-    data = []
-    for pid, name, active in rows:
-        data.append({"ID": pid, "Prestataire": name, "Actif": bool(active)})
-    return pd.DataFrame(data)
+    return pd.DataFrame([{"ID": pid, "Prestataire": name, "Actif": active} for pid, name, active in reference_data().providers])
 
+@perf.timed("db")
 def add_or_reactivate_provider(name: str):
+    require_admin()
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "INSERT INTO providers (name, active) VALUES (%s, true) ON CONFLICT (name) DO UPDATE SET active = true;",
                 (name,),
             )
+            _bump_catalog(cur)
         conn.commit()
+    _after_catalog_write()
 
 # --- Prestations ---
+# Chaque écriture attribue une nouvelle `version` (séquence, voir migrations.py) à la ligne touchée et
+# publie un NOTIFY : les autres processus invalident leur cache et les magasins
+# synchronisés (sync.py) ne relisent que les lignes modifiées.
+CHANGES_CHANNEL = "prestations_changed"
+PROCESS_ID = uuid.uuid4().hex
+
+def _notify_changes(cur, changes):
+    """Publie (au commit) les portées (client, facturée) modifiées sur CHANGES_CHANNEL."""
+    if dialect() != "postgres":  # base embarquée : un seul processus, sync.py relit par scrutation
+        return
+    scopes = sorted({(c, bool(s)) for c, s in changes})
+    payload = json.dumps({"origin": PROCESS_ID, "scopes": scopes})
+    if len(payload) > 7000:  # limite de taille d'un NOTIFY : on demande une invalidation complète
+        payload = json.dumps({"origin": PROCESS_ID, "scopes": None})
+    cur.execute("SELECT pg_notify(%s, %s);", (CHANGES_CHANNEL, payload))
+
+def _after_write(changes, ids=()):
+    """Invalide les caches locaux après le commit d'une écriture."""
+    if ids:
+        _forget_prestations(ids)
+    _get_query_cache().invalidate(changes)
+
+@perf.timed("db")
 def insert_prestation(provider, client, task, description, start_dt, end_dt, rate):
+    _check_provider(provider)
     hours = round((end_dt - start_dt).total_seconds() / 3600, 2)
     total = round(hours * rate, 2)
+    changes = [(client, False)]
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
@@ -139,30 +533,475 @@ def insert_prestation(provider, client, task, description, start_dt, end_dt, rat
                 """,
                 (provider, client, task, description, start_dt, end_dt, hours, rate, total),
             )
+            _notify_changes(cur, changes)
         conn.commit()
+    _after_write(changes)
     return hours, total
 
+@perf.timed("db")
 def mark_prestations_invoiced(ids, invoice_ref):
-    if not ids: return
+    """Marque les prestations encore non facturées. Retourne le nombre de lignes marquées.
+
+    Les lignes déjà facturées (double clic, autre session) gardent leur référence.
+    """
+    require_admin()
+    if not ids: return 0
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "UPDATE prestations SET invoiced = true, invoiced_at = now(), invoice_ref = %s WHERE id = ANY(%s)",
+                """
+                UPDATE prestations
+                SET invoiced = true, invoiced_at = now(), invoice_ref = %s,
+                    updated_at = now(), version = nextval('prestations_version_seq')
+                WHERE id = ANY(%s) AND NOT invoiced
+                RETURNING client
+                """,
                 (invoice_ref, list(ids)),
             )
+            rows = cur.fetchall()
+            changes = [(c, state) for c in {r[0] for r in rows} for state in (False, True)]
+            if changes:
+                _notify_changes(cur, changes)
         conn.commit()
+    _after_write(changes, ids)
+    return len(rows)
 
+@perf.timed("db")
 def delete_prestations(ids):
     if not ids: return
+    scope_sql, scope_params = _scope_condition()
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM prestations WHERE id = ANY(%s);", (list(ids),))
+            if dialect() == "duckdb":  # pas de DELETE dans un WITH
+                cur.execute(f"DELETE FROM prestations WHERE id = ANY(%s){scope_sql} RETURNING id, client, invoiced",
+                            [list(ids)] + scope_params)
+                deleted = cur.fetchall()
+                if deleted:
+                    cur.execute(
+                        """
+                        INSERT INTO prestations_tombstones (id, client, invoiced)
+                        SELECT unnest(%s), unnest(%s), unnest(%s)
+                        ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, deleted_at = EXCLUDED.deleted_at
+                        """,
+                        [list(col) for col in zip(*deleted)],
+                    )
+                changes = {(c, s) for _, c, s in deleted}
+            else:
+                cur.execute(
+                    f"""
+                    WITH deleted AS (DELETE FROM prestations WHERE id = ANY(%s){scope_sql} RETURNING id, client, invoiced)
+                    INSERT INTO prestations_tombstones (id, client, invoiced)
+                    SELECT id, client, invoiced FROM deleted
+                    ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, deleted_at = EXCLUDED.deleted_at
+                    RETURNING client, invoiced
+                    """,
+                    [list(ids)] + scope_params,
+                )
+                changes = set(cur.fetchall())
+            _notify_changes(cur, changes)
         conn.commit()
+    _after_write(changes, ids)
 
-@st.cache_data(ttl=60)
-def load_prestations_filtered(provider=None, client=None, task=None, start_date=None, end_date=None, invoiced=None):
+# --- Facturation de la période (tous les clients) ---
+# Un numéro de facture par client, tiré de la séquence invoice_number_seq (migrations.py),
+# et toutes les prestations de la période marquées en une seule transaction.
+BILLING_COLUMNS = ["Client", "Facture", "Prestations", "Heures", "Total €"]
+
+def _billing_filters(start_date, end_date, clients=None):
+    conditions, params = _prestation_filters(start_date=start_date, end_date=end_date, invoiced=False)
+    if clients:
+        conditions.append("client = ANY(%s)"); params.append(list(clients))
+    return " AND ".join(conditions), params
+
+@perf.timed("db")
+def preview_billing_run(start_date, end_date, clients=None):
+    """Ce que facturerait run_billing : une ligne par client (nombre, heures, montant), calculée par la base."""
+    require_admin()
+    where, params = _billing_filters(start_date, end_date, clients)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT client, NULL, COUNT(*), SUM(hours)::float8, SUM(total)::float8
+                FROM prestations WHERE {where}
+                GROUP BY client ORDER BY client
+                """,
+                params,
+            )
+            rows = cur.fetchall()
+    return pd.DataFrame(rows, columns=BILLING_COLUMNS).drop(columns="Facture")
+
+@perf.timed("db")
+def run_billing(start_date, end_date, clients=None, prefix=None):
+    """Facture la période : numéro séquentiel par client (`prefix` + 5 chiffres, préfixe
+    « année de fin- » par défaut) et prestations marquées en un seul UPDATE ... FROM.
+
+    Les lignes sont verrouillées (FOR UPDATE) avant d'être numérotées : un second
+    lancement concurrent attend le premier puis ne trouve plus rien à facturer.
+    Retourne le récapitulatif par client (mêmes colonnes que l'aperçu, plus le numéro).
+    """
+    require_admin()
+    prefix = f"{end_date.year}-" if prefix is None else prefix
+    where, params = _billing_filters(start_date, end_date, clients)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if dialect() == "duckdb":  # ni FOR UPDATE ni UPDATE dans un WITH : les accès sont déjà sérialisés
+                cur.execute(
+                    f"""
+                    WITH numbered AS (
+                        SELECT billed_client, %s || lpad(nextval('invoice_number_seq')::text, 5, '0') AS number_ref
+                        FROM (SELECT DISTINCT client AS billed_client FROM prestations WHERE {where} ORDER BY client) c
+                    )
+                    UPDATE prestations
+                    SET invoiced = true, invoiced_at = now(), invoice_ref = numbered.number_ref,
+                        updated_at = now(), version = nextval('prestations_version_seq')
+                    FROM numbered
+                    WHERE prestations.client = numbered.billed_client AND {where}
+                    RETURNING id, client, invoice_ref, hours, total
+                    """,
+                    [prefix] + params + params,
+                )
+                summary = {}
+                for pid, client, ref, hours, total in cur.fetchall():
+                    entry = summary.setdefault(client, [client, ref, 0, 0.0, 0.0, []])
+                    entry[2] += 1; entry[3] += float(hours); entry[4] += float(total); entry[5].append(pid)
+                rows = [tuple(summary[c]) for c in sorted(summary)]
+            else:
+                cur.execute(
+                    f"""
+                    WITH locked AS (
+                        SELECT id, client FROM prestations
+                        WHERE {where}
+                        ORDER BY id
+                        FOR UPDATE
+                    ),
+                    numbered AS (
+                        SELECT client, %s || lpad(nextval('invoice_number_seq')::text, 5, '0') AS invoice_ref
+                        FROM (SELECT DISTINCT client FROM locked ORDER BY client) c
+                    ),
+                    billed AS (
+                        UPDATE prestations p
+                        SET invoiced = true, invoiced_at = now(), invoice_ref = n.invoice_ref,
+                            updated_at = now(), version = nextval('prestations_version_seq')
+                        FROM locked l JOIN numbered n USING (client)
+                        WHERE p.id = l.id
+                        RETURNING p.id, p.client, p.invoice_ref, p.hours, p.total
+                    )
+                    SELECT client, invoice_ref, COUNT(*), SUM(hours)::float8, SUM(total)::float8, array_agg(id)
+                    FROM billed
+                    GROUP BY client, invoice_ref ORDER BY client
+                    """,
+                    params + [prefix],
+                )
+                rows = cur.fetchall()
+            changes = [(r[0], state) for r in rows for state in (False, True)]
+            _notify_changes(cur, changes)
+        conn.commit()
+    _after_write(changes, [pid for r in rows for pid in r[5]])
+    return pd.DataFrame([r[:5] for r in rows], columns=BILLING_COLUMNS)
+
+# --- Timers ---
+# Un timer en cours par prestataire, en base : il survit à la fermeture de l'onglet et se voit
+# depuis un autre appareil. Les heures sont celles de l'application (horodatages locaux).
+@perf.timed("db")
+def load_timers():
+    """Timers en cours : {prestataire: {client, task, description, rate, started_at}}."""
+    scope_sql, scope_params = _scope_condition()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT provider, client, task, COALESCE(description, ''), rate::float8, started_at FROM timers"
+                        f" WHERE true{scope_sql} ORDER BY started_at;", scope_params)
+            rows = cur.fetchall()
+    return {
+        provider: {"client": client, "task": task, "description": description, "rate": rate, "started_at": started_at}
+        for provider, client, task, description, rate, started_at in rows
+    }
+
+@perf.timed("db")
+def start_timer(provider, client, task, description, rate, started_at):
+    """Démarre le timer du prestataire. Retourne False s'il en a déjà un en cours."""
+    _check_provider(provider)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO timers (provider, client, task, description, rate, started_at)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (provider) DO NOTHING
+                RETURNING provider
+                """,
+                (provider, client, task, description, rate, started_at),
+            )
+            started = cur.fetchone() is not None
+        conn.commit()
+    return started
+
+@perf.timed("db")
+def stop_timer(provider, end_dt):
+    """Arrête le timer et l'enregistre comme prestation, en une seule instruction.
+
+    Retourne (heures, total), ou None si le timer n'existe plus (déjà arrêté ailleurs).
+    """
+    _check_provider(provider)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if dialect() == "duckdb":  # pas de DELETE dans un WITH : accès déjà sérialisés
+                cur.execute("DELETE FROM timers WHERE provider = %s RETURNING client, task, description, rate::float8, started_at;", (provider,))
+                timer = cur.fetchone()
+                if timer is None:
+                    return None
+                client, task, description, rate, started_at = timer
+                hours = round((end_dt - started_at).total_seconds() / 3600, 2)
+                cur.execute(
+                    """
+                    INSERT INTO prestations (provider, client, task, description, start_at, end_at, hours, rate, total, created_at, invoiced)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, now(), false)
+                    RETURNING client, hours::float8, total::float8
+                    """,
+                    (provider, client, task, description, started_at, end_dt, hours, rate, round(hours * rate, 2)),
+                )
+            else:
+                cur.execute(
+                    """
+                    WITH t AS (DELETE FROM timers WHERE provider = %s RETURNING *)
+                    INSERT INTO prestations (provider, client, task, description, start_at, end_at, hours, rate, total, created_at, invoiced)
+                    SELECT t.provider, t.client, t.task, t.description, t.started_at, e.end_at, h.hours, t.rate,
+                           round(h.hours * t.rate, 2), now(), false
+                    FROM t
+                    CROSS JOIN (SELECT %s::timestamp AS end_at) e
+                    CROSS JOIN LATERAL (SELECT round((extract(epoch FROM e.end_at - t.started_at) / 3600)::numeric, 2) AS hours) h
+                    RETURNING client, hours::float8, total::float8
+                    """,
+                    (provider, end_dt),
+                )
+            row = cur.fetchone()
+            if row is None:
+                return None
+            client, hours, total = row
+            changes = [(client, False)]
+            _notify_changes(cur, changes)
+        conn.commit()
+    _after_write(changes)
+    return hours, total
+
+@perf.timed("db")
+def cancel_timer(provider):
+    """Abandonne le timer du prestataire sans rien enregistrer."""
+    _check_provider(provider)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM timers WHERE provider = %s;", (provider,))
+        conn.commit()
+
+# --- Saisies différées (voir journal.py) ---
+JOURNAL_INSERT = """
+    INSERT INTO prestations (client_uuid, provider, client, task, description, start_at, end_at, hours, rate, total, created_at, invoiced)
+"""
+
+def rejected_entry_errors():
+    """Erreurs dues au contenu d'une saisie (valeur refusée, contrainte violée, caractère NUL)
+    et non à la connexion : renvoyer la même saisie échouera toujours."""
+    if dialect() == "duckdb":
+        import duckdb
+        return duckdb.DataError, duckdb.IntegrityError, ValueError
+    return psycopg2.DataError, psycopg2.IntegrityError, ValueError
+
+@perf.timed("db")
+def insert_journal_entries(entries):
+    """Insère un lot de saisies du journal local en une transaction. Retourne le nombre de lignes insérées.
+
+    Chaque saisie (dict, voir journal.py) n'est insérée qu'une fois grâce à son `client_uuid`.
+    Une saisie issue d'un timer (`timer_started_at`) supprime ce timer, et n'est pas insérée
+    s'il n'existe plus : arrêté ou abandonné depuis un autre appareil, ou lot déjà envoyé.
+    La portée du compte est vérifiée à l'écriture dans le journal, pas ici.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            records = []
+            for e in entries:
+                if e["timer_started_at"] is not None:
+                    cur.execute("DELETE FROM timers WHERE provider = %s AND started_at = %s RETURNING provider;",
+                                (e["provider"], e["timer_started_at"]))
+                    if cur.fetchone() is None:
+                        continue
+                records.append((e["client_uuid"], e["provider"], e["client"], e["task"], e["description"],
+                                e["start_at"], e["end_at"], e["hours"], e["rate"], e["total"]))
+            if not records:
+                inserted = []
+            elif dialect() == "duckdb":  # base locale : pas d'aller-retour réseau à économiser
+                inserted = []
+                for record in records:
+                    cur.execute(JOURNAL_INSERT + " VALUES (%s::uuid, %s, %s, %s, %s, %s, %s, %s, %s, %s, now(), false)"
+                                " ON CONFLICT (client_uuid) DO NOTHING RETURNING client;", record)
+                    inserted += cur.fetchall()
+            else:
+                inserted = psycopg2.extras.execute_values(
+                    cur,
+                    JOURNAL_INSERT + " VALUES %s ON CONFLICT (client_uuid) DO NOTHING RETURNING client;",
+                    records,
+                    template="(%s::uuid, %s, %s, %s, %s, %s::timestamp, %s::timestamp, %s, %s, %s, now(), false)",
+                    fetch=True,
+                )
+            changes = [(client, False) for (client,) in inserted]
+            if changes:
+                _notify_changes(cur, changes)
+        conn.commit()
+    if changes:
+        _after_write(changes)
+    return len(inserted)
+
+# --- Import en masse ---
+IMPORT_REQUIRED = ["Prestataire", "Client", "Tâche", "Début", "Fin"]
+IMPORT_COLUMNS = ["provider", "client", "task", "description", "start_at", "end_at", "hours", "rate", "total", "invoiced", "invoice_ref"]
+
+def _parse_datetimes(col):
+    """Dates ISO (2025-01-31 09:00) ou à la française (31/01/2025 09:00) ; NaT si illisible."""
+    iso = pd.to_datetime(col, errors="coerce", format="ISO8601")
+    return iso.fillna(pd.to_datetime(col, errors="coerce", dayfirst=True, format="mixed"))
+
+@perf.timed("db")
+def import_prestations(df, dry_run=False):
+    """Valide puis importe un lot de prestations en une seule transaction.
+
+    Colonnes attendues : Prestataire, Client, Tâche, Début, Fin, et en option
+    Description, Tarif €/h (sinon le tarif de la tâche) et Réf facture (ligne
+    importée comme déjà facturée). Rien n'est écrit si une ligne est invalide ou
+    si `dry_run` est vrai. Retourne un rapport (erreurs par ligne, totaux, débit).
+    """
+    require_admin()
+    t0 = perf_counter()
+    missing_cols = [c for c in IMPORT_REQUIRED if c not in df.columns]
+    if missing_cols:
+        raise ValueError(f"Colonnes manquantes : {', '.join(missing_cols)}")
+
+    refs = reference_data(check=True)
+    known = {
+        "client": {name for _, name, _ in refs.clients},
+        "provider": {name for _, name, _ in refs.providers},
+        "task": {name for _, name, _, _ in refs.tasks},
+    }
+    task_rates = {name: rate for _, name, rate, _ in refs.tasks}
+
+    data = pd.DataFrame({
+        "provider": df["Prestataire"].astype("string").str.strip(),
+        "client": df["Client"].astype("string").str.strip(),
+        "task": df["Tâche"].astype("string").str.strip(),
+        "description": df["Description"].astype("string").fillna("") if "Description" in df.columns else "",
+        "start_at": _parse_datetimes(df["Début"]),
+        "end_at": _parse_datetimes(df["Fin"]),
+    }).reset_index(drop=True)
+    rate = pd.to_numeric(df["Tarif €/h"], errors="coerce").reset_index(drop=True) if "Tarif €/h" in df.columns else None
+    default_rate = data["task"].map(task_rates).astype("float64")
+    data["rate"] = default_rate if rate is None else rate.fillna(default_rate)
+    refs_col = df["Réf facture"].astype("string").str.strip().reset_index(drop=True) if "Réf facture" in df.columns else None
+    data["invoice_ref"] = refs_col.where(refs_col != "") if refs_col is not None else pd.NA
+    data["hours"] = ((data["end_at"] - data["start_at"]).dt.total_seconds() / 3600).round(2)
+    data["total"] = (data["hours"] * data["rate"]).round(2)
+
+    checks = [
+        (data["provider"].isna() | (data["provider"] == ""), "Prestataire manquant"),
+        (data["client"].isna() | (data["client"] == ""), "Client manquant"),
+        (data["task"].isna() | (data["task"] == ""), "Tâche manquante"),
+        (data["provider"].notna() & (data["provider"] != "") & ~data["provider"].isin(known["provider"]), "Prestataire inconnu"),
+        (data["client"].notna() & (data["client"] != "") & ~data["client"].isin(known["client"]), "Client inconnu"),
+        (data["task"].notna() & (data["task"] != "") & ~data["task"].isin(known["task"]), "Tâche inconnue"),
+        (data["start_at"].isna(), "Début invalide"),
+        (data["end_at"].isna(), "Fin invalide"),
+        (data["end_at"] <= data["start_at"], "La fin doit être après le début"),
+        (data["rate"].isna() | (data["rate"] < 0), "Tarif invalide"),
+    ]
+    errors = pd.concat(
+        [pd.DataFrame({"Ligne": data.index[mask.fillna(False).to_numpy(dtype=bool)] + 2, "Erreur": message}) for mask, message in checks],
+        ignore_index=True,
+    ).sort_values("Ligne", kind="stable")
+
+    report = {
+        "rows": len(data), "valid": len(data) - errors["Ligne"].nunique(), "errors": errors,
+        "hours": float(data["hours"].sum()), "total": float(data["total"].sum()),
+        "inserted": 0, "dry_run": dry_run,
+    }
+    if not dry_run and errors.empty and len(data):
+        invoiced = data["invoice_ref"].notna()
+        records = list(zip(
+            data["provider"], data["client"], data["task"], data["description"],
+            data["start_at"].dt.to_pydatetime(), data["end_at"].dt.to_pydatetime(),
+            data["hours"].astype(float), data["rate"].astype(float), data["total"].astype(float),
+            invoiced, data["invoice_ref"].astype(object).where(invoiced, None),
+        ))
+        changes = set(zip(data["client"], invoiced))
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                if dialect() == "duckdb":  # DuckDB lit le DataFrame directement
+                    conn.register("import_rows", pd.DataFrame(records, columns=IMPORT_COLUMNS))
+                    cur.execute(
+                        f"INSERT INTO prestations ({', '.join(IMPORT_COLUMNS)}, created_at, invoiced_at)"
+                        f" SELECT {', '.join(IMPORT_COLUMNS)}, now(), CASE WHEN invoiced THEN now() END FROM import_rows"
+                    )
+                    conn.unregister("import_rows")
+                else:
+                    psycopg2.extras.execute_values(
+                        cur,
+                        """
+                        INSERT INTO prestations (provider, client, task, description, start_at, end_at, hours, rate, total,
+                                                 invoiced, invoice_ref, created_at, invoiced_at)
+                        SELECT v.provider, v.client, v.task, v.description, v.start_at, v.end_at, v.hours, v.rate, v.total,
+                               v.invoiced, v.invoice_ref, now(), CASE WHEN v.invoiced THEN now() END
+                        FROM (VALUES %s) AS v (provider, client, task, description, start_at, end_at, hours, rate, total, invoiced, invoice_ref)
+                        """,
+                        records,
+                        template="(%s, %s, %s, %s, %s::timestamp, %s::timestamp, %s::numeric, %s::numeric, %s::numeric, %s::boolean, %s::text)",
+                        page_size=1000,
+                    )
+                _notify_changes(cur, changes)
+            conn.commit()
+        _after_write(changes)
+        report["inserted"] = len(records)
+
+    report["seconds"] = perf_counter() - t0
+    report["rows_per_second"] = report["rows"] / report["seconds"] if report["seconds"] else 0.0
+    return report
+
+# --- Cache des requêtes sur les prestations ---
+@st.cache_resource(show_spinner=False)
+def _get_query_cache():
+    return QueryCache(
+        max_entries=int(st.secrets.get("QUERY_CACHE_MAX_ENTRIES", 256)),
+        ttl=float(st.secrets.get("QUERY_CACHE_TTL", 60)),
+        max_bytes=int(float(st.secrets.get("QUERY_CACHE_MAX_MB", 256)) * 1024 * 1024),
+    )
+
+def _cached_query(func):
+    """Met en cache un chargeur de prestations selon ses arguments.
+
+    Le chargeur doit accepter les filtres `client` et `invoiced` : ils déterminent
+    les portées dont dépend le résultat, et donc les écritures qui l'invalident. Le
+    prestataire auquel la session est limitée fait partie de la clé.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        args_ = bound.arguments
+        key = (func.__name__, session_provider()) + tuple(args_.items())
+        scopes = query_scopes(args_["client"], args_["invoiced"])
+        return _get_query_cache().get_or_load(key, scopes, lambda: func(*bound.args, **bound.kwargs))
+    return wrapper
+
+PRESTATION_COLUMNS = ["ID", "Prestataire", "Client", "Tâche", "Description", "Début", "Fin", "Heures", "Tarif €/h", "Total €", "Facturée", "Réf facture", "Date facturation"]
+PRESTATION_SELECT = (
+    "SELECT id, COALESCE(provider, ''), client, task, COALESCE(description, ''), start_at::timestamp, end_at::timestamp,"
+    " hours::float8, rate::float8, total::float8, invoiced, COALESCE(invoice_ref, ''), invoiced_at::timestamp FROM prestations"
+)
+
+def _prestation_filters(provider=None, client=None, task=None, start_date=None, end_date=None, invoiced=None):
+    """Traduit les filtres de l'interface en conditions SQL et paramètres (et la portée de la session)."""
     conditions, params = [], []
-    
+    scope = session_provider()
+    if scope is not None:
+        provider = scope
+
     if provider and provider != "(Tous)":
         conditions.append("provider = %s"); params.append(provider)
     if client and client != "(Tous)":
@@ -175,8 +1014,39 @@ def load_prestations_filtered(provider=None, client=None, task=None, start_date=
         conditions.append("start_at <= %s"); params.append(datetime.combine(end_date, time(23, 59, 59)))
     if invoiced is True: conditions.append("invoiced = true")
     elif invoiced is False: conditions.append("invoiced = false")
+    return conditions, params
+
+def _prestations_dataframe(rows):
+    """Construit le DataFrame colonne par colonne à partir des lignes de PRESTATION_SELECT.
+
+    Les colonnes répétitives (prestataire, client, tâche, référence) sont catégorielles,
+    les montants en float64 et les dates en datetime64.
+    """
+    n = len(rows)
+    cols = list(zip(*rows)) if n else [()] * len(PRESTATION_COLUMNS)
+    ids, providers, clients, tasks, descriptions, starts, ends, hours, rates, totals, invoiced, refs, invoiced_at = cols
+    return pd.DataFrame({
+        "ID": np.fromiter(ids, dtype=np.int64, count=n),
+        "Prestataire": pd.Categorical(providers),
+        "Client": pd.Categorical(clients),
+        "Tâche": pd.Categorical(tasks),
+        "Description": pd.Series(descriptions),
+        "Début": pd.to_datetime(pd.Series(starts, dtype=object)),
+        "Fin": pd.to_datetime(pd.Series(ends, dtype=object)),
+        "Heures": np.array(hours, dtype=np.float64),
+        "Tarif €/h": np.array(rates, dtype=np.float64),
+        "Total €": np.array(totals, dtype=np.float64),
+        "Facturée": np.array(invoiced, dtype=bool),
+        "Réf facture": pd.Categorical(refs),
+        "Date facturation": pd.to_datetime(pd.Series(invoiced_at, dtype=object)),
+    }, columns=PRESTATION_COLUMNS)
 
-    sql = "SELECT id, provider, client, task, description, start_at, end_at, hours, rate, total, invoiced, invoice_ref, invoiced_at FROM prestations"
+@perf.timed("db", cached=True)
+@_cached_query
+def load_prestations_filtered(provider=None, client=None, task=None, start_date=None, end_date=None, invoiced=None):
+    conditions, params = _prestation_filters(provider, client, task, start_date, end_date, invoiced)
+
+    sql = PRESTATION_SELECT
     if conditions: sql += " WHERE " + " AND ".join(conditions)
     sql += " ORDER BY start_at ASC"
 
@@ -185,41 +1055,455 @@ def load_prestations_filtered(provider=None, client=None, task=None, start_date=
             cur.execute(sql, params)
             rows = cur.fetchall()
 
-    data = []
-    for r in rows:
-        data.append({
-            "ID": r[0], "Prestataire": r[1] or "", "Client": r[2], "Tâche": r[3], "Description": r[4] or "",
-            "Début": r[5], "Fin": r[6], "Heures": float(r[7]), "Tarif €/h": float(r[8]), "Total €": float(r[9]),
-            "Facturée": bool(r[10]), "Réf facture": r[11] or "", "Date facturation": r[12],
-        })
-    
-    if not data:
-        return pd.DataFrame(columns=["ID", "Prestataire", "Client", "Tâche", "Description", "Début", "Fin", "Heures", "Tarif €/h", "Total €", "Facturée", "Réf facture", "Date facturation"])
-    return pd.DataFrame(data)
+    return _prestations_dataframe(rows)
 
-def clear_prestations_cache():
-    try: load_prestations_filtered.clear()
+@perf.timed("db", cached=True)
+@_cached_query
+def load_prestations_page(provider=None, client=None, task=None, start_date=None, end_date=None, invoiced=None,
+                          page_size=50, after=None, before=None):
+    """Charge une page de prestations triées par (start_at, id), par pagination « keyset ».
+
+    `after` / `before` sont des curseurs (start_at, id) renvoyés par un appel précédent.
+    Retourne (df, curseur_précédent, curseur_suivant) ; un curseur vaut None
+    lorsqu'il n'y a pas de page dans ce sens.
+    """
+    conditions, params = _prestation_filters(provider, client, task, start_date, end_date, invoiced)
+    backwards = before is not None
+    if backwards:
+        conditions.append("(start_at, id) < (%s, %s)"); params.extend(before)
+    elif after is not None:
+        conditions.append("(start_at, id) > (%s, %s)"); params.extend(after)
+
+    sql = PRESTATION_SELECT
+    if conditions: sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY start_at DESC, id DESC" if backwards else " ORDER BY start_at ASC, id ASC"
+    sql += " LIMIT %s"; params.append(page_size + 1)
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return _prestations_dataframe(rows), None, None
+
+    first, last = (rows[0][5], rows[0][0]), (rows[-1][5], rows[-1][0])
+    if backwards:
+        prev_cursor, next_cursor = (first if has_more else None), last
+    else:
+        prev_cursor, next_cursor = (first if after is not None else None), (last if has_more else None)
+    return _prestations_dataframe(rows), prev_cursor, next_cursor
+
+@perf.timed("db", cached=True)
+@_cached_query
+def summarize_prestations(provider=None, client=None, task=None, start_date=None, end_date=None, invoiced=None):
+    """Nombre de prestations, heures et montant total calculés par la base."""
+    conditions, params = _prestation_filters(provider, client, task, start_date, end_date, invoiced)
+    sql = "SELECT COUNT(*), COALESCE(SUM(hours), 0), COALESCE(SUM(total), 0) FROM prestations"
+    if conditions: sql += " WHERE " + " AND ".join(conditions)
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            count, hours, total = cur.fetchone()
+    return {"count": count, "hours": float(hours), "total": float(total)}
+
+# --- Recherche plein texte ---
+# Sous PostgreSQL : colonne tsvector `search` (configuration french_unaccent) et index
+# trigrammes sur `search_doc`, la description et le client sans accents (migration 8).
+# La syntaxe est celle de websearch_to_tsquery : "expression exacte", -exclu, or.
+DUCKDB_SEARCH_DOCUMENT = "strip_accents(lower(COALESCE(description, '') || ' ' || client))"
+
+def _search_words(query):
+    """Mots de la recherche (sans guillemets ni « or »), avec un indicateur d'exclusion."""
+    words = []
+    for token in query.replace('"', " ").split():
+        negated = token.startswith("-")
+        word = token.lstrip("-")
+        if word and word.lower() != "or":
+            words.append((word, negated))
+    return words
+
+def _fold(text):
+    """Minuscules sans accents, comme search_text() côté PostgreSQL."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
 
-    except: pass
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
-    # --- AJOUTER CETTE NOUVELLE FONCTION DANS database.py ---
+@perf.timed("db")
+def search_prestations(query, filters=None, limit=50):
+    """Prestations dont la description ou le client correspondent à `query`, les plus pertinentes d'abord.
 
+    `filters` reprend les filtres de l'historique (provider, client, task, start_date,
+    end_date, invoiced). Les mots complets passent par l'index plein texte (« audits »
+    trouve « audit »), les mots partiels d'au moins 3 lettres par l'index trigrammes.
+    Retourne au plus `limit` lignes, au format de l'historique.
+    """
+    words = _search_words(query or "")
+    if not words:
+        return _prestations_dataframe([])
+    conditions, params = _prestation_filters(**(filters or {}))
+
+    if dialect() == "duckdb":
+        for word, negated in words:
+            conditions.append(f"{'NOT ' if negated else ''}contains({DUCKDB_SEARCH_DOCUMENT}, %s)")
+            params.append(_fold(word))
+        order = "start_at DESC, id DESC"
+    else:
+        match = "search @@ websearch_to_tsquery('french_unaccent', %s)"
+        match_params = [query]
+        if any(len(word) >= 3 for word, negated in words if not negated):
+            partial = " AND ".join(f"search_doc {'NOT ' if negated else ''}LIKE search_text(%s)" for word, negated in words)
+            match = f"({match} OR ({partial}))"
+            match_params += [f"%{_like_escape(word)}%" for word, negated in words]
+        conditions.insert(0, match)
+        params[:0] = match_params
+        order = "ts_rank(search, websearch_to_tsquery('french_unaccent', %s)) DESC, start_at DESC, id DESC"
+        params.append(query)
+
+    sql = PRESTATION_SELECT + " WHERE " + " AND ".join(conditions) + f" ORDER BY {order} LIMIT %s"
+    params.append(limit)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+    return _prestations_dataframe(rows)
+
+# --- Chevauchements (doubles encodages) ---
+# Sous PostgreSQL, les créneaux sont comparés comme intervalles tsrange [début, fin) pour
+# utiliser l'index GiST (provider, tsrange(start_at, end_at)) de la migration 9.
+OVERLAP_COLUMNS = ["Prestataire", "ID 1", "Client 1", "Début 1", "Fin 1", "ID 2", "Client 2", "Début 2", "Fin 2", "Chevauchement (h)"]
+OVERLAP_SELECT = """
+    SELECT a.provider, a.id, a.client, a.start_at::timestamp, a.end_at::timestamp,
+           b.id, b.client, b.start_at::timestamp, b.end_at::timestamp,
+           round((extract(epoch FROM LEAST(a.end_at, b.end_at) - GREATEST(a.start_at, b.start_at)) / 3600)::numeric, 2)::float8
+"""
+
+@perf.timed("db")
+def find_overlaps(provider, start_dt, end_dt, exclude_id=None):
+    """Prestations du prestataire dont le créneau chevauche [start_dt, end_dt).
+
+    `exclude_id` écarte la prestation en cours de modification. Retourne un DataFrame
+    au format de l'historique, trié par début.
+    """
+    if not provider or end_dt <= start_dt:
+        return _prestations_dataframe([])
+    _check_provider(provider)
+    if dialect() == "duckdb":
+        conditions = ["provider = %s", "end_at > %s", "start_at < %s"]
+    else:
+        conditions = ["provider = %s", "tsrange(start_at, end_at) && tsrange(%s, %s)"]
+    params = [provider, start_dt, end_dt]
+    if exclude_id is not None:
+        conditions.append("id <> %s"); params.append(exclude_id)
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(PRESTATION_SELECT + " WHERE " + " AND ".join(conditions) + " ORDER BY start_at, id", params)
+            rows = cur.fetchall()
+    return _prestations_dataframe(rows)
+
+@perf.timed("db")
+def overlap_report(provider=None, start_date=None, end_date=None, limit=1000):
+    """Toutes les paires de prestations d'un même prestataire qui se chevauchent, en une requête.
+
+    Chaque paire apparaît une fois, la prestation qui commence en premier à gauche ; les
+    filtres portent sur celle-ci. Retourne au plus `limit` paires (DataFrame OVERLAP_COLUMNS).
+    """
+    conditions, params = _prestation_filters(provider=provider, start_date=start_date, end_date=end_date)
+    if dialect() == "duckdb":
+        # Sans index sur intervalles, une jointure par inégalités compare toutes les prestations
+        # d'un prestataire deux à deux. On numérote plutôt ses prestations par début (rn) : celles
+        # qui chevauchent la prestation a sont les suivantes jusqu'à la dernière qui commence
+        # avant sa fin (last_rn, compté sur la suite triée des débuts et des fins).
+        sql = f"""
+            WITH s AS (
+                SELECT id, provider, client, start_at, end_at,
+                       row_number() OVER (PARTITION BY provider ORDER BY start_at, id) AS rn
+                FROM prestations WHERE provider IS NOT NULL
+            ), ends AS (
+                SELECT id, is_start,
+                       sum(is_start) OVER (PARTITION BY provider ORDER BY t, is_start ROWS UNBOUNDED PRECEDING)::bigint AS last_rn
+                FROM (SELECT id, provider, start_at AS t, 1 AS is_start FROM s
+                      UNION ALL SELECT id, provider, end_at, 0 FROM s) events
+            )
+            {OVERLAP_SELECT}
+            FROM (
+                SELECT s.*, unnest(range(s.rn + 1, e.last_rn + 1)) AS other_rn
+                FROM s JOIN ends e ON e.id = s.id AND e.is_start = 0
+                WHERE {' AND '.join(conditions + ['e.last_rn > s.rn'])}
+            ) a
+            JOIN s b ON b.provider = a.provider AND b.rn = a.other_rn
+        """
+    else:
+        conditions.append("provider IS NOT NULL")
+        sql = f"""
+            {OVERLAP_SELECT}
+            FROM (SELECT id, provider, client, start_at, end_at FROM prestations WHERE {' AND '.join(conditions)}) a
+            JOIN prestations b ON b.provider = a.provider
+                AND tsrange(b.start_at, b.end_at) && tsrange(a.start_at, a.end_at)
+                AND (b.start_at > a.start_at OR (b.start_at = a.start_at AND b.id > a.id))
+        """
+    sql += " ORDER BY a.start_at, a.id, b.id LIMIT %s"
+    params.append(limit)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+
+    df = pd.DataFrame(rows, columns=OVERLAP_COLUMNS)
+    for column in ("Début 1", "Fin 1", "Début 2", "Fin 2"):
+        df[column] = pd.to_datetime(df[column])
+    return df
+
+# --- Agrégations (dashboard) ---
+# Sous PostgreSQL, lues dans les cumuls journaliers prestations_daily (tenus à jour par
+# triggers, voir migrations.py) ; sous DuckDB, calculées sur la table prestations.
+AGGREGATE_KEYS = {  # clé -> (expression SQL, libellé de colonne)
+    "client": ("client", "Client"),
+    "task": ("task", "Tâche"),
+    "provider": ("provider", "Prestataire"),
+    "invoiced": ("invoiced", "Facturée"),
+    "day": ("day", "Jour"),
+    "week": ("date_trunc('week', day)::date", "Semaine"),
+    "month": ("date_trunc('month', day)::date", "Mois"),
+}
+DATE_KEYS = ("day", "week", "month")
+DUCKDB_DAILY = (
+    "(SELECT start_at::date AS day, client, task, COALESCE(provider, '') AS provider, invoiced,"
+    " 1 AS lines, hours, total FROM prestations)"
+)
+
+@perf.timed("db", cached=True)
+@_cached_query
+def aggregate_prestations(by=(), provider=None, client=None, task=None, start_date=None, end_date=None, invoiced=None):
+    """Nombre de prestations, heures et montants regroupés selon `by` (clés de AGGREGATE_KEYS).
+
+    Mêmes filtres que l'historique. Retourne un DataFrame trié par clés, une seule
+    ligne si `by` est vide.
+    """
+    unknown = set(by) - set(AGGREGATE_KEYS)
+    if unknown:
+        raise ValueError(f"Regroupement inconnu : {', '.join(sorted(unknown))}")
+
+    conditions, params = ["lines > 0"], []
+    scope = session_provider()
+    if scope is not None:
+        provider = scope
+    for column, value in (("provider", provider), ("client", client), ("task", task)):
+        if value and value != "(Tous)":
+            conditions.append(f"{column} = %s"); params.append(value)
+    if start_date:
+        conditions.append("day >= %s"); params.append(start_date)
+    if end_date:
+        conditions.append("day <= %s"); params.append(end_date)
+    if invoiced is True: conditions.append("invoiced = true")
+    elif invoiced is False: conditions.append("invoiced = false")
+
+    keys = [AGGREGATE_KEYS[key][0] for key in by]
+    source = DUCKDB_DAILY if dialect() == "duckdb" else "prestations_daily"
+    sql = (
+        f"SELECT {''.join(k + ', ' for k in keys)}"
+        "COALESCE(SUM(lines), 0)::bigint, COALESCE(SUM(hours), 0)::float8, COALESCE(SUM(total), 0)::float8"
+        f" FROM {source} d WHERE {' AND '.join(conditions)}"
+    )
+    if keys:
+        positions = ", ".join(str(i) for i in range(1, len(keys) + 1))
+        sql += f" GROUP BY {positions} ORDER BY {positions}"
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+
+    df = pd.DataFrame(rows, columns=[AGGREGATE_KEYS[key][1] for key in by] + ["Prestations", "Heures", "Total €"])
+    for key in by:
+        if key in DATE_KEYS:
+            label = AGGREGATE_KEYS[key][1]
+            df[label] = pd.to_datetime(df[label])
+    return df
+
+# --- Lecture ponctuelle (formulaire d'édition) ---
+# Les écritures de ce processus retirent leurs lignes du cache ; celles des autres processus le
+# vident (notification reçue par sync.py). PRESTATION_CACHE_TTL borne l'écart restant (notification
+# manquée pendant une reconnexion).
+PRESTATION_CACHE_SIZE = 256
+PRESTATION_CACHE_TTL = 60.0
+_prestation_rows = OrderedDict()  # id -> (ligne, instant de lecture)
+_prestation_rows_lock = threading.Lock()
+_prestation_rows_epoch = 0
+
+def _forget_prestations(ids):
+    """Retire du cache ponctuel les prestations modifiées ou supprimées."""
+    global _prestation_rows_epoch
+    with _prestation_rows_lock:
+        _prestation_rows_epoch += 1
+        for pid in ids:
+            _prestation_rows.pop(int(pid), None)
+
+def _forget_all_prestations():
+    """Vide le cache ponctuel (écriture d'un autre processus, d'ID inconnus)."""
+    global _prestation_rows_epoch
+    with _prestation_rows_lock:
+        _prestation_rows_epoch += 1
+        _prestation_rows.clear()
+
+@perf.timed("db", cached=True)
+def load_prestations_by_ids(ids):
+    """Charge uniquement les prestations demandées, dans l'ordre de `ids`."""
+    ids = [int(pid) for pid in ids]
+    found = {}
+    now = monotonic()
+    with _prestation_rows_lock:
+        epoch = _prestation_rows_epoch
+        for pid in ids:
+            if pid in _prestation_rows:
+                row, loaded_at = _prestation_rows[pid]
+                if now - loaded_at > PRESTATION_CACHE_TTL:
+                    del _prestation_rows[pid]
+                    continue
+                _prestation_rows.move_to_end(pid)
+                found[pid] = row
+
+    missing = [pid for pid in dict.fromkeys(ids) if pid not in found]
+    if missing:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(PRESTATION_SELECT + " WHERE id = ANY(%s)", (missing,))
+                rows = cur.fetchall()
+        with _prestation_rows_lock:
+            # Une écriture pendant la lecture rend ces lignes suspectes : on ne les garde pas
+            keep = epoch == _prestation_rows_epoch
+            for r in rows:
+                found[r[0]] = r
+                if keep:
+                    _prestation_rows[r[0]] = (r, now)
+            while len(_prestation_rows) > PRESTATION_CACHE_SIZE:
+                _prestation_rows.popitem(last=False)
+
+    scope = session_provider()
+    return _prestations_dataframe([found[pid] for pid in ids if pid in found and scope in (None, found[pid][1])])
+
+@perf.timed("db", cached=True)
+def load_prestation(id_prestation):
+    """Charge une prestation par son ID (ligne pandas), ou None si elle n'existe pas."""
+    df = load_prestations_by_ids([id_prestation])
+    return None if df.empty else df.iloc[0]
+
+# --- Synchronisation incrémentale (voir sync.py) ---
+# Le filigrane est un couple (version, transactions) : la plus grande version lue, et les
+# transactions encore en cours au moment de la lecture (pg_snapshot_xip). Leurs lignes,
+# invisibles pour cette lecture, peuvent porter des versions plus petites : la lecture
+# suivante les reprend par leur writer_xid (voir migrations.py), quelle que soit leur version.
+def _snapshot_watermark(cur, max_version):
+    """Filigrane de l'instantané courant (à appeler dans la transaction REPEATABLE READ de la lecture)."""
+    if dialect() == "duckdb":  # accès sérialisés par DuckDBStore : rien n'est en cours
+        return max_version, ()
+    cur.execute("SELECT array(SELECT pg_snapshot_xip(pg_current_snapshot())::text);")
+    return max_version, tuple(cur.fetchone()[0])
+
+def _changed_since(watermark):
+    """Condition SQL (et paramètres) des lignes écrites après le filigrane."""
+    version, in_progress = watermark
+    if not in_progress:
+        return "version > %s", [version]
+    return "(version > %s OR writer_xid = ANY(%s::text[]::xid8[]))", [version, list(in_progress)]
+
+@perf.timed("db")
+def load_prestations_snapshot(invoiced=False):
+    """Chargement initial d'un magasin synchronisé : (lignes, filigrane)."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if dialect() == "postgres":  # DuckDB : chaque transaction lit déjà un instantané
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            cur.execute(PRESTATION_SELECT + " WHERE invoiced = %s", (invoiced,))
+            rows = cur.fetchall()
+            cur.execute(
+                "SELECT GREATEST((SELECT COALESCE(MAX(version), 0) FROM prestations),"
+                " (SELECT COALESCE(MAX(version), 0) FROM prestations_tombstones));"
+            )
+            watermark = _snapshot_watermark(cur, cur.fetchone()[0])
+    return rows, watermark
+
+@perf.timed("db")
+def load_prestation_changes(since):
+    """Lignes modifiées et IDs supprimés depuis le filigrane `since` : (lignes, ids, filigrane).
+
+    Les lignes des transactions qui étaient en cours sont relues : certaines peuvent déjà
+    être connues de l'appelant, qui compare avant d'appliquer.
+    """
+    condition, params = _changed_since(since)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if dialect() == "postgres":  # DuckDB : chaque transaction lit déjà un instantané
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            cur.execute(PRESTATION_SELECT.replace(" FROM prestations", ", version FROM prestations")
+                        + f" WHERE {condition} ORDER BY version", params)
+            changed = cur.fetchall()
+            cur.execute(f"SELECT id, version FROM prestations_tombstones WHERE {condition};", params)
+            deleted = cur.fetchall()
+            max_version = max([r[-1] for r in changed] + [v for _, v in deleted] + [since[0]])
+            watermark = _snapshot_watermark(cur, max_version)
+    return [r[:-1] for r in changed], [pid for pid, _ in deleted], watermark
+
+def clear_prestations_cache():
+    """Vide le cache des requêtes et le cache ponctuel (les écritures invalident déjà leurs entrées)."""
+    _get_query_cache().clear()
+    _forget_all_prestations()
+
+def query_cache_stats():
+    """Compteurs du cache des requêtes : hits, misses, évictions, invalidations."""
+    return _get_query_cache().stats()
+
+@perf.timed("db")
 def update_prestation(id_prestation, provider, client, task, description, start_dt, end_dt, rate):
     """Met à jour une prestation existante."""
     # Recalcul des heures et du total
     hours = round((end_dt - start_dt).total_seconds() / 3600, 2)
     total = round(hours * rate, 2)
+    _check_provider(provider)
     
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                UPDATE prestations 
-                SET provider = %s, client = %s, task = %s, description = %s, 
-                    start_at = %s, end_at = %s, hours = %s, rate = %s, total = %s
-                WHERE id = %s
-                """,
-                (provider, client, task, description, start_dt, end_dt, hours, rate, total, id_prestation),
-            )
+            if dialect() == "duckdb":  # RETURNING ne voit pas la table du FROM : ancien client lu avant
+                scope_sql, scope_params = _scope_condition()
+                cur.execute(f"SELECT client FROM prestations WHERE id = %s{scope_sql};", [id_prestation] + scope_params)
+                old = cur.fetchone()
+                cur.execute(
+                    f"""
+                    UPDATE prestations
+                    SET provider = %s, client = %s, task = %s, description = %s,
+                        start_at = %s, end_at = %s, hours = %s, rate = %s, total = %s,
+                        updated_at = now(), version = nextval('prestations_version_seq')
+                    WHERE id = %s{scope_sql}
+                    RETURNING invoiced
+                    """,
+                    [provider, client, task, description, start_dt, end_dt, hours, rate, total, id_prestation] + scope_params,
+                )
+                changes = [(old[0], invoiced) for (invoiced,) in cur.fetchall()]
+            else:
+                scope_sql, scope_params = _scope_condition("old.provider")
+                cur.execute(
+                    f"""
+                    UPDATE prestations p
+                    SET provider = %s, client = %s, task = %s, description = %s, 
+                        start_at = %s, end_at = %s, hours = %s, rate = %s, total = %s,
+                        updated_at = now(), version = nextval('prestations_version_seq')
+                    FROM prestations old
+                    WHERE p.id = old.id AND p.id = %s{scope_sql}
+                    RETURNING old.client, p.invoiced
+                    """,
+                    [provider, client, task, description, start_dt, end_dt, hours, rate, total, id_prestation] + scope_params,
+                )
+                changes = [(old_client, invoiced) for old_client, invoiced in cur.fetchall()]
+            changes += [(client, invoiced) for _, invoiced in changes]
+            _notify_changes(cur, changes)
         conn.commit()
+    _after_write(changes, [id_prestation])
     return hours, total
@@ -0,0 +1,137 @@
+"""Export des prestations en flux depuis Postgres, en CSV ou en Parquet.
+
+Les lignes ne transitent jamais toutes en mémoire : le CSV est produit par
+`COPY (SELECT ...) TO STDOUT` directement dans le fichier cible, le Parquet est
+écrit par blocs lus sur un curseur serveur nommé. Sur la base embarquée DuckDB,
+les deux formats sont écrits par blocs lus avec fetchmany.
+
+    python export.py --year 2025 --format parquet prestations_2025.parquet
+"""
+import argparse
+import csv
+import io
+from datetime import date
+
+import database as db
+
+# (expression SQL, libellé de colonne) : mêmes colonnes que l'historique
+EXPORT_FIELDS = [
+    ("id", "ID"),
+    ("COALESCE(provider, '')", "Prestataire"),
+    ("client", "Client"),
+    ("task", "Tâche"),
+    ("COALESCE(description, '')", "Description"),
+    ("start_at::timestamp", "Début"),
+    ("end_at::timestamp", "Fin"),
+    ("hours::float8", "Heures"),
+    ("rate::float8", "Tarif €/h"),
+    ("total::float8", "Total €"),
+    ("invoiced", "Facturée"),
+    ("COALESCE(invoice_ref, '')", "Réf facture"),
+    ("invoiced_at::timestamp", "Date facturation"),
+]
+YEAR_FIELDS = [("to_char(start_at, 'YYYY-MM')", "Mois")] + EXPORT_FIELDS
+DUCKDB_OVERRIDES = {"Mois": "strftime(start_at, '%%Y-%%m')"}
+
+# En CSV, les booléens sont lisibles plutôt que t/f
+CSV_OVERRIDES = {"Facturée": "CASE WHEN invoiced THEN 'Oui' ELSE 'Non' END"}
+
+CHUNK_ROWS = 50_000
+
+def _export_query(fields, order_by, fmt, **filters):
+    conditions, params = db._prestation_filters(**filters)
+    overrides = dict(CSV_OVERRIDES) if fmt == "csv" else {}
+    if db.dialect() == "duckdb":
+        overrides.update(DUCKDB_OVERRIDES)
+    columns = ", ".join(f'{overrides.get(label, expr)} AS "{label}"' for expr, label in fields)
+    sql = f"SELECT {columns} FROM prestations"
+    if conditions: sql += " WHERE " + " AND ".join(conditions)
+    return sql + f" ORDER BY {order_by}", params
+
+
+def _write_csv(fileobj, sql, params):
+    """Écrit le résultat de la requête en CSV (séparateur ';', BOM UTF-8 pour Excel)."""
+    fileobj.write(b"\xef\xbb\xbf")
+    if db.dialect() == "duckdb":
+        return _write_csv_rows(fileobj, sql, params)
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            query = cur.mogrify(sql, params).decode("utf-8")
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, DELIMITER ';', ENCODING 'UTF8')", fileobj)
+            return cur.rowcount
+
+def _write_csv_rows(fileobj, sql, params, chunk_rows=CHUNK_ROWS):
+    """CSV écrit par blocs, pour les moteurs sans COPY TO STDOUT."""
+    out = io.TextIOWrapper(fileobj, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(out, delimiter=";", lineterminator="\n")
+    count = 0
+    try:
+        with db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                writer.writerow([d[0] for d in cur.description])
+                while rows := cur.fetchmany(chunk_rows):
+                    writer.writerows(rows)
+                    count += len(rows)
+    finally:
+        out.detach()  # le fichier appartient à l'appelant
+    return count
+
+def _parquet_schema(fields):
+    import pyarrow as pa
+
+    types = {
+        "ID": pa.int64(), "Début": pa.timestamp("us"), "Fin": pa.timestamp("us"), "Date facturation": pa.timestamp("us"),
+        "Heures": pa.float64(), "Tarif €/h": pa.float64(), "Total €": pa.float64(), "Facturée": pa.bool_(),
+    }
+    return pa.schema([(label, types.get(label, pa.string())) for _, label in fields])
+
+def _write_parquet(fileobj, sql, params, fields, chunk_rows=CHUNK_ROWS):
+    """Écrit le résultat de la requête en Parquet, un groupe de lignes par bloc lu."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(fields)
+    count = 0
+    with db.get_connection() as conn:
+        with conn.cursor(name="export_prestations") as cur:
+            cur.itersize = chunk_rows
+            cur.execute(sql, params)
+            with pq.ParquetWriter(fileobj, schema, compression="zstd") as writer:
+                while True:
+                    rows = cur.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    columns = list(zip(*rows))
+                    writer.write_table(pa.Table.from_arrays(
+                        [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema
+                    ))
+                    count += len(rows)
+    return count
+
+def export_prestations(fileobj, fmt="csv", **filters):
+    """Exporte les prestations filtrées (mêmes filtres que l'historique) dans `fileobj`. Retourne le nombre de lignes."""
+    sql, params = _export_query(EXPORT_FIELDS, "start_at, id", fmt, **filters)
+    if fmt == "parquet":
+        return _write_parquet(fileobj, sql, params, EXPORT_FIELDS)
+    return _write_csv(fileobj, sql, params)
+
+def export_year(fileobj, year, fmt="csv"):
+    """Export comptable : toutes les prestations de l'année (facturées ou non), par client puis date."""
+    sql, params = _export_query(YEAR_FIELDS, "client, start_at, id", fmt, start_date=date(year, 1, 1), end_date=date(year, 12, 31))
+    if fmt == "parquet":
+        return _write_parquet(fileobj, sql, params, YEAR_FIELDS)
+    return _write_csv(fileobj, sql, params)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export des prestations")
+    parser.add_argument("output")
+    parser.add_argument("--year", type=int, help="Export comptable de l'année complète")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    args = parser.parse_args()
+    with open(args.output, "wb") as out:
+        if args.year:
+            n = export_year(out, args.year, args.format)
+        else:
+            n = export_prestations(out, args.format)
+    print(f"{n} ligne(s) exportée(s) dans {args.output}")
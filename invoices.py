@@ -0,0 +1,328 @@
+"""Génération des factures d'une période : un PDF et un fichier structuré par client.
+
+Les prestations non facturées de la période sont lues en une requête, regroupées
+par client, puis chaque client est rendu dans un processus séparé (PDF, CSV des
+lignes et XML au format UBL simplifié). Les processus de rendu ne touchent pas à
+la base : ils reçoivent les lignes de leur client et écrivent leurs fichiers.
+Chaque fichier est écrit sous un nom temporaire puis renommé, si bien qu'un
+fichier présent dans le dossier est toujours complet.
+
+Les prestations ne sont pas marquées comme facturées : ce sont des brouillons à
+relire avant l'envoi.
+
+Les PDF utilisent DejaVu Sans (dossier fonts/, police TrueType intégrée au fichier) :
+noms et descriptions s'affichent quel que soit l'alphabet (polonais, tchèque, œ, …).
+
+Secrets utilisés : INVOICE_ISSUER (émetteur), INVOICE_VAT_RATE (taux de TVA,
+0.21 par défaut) et INVOICE_DIR (dossier de sortie, « factures » par défaut).
+
+    python invoices.py --from 2025-01-01 --to 2025-01-31 --out factures/2025-01
+"""
+import argparse
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import unicodedata
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import groupby
+from pathlib import Path
+from time import perf_counter
+
+from fpdf import FPDF
+
+DEFAULT_ISSUER = "EJS"
+DEFAULT_VAT_RATE = "0.21"
+DEFAULT_DIR = "factures"
+CENT = Decimal("0.01")
+FONT_DIR = Path(__file__).resolve().parent / "fonts"
+FONT = "DejaVu"
+
+# Colonnes lues pour chaque ligne de facture (même ordre que les tuples des jobs)
+INVOICE_SELECT = (
+    "SELECT client, start_at::timestamp, COALESCE(provider, ''), task, COALESCE(description, ''), hours, rate, total"
+    " FROM prestations"
+)
+LINE_HEADER = ["Date", "Prestataire", "Tâche", "Description", "Heures", "Tarif €/h", "Total €"]
+
+def settings():
+    """Émetteur, taux de TVA et dossier de sortie (secrets, avec valeurs par défaut)."""
+    import streamlit as st
+
+    try:
+        secrets = dict(st.secrets)
+    except FileNotFoundError:  # pas de secrets.toml (scripts)
+        secrets = {}
+    return {
+        "issuer": secrets.get("INVOICE_ISSUER", DEFAULT_ISSUER),
+        "vat_rate": Decimal(str(secrets.get("INVOICE_VAT_RATE", DEFAULT_VAT_RATE))),
+        "out_dir": secrets.get("INVOICE_DIR", DEFAULT_DIR),
+    }
+
+def slugify(name):
+    """Nom de client utilisable dans un nom de fichier."""
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^A-Za-z0-9]+", "-", ascii_name).strip("-").lower() or "client"
+
+def period_label(start, end):
+    return f"{start:%Y%m%d}-{end:%Y%m%d}"
+
+def invoice_reference(job):
+    """Référence (et nom des fichiers) de la facture d'un client pour la période.
+
+    Deux clients peuvent donner le même slug (« Café » et « Cafe », « A&B » et « A-B ») :
+    une empreinte courte du nom exact rend le nom unique, et stable d'un lot à l'autre.
+    """
+    digest = hashlib.sha1(job["client"].encode("utf-8")).hexdigest()[:6]
+    return f"{period_label(job['start'], job['end'])}-{slugify(job['client'])}-{digest}"
+
+# --- Préparation (processus principal) ---
+def load_invoice_jobs(start, end, issuer=DEFAULT_ISSUER, vat_rate=Decimal(DEFAULT_VAT_RATE), clients=None):
+    """Un job par client ayant des prestations non facturées entre `start` et `end` (inclus).
+
+    Un job est un dict sérialisable (client, période, émetteur, TVA, lignes) : il
+    contient tout ce qu'il faut pour rendre les documents sans accès à la base.
+    """
+    import database as db
+
+    conditions, params = db._prestation_filters(start_date=start, end_date=end, invoiced=False)
+    if clients:
+        conditions.append("client IN (" + ", ".join(["%s"] * len(clients)) + ")"); params.extend(clients)
+    sql = INVOICE_SELECT + " WHERE " + " AND ".join(conditions) + " ORDER BY client, start_at, id"
+
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+
+    return [
+        {"client": client, "start": start, "end": end, "issuer": issuer, "vat_rate": vat_rate,
+         "lines": [row[1:] for row in lines]}
+        for client, lines in groupby(rows, key=lambda row: row[0])
+    ]
+
+# --- Rendu (processus de travail) ---
+def _money(value):
+    """1234.5 -> « 1 234,50 »"""
+    return f"{value:,.2f}".replace(",", " ").replace(".", ",")
+
+def _totals(job):
+    hours = sum((Decimal(line[4]) for line in job["lines"]), Decimal(0))
+    net = sum((Decimal(line[6]) for line in job["lines"]), Decimal(0)).quantize(CENT, ROUND_HALF_UP)
+    vat = (net * job["vat_rate"]).quantize(CENT, ROUND_HALF_UP)
+    return hours, net, vat, net + vat
+
+def _atomic_write(path, data):
+    """Écrit `data` (bytes) dans un fichier temporaire du même dossier, puis le renomme en `path`."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)  # mkstemp crée le fichier en 0600
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def render_pdf(job, reference, totals):
+    hours, net, vat, gross = totals
+    pdf = FPDF(format="A4")
+    pdf.add_font(FONT, "", FONT_DIR / "DejaVuSans.ttf")  # Unicode : les polices de base s'arrêtent à cp1252
+    pdf.add_font(FONT, "B", FONT_DIR / "DejaVuSans-Bold.ttf")
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+
+    pdf.set_font(FONT, "B", 16)
+    pdf.cell(0, 8, job["issuer"], new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(FONT, "", 10)
+    pdf.cell(0, 6, f"Facture {reference} (brouillon)", new_x="LMARGIN", new_y="NEXT")
+    pdf.cell(0, 6, f"Période du {job['start']:%d/%m/%Y} au {job['end']:%d/%m/%Y}", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(4)
+    pdf.set_font(FONT, "B", 12)
+    pdf.cell(0, 7, f"Client : {job['client']}", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(3)
+
+    widths = (20, 32, 28, 55, 15, 18, 22)
+    aligns = ("L", "L", "L", "L", "R", "R", "R")
+    pdf.set_font(FONT, "B", 8)
+    for width, label, align in zip(widths, LINE_HEADER, aligns):
+        pdf.cell(width, 6, label, border="B", align=align)
+    pdf.ln()
+    pdf.set_font(FONT, "", 8)
+    for start_at, provider, task, description, line_hours, rate, total in job["lines"]:
+        values = (f"{start_at:%d/%m/%Y}", provider, task, description,
+                  _money(line_hours), _money(rate), _money(total))
+        for width, value, align in zip(widths, values, aligns):
+            # Texte tronqué à la largeur de la colonne
+            while value and pdf.get_string_width(value) > width - 1:
+                value = value[:-1]
+            pdf.cell(width, 5, value, align=align)
+        pdf.ln()
+
+    pdf.ln(4)
+    pdf.set_font(FONT, "", 10)
+    label_width = sum(widths) - 35
+    for label, value in (("Heures", _money(hours)), ("Total HTVA", f"{_money(net)} €"),
+                         (f"TVA {job['vat_rate'] * 100:g} %", f"{_money(vat)} €")):
+        pdf.cell(label_width, 6, label, align="R")
+        pdf.cell(35, 6, value, align="R", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(FONT, "B", 11)
+    pdf.cell(label_width, 7, "Total TVAC", align="R")
+    pdf.cell(35, 7, f"{_money(gross)} €", align="R", new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+def render_csv(job):
+    """Lignes de la facture (séparateur ';', BOM UTF-8 pour Excel)."""
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=";", lineterminator="\n")
+    writer.writerow(LINE_HEADER)
+    for start_at, provider, task, description, hours, rate, total in job["lines"]:
+        writer.writerow([f"{start_at:%Y-%m-%d %H:%M}", provider, task, description, hours, rate, total])
+    return b"\xef\xbb\xbf" + out.getvalue().encode("utf-8")
+
+UBL_NS = {
+    "": "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2",
+    "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+    "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+}
+
+def _ubl(parent, tag, text=None, **attrs):
+    prefix, _, name = tag.rpartition(":")
+    element = ET.SubElement(parent, f"{{{UBL_NS[prefix]}}}{name}", attrs)
+    if text is not None:
+        element.text = str(text)
+    return element
+
+def render_ubl(job, reference, totals):
+    """Facture structurée au format UBL 2.1 simplifié (en-tête, parties, lignes, totaux)."""
+    hours, net, vat, gross = totals
+    for prefix, uri in UBL_NS.items():
+        ET.register_namespace(prefix, uri)
+    root = ET.Element(f"{{{UBL_NS['']}}}Invoice")
+    _ubl(root, "cbc:ID", reference)
+    _ubl(root, "cbc:IssueDate", date.today().isoformat())
+    _ubl(root, "cbc:DocumentCurrencyCode", "EUR")
+    invoice_period = _ubl(root, "cac:InvoicePeriod")
+    _ubl(invoice_period, "cbc:StartDate", job["start"].isoformat())
+    _ubl(invoice_period, "cbc:EndDate", job["end"].isoformat())
+    for role, name in (("AccountingSupplierParty", job["issuer"]), ("AccountingCustomerParty", job["client"])):
+        party = _ubl(_ubl(root, f"cac:{role}"), "cac:Party")
+        _ubl(_ubl(party, "cac:PartyName"), "cbc:Name", name)
+
+    tax_total = _ubl(root, "cac:TaxTotal")
+    _ubl(tax_total, "cbc:TaxAmount", vat, currencyID="EUR")
+    totals_el = _ubl(root, "cac:LegalMonetaryTotal")
+    _ubl(totals_el, "cbc:LineExtensionAmount", net, currencyID="EUR")
+    _ubl(totals_el, "cbc:TaxExclusiveAmount", net, currencyID="EUR")
+    _ubl(totals_el, "cbc:TaxInclusiveAmount", gross, currencyID="EUR")
+    _ubl(totals_el, "cbc:PayableAmount", gross, currencyID="EUR")
+
+    for number, (start_at, provider, task, description, line_hours, rate, total) in enumerate(job["lines"], 1):
+        line = _ubl(root, "cac:InvoiceLine")
+        _ubl(line, "cbc:ID", number)
+        _ubl(line, "cbc:InvoicedQuantity", line_hours, unitCode="HUR")
+        _ubl(line, "cbc:LineExtensionAmount", total, currencyID="EUR")
+        item = _ubl(line, "cac:Item")
+        _ubl(item, "cbc:Description", f"{start_at:%Y-%m-%d} {provider} – {description}".strip(" –"))
+        _ubl(item, "cbc:Name", task)
+        _ubl(_ubl(line, "cac:Price"), "cbc:PriceAmount", rate, currencyID="EUR")
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+
+def render_invoice(job, out_dir):
+    """Rend et écrit les documents d'un client. Retourne le résumé (client, montants, fichiers)."""
+    reference = invoice_reference(job)
+    totals = _totals(job)
+    documents = {
+        ".pdf": render_pdf(job, reference, totals),
+        ".csv": render_csv(job),
+        ".xml": render_ubl(job, reference, totals),
+    }
+    files = []
+    for suffix, data in documents.items():
+        path = os.path.join(out_dir, reference + suffix)
+        _atomic_write(path, data)
+        files.append(path)
+    hours, net, vat, gross = totals
+    return {"client": job["client"], "lines": len(job["lines"]), "hours": float(hours),
+            "net": float(net), "vat": float(vat), "gross": float(gross), "files": files, "error": None}
+
+# --- Orchestration ---
+def generate_invoices(start, end, out_dir=None, workers=None, progress=None, clients=None):
+    """Génère les factures de la période, un client par tâche dans un pool de processus.
+
+    `progress(terminés, total, résultat)` est appelé à chaque client terminé. Un
+    client en erreur n'interrompt pas le lot : son résultat porte le message dans
+    "error". Retourne (résultats triés par client, durée en secondes).
+    """
+    t0 = perf_counter()
+    config = settings()
+    out_dir = out_dir or os.path.join(config["out_dir"], period_label(start, end))
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = load_invoice_jobs(start, end, config["issuer"], config["vat_rate"], clients)
+    total = len(jobs)
+    workers = min(workers or os.cpu_count() or 1, total)
+    results = []
+
+    def done(result):
+        results.append(result)
+        if progress:
+            progress(len(results), total, result)
+
+    def failed(job, exc):
+        return {"client": job["client"], "lines": len(job["lines"]), "hours": None, "net": None, "vat": None,
+                "gross": None, "files": [], "error": f"{type(exc).__name__}: {exc}"}
+
+    if workers <= 1:
+        for job in jobs:
+            try:
+                done(render_invoice(job, out_dir))
+            except Exception as exc:
+                done(failed(job, exc))
+    else:
+        # "spawn" : le processus Streamlit a des threads (pool, synchronisation), fork n'est pas sûr
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # Les plus gros clients d'abord, pour ne pas finir le lot sur un seul processus
+            futures = {pool.submit(render_invoice, job, out_dir): job
+                       for job in sorted(jobs, key=lambda j: len(j["lines"]), reverse=True)}
+            for future in as_completed(futures):
+                try:
+                    done(future.result())
+                except Exception as exc:
+                    done(failed(futures[future], exc))
+
+    results.sort(key=lambda r: r["client"])
+    return results, perf_counter() - t0
+
+def zip_invoices(fileobj, results):
+    """Archive zip de tous les documents générés (pour un téléchargement unique)."""
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            for path in result["files"]:
+                archive.write(path, os.path.basename(path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Génération des factures d'une période")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, required=True)
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, required=True)
+    parser.add_argument("--out", help="Dossier de sortie (défaut : INVOICE_DIR/<période>)")
+    parser.add_argument("--workers", type=int, help="Nombre de processus (défaut : nombre de cœurs)")
+    parser.add_argument("--client", action="append", dest="clients", help="Limiter à ce client (répétable)")
+    args = parser.parse_args()
+
+    def report(n, total, result):
+        status = result["error"] or f"{result['lines']} ligne(s), {result['gross']:.2f} € TVAC"
+        print(f"  [{n}/{total}] {result['client']} : {status}", flush=True)
+
+    results, seconds = generate_invoices(args.start, args.end, args.out, args.workers, report, args.clients)
+    errors = sum(1 for r in results if r["error"])
+    print(f"{len(results)} facture(s) générée(s) en {seconds:.1f} s" + (f", {errors} en erreur" if errors else ""))
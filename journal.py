@@ -0,0 +1,257 @@
+"""Journal local des saisies (enregistrement différé, mode mobile).
+
+Sur une connexion lente ou coupée, chaque enregistrement attend la base (connexion,
+TLS, insertion, commit) et échoue si le lien tombe. En enregistrement différé, la
+saisie est écrite dans un fichier SQLite local (commit durable de quelques
+millisecondes) et l'écran répond aussitôt. Un thread envoie ensuite les saisies par
+lots (database.insert_journal_entries), avec une attente croissante tant que la base
+est injoignable ; ce qui reste dans le fichier est renvoyé au redémarrage.
+
+Chaque saisie reçoit ici un UUID (colonne prestations.client_uuid, unique) : un lot
+renvoyé parce que la confirmation s'est perdue n'est inséré qu'une fois. Une saisie
+que la base refuse (donnée invalide) est mise de côté avec son erreur, dans la table
+`rejected`, pour ne pas bloquer les suivantes ; elle est signalée à l'écran.
+
+Secrets : JOURNAL_PATH (défaut "pointage_journal.sqlite") et WRITE_BEHIND (valeur
+par défaut de l'option « Enregistrement différé » du mode mobile).
+
+    python journal.py           # liste les saisies en attente et celles refusées
+    python journal.py --flush   # les envoie maintenant
+"""
+import argparse
+import logging
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import streamlit as st
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = "pointage_journal.sqlite"
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 5.0
+MAX_BACKOFF = 60.0
+
+ENTRY_FIELDS = ["seq", "client_uuid", "provider", "client", "task", "description", "start_at", "end_at",
+                "hours", "rate", "total", "timer_started_at", "recorded_at", "attempts", "last_error"]
+DATETIME_FIELDS = ("start_at", "end_at", "timer_started_at", "recorded_at")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- ordre d'envoi, jamais réutilisé
+        client_uuid TEXT NOT NULL UNIQUE,
+        provider TEXT,
+        client TEXT NOT NULL,
+        task TEXT NOT NULL,
+        description TEXT,
+        start_at TEXT NOT NULL,
+        end_at TEXT NOT NULL,
+        hours REAL NOT NULL,
+        rate REAL NOT NULL,
+        total REAL NOT NULL,
+        timer_started_at TEXT,  -- saisie issue d'un timer : il est supprimé à l'envoi
+        recorded_at TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT
+    );
+    -- Saisies refusées par la base (last_error) : retirées de la file, à ressaisir
+    CREATE TABLE IF NOT EXISTS rejected AS SELECT *, NULL AS rejected_at FROM entries WHERE 0;
+"""
+
+class Journal:
+    """File durable des saisies à envoyer, partagée par les sessions du processus."""
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.wake = threading.Event()  # signalé à chaque saisie : envoi immédiat
+        self.last_flush = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._con.execute("PRAGMA journal_mode = WAL;")
+        self._con.execute("PRAGMA synchronous = FULL;")  # la saisie survit à une coupure de courant
+        self._con.executescript(SCHEMA)
+
+    def record(self, provider, client, task, description, start_dt, end_dt, rate, timer_started_at=None):
+        """Écrit une saisie dans le journal et retourne (heures, total), comme database.insert_prestation."""
+        db._check_provider(provider)
+        hours = round((end_dt - start_dt).total_seconds() / 3600, 2)
+        total = round(hours * rate, 2)
+        with self._lock:
+            self._con.execute(
+                "INSERT INTO entries (client_uuid, provider, client, task, description, start_at, end_at, hours, rate, total,"
+                " timer_started_at, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                (str(uuid.uuid4()), provider, client, task, description, start_dt.isoformat(), end_dt.isoformat(),
+                 hours, float(rate), total, timer_started_at.isoformat() if timer_started_at else None,
+                 datetime.now().isoformat(timespec="seconds")),
+            )
+        self.wake.set()
+        return hours, total
+
+    def entries(self, provider=None, limit=None, rejected=False):
+        """Saisies en attente (dicts), les plus anciennes d'abord ; ou celles refusées par la base."""
+        sql = f"SELECT {', '.join(ENTRY_FIELDS)} FROM {'rejected' if rejected else 'entries'}"
+        params = []
+        if provider is not None:
+            sql += " WHERE provider = ?"
+            params.append(provider)
+        sql += " ORDER BY seq"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._con.execute(sql, params).fetchall()
+        entries = [dict(zip(ENTRY_FIELDS, row)) for row in rows]
+        for e in entries:
+            for field in DATETIME_FIELDS:
+                if e[field] is not None:
+                    e[field] = datetime.fromisoformat(e[field])
+        return entries
+
+    def pending(self, provider=None, rejected=False):
+        """Nombre de saisies en attente (d'un prestataire), ou refusées par la base."""
+        sql, params = f"SELECT count(*) FROM {'rejected' if rejected else 'entries'}", ()
+        if provider is not None:
+            sql, params = sql + " WHERE provider = ?", (provider,)
+        with self._lock:
+            return self._con.execute(sql, params).fetchone()[0]
+
+    def pending_timer_stops(self):
+        """Timers arrêtés dont l'enregistrement n'est pas encore envoyé : {(prestataire, début)}."""
+        with self._lock:
+            rows = self._con.execute("SELECT provider, timer_started_at FROM entries WHERE timer_started_at IS NOT NULL;").fetchall()
+        return {(provider, datetime.fromisoformat(started_at)) for provider, started_at in rows}
+
+    def flush(self):
+        """Envoie toutes les saisies en attente, par lots. Retourne le nombre de prestations insérées.
+
+        Un lot n'est retiré du journal qu'après le commit côté base ; en cas d'échec il reste
+        en tête de file (essais et dernière erreur notés) et l'exception est propagée. Si la
+        base refuse le lot pour une donnée invalide, il est renvoyé saisie par saisie et
+        celles qui échouent encore sont mises de côté (table `rejected`).
+        """
+        with self._flush_lock:
+            inserted = 0
+            while batch := self.entries(limit=self.batch_size):
+                try:
+                    inserted += db.insert_journal_entries(batch)
+                except db.rejected_entry_errors():
+                    inserted += self._send_one_by_one(batch)
+                except Exception as e:
+                    self._failed(batch, e)
+                    raise
+                else:
+                    with self._lock:
+                        self._con.executemany("DELETE FROM entries WHERE seq = ?;", [(e["seq"],) for e in batch])
+                self.last_error = None
+                self.last_flush = datetime.now()
+            return inserted
+
+    def _send_one_by_one(self, batch):
+        """Renvoie un lot refusé saisie par saisie ; les saisies refusées sont mises de côté."""
+        inserted = 0
+        for entry in batch:
+            try:
+                inserted += db.insert_journal_entries([entry])
+            except db.rejected_entry_errors() as e:
+                self._failed([entry], e)
+                logger.warning("Saisie %s refusée par la base, mise de côté : %s", entry["client_uuid"], e)
+                with self._lock, self._con:  # déplacement atomique (rollback en cas d'erreur)
+                    self._con.execute("BEGIN;")
+                    self._con.execute("INSERT INTO rejected SELECT *, ? FROM entries WHERE seq = ?;",
+                                      (datetime.now().isoformat(timespec="seconds"), entry["seq"]))
+                    self._con.execute("DELETE FROM entries WHERE seq = ?;", (entry["seq"],))
+                continue
+            except Exception as e:
+                self._failed([entry], e)
+                raise
+            with self._lock:
+                self._con.execute("DELETE FROM entries WHERE seq = ?;", (entry["seq"],))
+        return inserted
+
+    def _failed(self, batch, error):
+        """Note l'essai et l'erreur sur les saisies du lot."""
+        self.last_error = f"{type(error).__name__}: {error}".strip()
+        with self._lock:
+            self._con.executemany("UPDATE entries SET attempts = attempts + 1, last_error = ? WHERE seq = ?;",
+                                  [(self.last_error, e["seq"]) for e in batch])
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+class JournalFlusher(threading.Thread):
+    """Envoie le journal à chaque nouvelle saisie et toutes les `interval` secondes.
+
+    Tant que la base est injoignable, l'attente entre deux essais double, jusqu'à MAX_BACKOFF.
+    """
+
+    def __init__(self, journal, interval=FLUSH_INTERVAL):
+        super().__init__(name="journal-flusher", daemon=True)
+        self.journal = journal
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.journal.wake.set()
+
+    def run(self):
+        delay = 0.0  # saisies laissées par l'exécution précédente : envoi dès le démarrage
+        while True:
+            self.journal.wake.wait(delay)
+            self.journal.wake.clear()
+            if self._stop_event.is_set():
+                return
+            try:
+                sent = self.journal.flush()
+                if sent:
+                    logger.info("%d saisie(s) différée(s) envoyée(s)", sent)
+                delay = self.interval
+            except Exception:
+                delay = min(max(delay, self.interval) * 2, MAX_BACKOFF)
+                logger.warning("Envoi du journal en échec, nouvel essai dans %.0f s", delay, exc_info=True)
+
+def journal_path():
+    return st.secrets.get("JOURNAL_PATH", DEFAULT_PATH)
+
+@st.cache_resource(show_spinner=False)
+def get_journal():
+    """Journal du processus, avec son thread d'envoi démarré."""
+    journal = Journal(journal_path())
+    JournalFlusher(journal).start()
+    return journal
+
+def resume():
+    """Relance l'envoi des saisies laissées dans le journal par une exécution précédente."""
+    if Path(journal_path()).exists():
+        get_journal()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Saisies différées en attente d'envoi")
+    parser.add_argument("--flush", action="store_true", help="Envoie les saisies maintenant")
+    args = parser.parse_args()
+    local = Journal(journal_path())
+
+    def show(e):
+        print(f"{e['recorded_at']:%d/%m %H:%M} {e['provider']} — {e['client']} — {e['task']} : "
+              f"{e['start_at']:%d/%m/%Y %H:%M} → {e['end_at']:%H:%M} ({e['hours']} h)"
+              + (f" [{e['attempts']} essai(s) : {e['last_error']}]" if e["attempts"] else ""))
+
+    for e in local.entries():
+        show(e)
+    if args.flush:
+        print(f"{local.flush()} prestation(s) insérée(s).")
+    print(f"{local.pending()} saisie(s) en attente.")
+    if local.pending(rejected=True):
+        print("Refusées par la base (à ressaisir) :")
+        for e in local.entries(rejected=True):
+            show(e)
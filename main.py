@@ -1,14 +1,82 @@
+import sys
+from time import perf_counter
+
 import streamlit as st
 from pathlib import Path
 
-# Import des modules que nous venons de créer
-import database as db
-import auth
-import views
+# Les modules de l'application (pandas, psycopg2, duckdb) ne sont importés qu'après
+# l'affichage de l'en-tête, dans main() et bootstrap() : le navigateur reçoit la page
+# avant leur chargement. Au premier passage du processus, leur durée est notée pour le
+# profil de démarrage ; ensuite, ils sont déjà en mémoire.
+_COLD_START = "views" not in sys.modules
 
 LOGO_PATH = "logo_ejs.png"
 
+# Secret NAVIGATION : "pages" (seule la page affichée s'exécute) ou "tabs" (ancien
+# affichage en onglets, toutes les vues s'exécutent à chaque interaction). Les deux
+# modes sont mesurés séparément dans Admin > Performance (rerun:pages / rerun:tabs).
+NAVIGATION = "pages"
+
+@st.cache_resource(show_spinner=False)
+def bootstrap():
+    """Travaux de démarrage, une fois par processus serveur (et non par session).
+
+    Met le schéma à jour, crée les tâches par défaut, relance l'envoi des saisies
+    différées laissées par l'exécution précédente et démarre l'écoute des écritures des
+    autres processus (invalidation des caches, voir sync.py).
+    """
+    import database as db
+    import journal
+    import migrations
+    import perf
+    import sync
+
+    t0 = perf_counter()
+    applied = migrations.apply_migrations()
+    db.ensure_default_tasks()
+    journal.resume()
+    sync.start_listener()
+    perf.record_startup("bootstrap", (perf_counter() - t0) * 1000)
+    return applied
+
+# Facturation et administration sont réservées aux comptes « admin » : les autres ne
+# voient pas ces pages (et database.py refuse leurs écritures).
+def _pages(mobile_mode, admin):
+    import views
+
+    if mobile_mode:
+        return [
+            st.Page(views.ui_timer, title="Timer", icon="⏱️", url_path="timer", default=True),
+            st.Page(views.ui_manual_entry, title="Saisie", icon="📝", url_path="saisie"),
+            *([st.Page(views.ui_facturation, title="Factures", icon="💶", url_path="facturation")] if admin else []),
+            st.Page(views.ui_historique, title="Historique", icon="📚", url_path="historique"),
+        ]
+    return [
+        st.Page(views.ui_saisie, title="Saisie", icon="📝", url_path="saisie", default=True),
+        st.Page(views.ui_historique, title="Historique", icon="📚", url_path="historique"),
+        st.Page(views.ui_dashboard, title="Dashboard", icon="📊", url_path="dashboard"),
+        *([st.Page(views.ui_facturation, title="Facturation", icon="💶", url_path="facturation"),
+           st.Page(views.ui_gestion, title="Admin", icon="⚙️", url_path="admin")] if admin else []),
+    ]
+
+def _tabs_layout(admin):
+    """Ancien affichage : toutes les vues s'exécutent, même dans les onglets masqués."""
+    import views
+
+    titles = ["Saisie", "Historique", "Dashboard"] + (["Facturation", "Admin"] if admin else [])
+    tabs = st.tabs(titles)
+    with tabs[0]:
+        st1, st2 = st.tabs(["Manuel", "Timer"])
+        with st1: views.ui_manual_entry()
+        with st2: views.ui_timer()
+    with tabs[1]: views.ui_historique()
+    with tabs[2]: views.ui_dashboard()
+    if admin:
+        with tabs[3]: views.ui_facturation()
+        with tabs[4]: views.ui_gestion()
+
 def main():
+    t0 = perf_counter()
     st.set_page_config(page_title="EJS – Pointage", page_icon=LOGO_PATH, layout="wide")
 
     # Header
@@ -19,34 +87,52 @@ def main():
     with col_title:
         st.title("EJS – Pointage des heures")
 
+    t_imports = perf_counter()
+    import auth
+    import perf
+    import views
+    if _COLD_START:
+        perf.record_startup("imports", (perf_counter() - t_imports) * 1000)
+
+    # Initialisation DB (la table des comptes en fait partie)
+    bootstrap()
+
     # Sécurité
     if not auth.check_password():
         return
 
-    # Initialisation DB
-    if "defaults_done" not in st.session_state:
-        db.ensure_default_tasks()
-        st.session_state["defaults_done"] = True
-
     # Navigation
+    user = auth.current_user()
+    admin = auth.is_admin()
+    st.sidebar.caption(f"👤 {user['username']}" + (f" — {user['provider']}" if user["provider"] else ""))
+    st.sidebar.button("Se déconnecter", on_click=auth.logout)
     mobile_mode = st.sidebar.checkbox("Mode mobile", value=False)
+    # Enregistrement différé : les saisies vont dans un journal local (journal.py), envoyé en arrière-plan
+    if mobile_mode and st.sidebar.toggle("Enregistrement différé", value=st.secrets.get("WRITE_BEHIND", False), key="write_behind",
+                                         help="Enregistre sans attendre la base : utile sur une connexion lente ou instable."):
+        with st.sidebar:
+            views.ui_journal_status()
+    mode = st.secrets.get("NAVIGATION", NAVIGATION)
 
-    if mobile_mode:
-        page = st.sidebar.radio("Menu", ["Timer", "Saisie", "Factures", "Historique"])
-        if page == "Timer": views.ui_timer()
-        elif page == "Saisie": views.ui_manual_entry()
-        elif page == "Factures": views.ui_facturation()
-        elif page == "Historique": views.ui_historique()
-    else:
-        t1, t2, t3, t4, t5 = st.tabs(["Saisie", "Historique", "Dashboard", "Facturation", "Admin"])
-        with t1:
-            st1, st2 = st.tabs(["Manuel", "Timer"])
-            with st1: views.ui_manual_entry()
-            with st2: views.ui_timer()
-        with t2: views.ui_historique()
-        with t3: views.ui_dashboard()
-        with t4: views.ui_facturation()
-        with t5: views.ui_gestion()
+    with perf.span("rerun", f"rerun:{mode}") as rerun:
+        if mode == "tabs" and not mobile_mode:
+            _tabs_layout(admin)
+        else:
+            st.navigation(_pages(mobile_mode, admin), position="sidebar" if mobile_mode else "top").run()
+
+    if st.secrets.get("PERF_SHOW_RERUN", False):
+        st.sidebar.caption(f"Cette exécution : {rerun.calls} appel(s) DB, {rerun.queries} requête(s), {rerun.attributes['ms']:.0f} ms")
+
+    # Premier affichage complet de la session (après connexion), du début du script à la fin de la page
+    if "first_render_ms" not in st.session_state:
+        st.session_state.first_render_ms = (perf_counter() - t0) * 1000
+        perf.record_startup("first_render", st.session_state.first_render_ms)
+    if st.secrets.get("PROFILE_STARTUP", False):
+        startup = perf.startup_times()
+        st.sidebar.caption(
+            f"Démarrage du serveur : imports {startup.get('imports', 0):.0f} ms, bootstrap {startup.get('bootstrap', 0):.0f} ms"
+            f" — premier affichage de la session : {st.session_state.first_render_ms:.0f} ms"
+        )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
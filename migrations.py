@@ -0,0 +1,466 @@
+"""Schéma de la base, versionné.
+
+Chaque migration est appliquée une seule fois (table `schema_migrations`), sous un
+verrou consultatif pour que deux processus qui démarrent ensemble ne se gênent pas.
+Les instructions sont idempotentes (IF NOT EXISTS) : une base créée à la main
+avant ce module est reprise telle quelle. La base embarquée DuckDB (storage.py) a
+sa propre suite, mêmes numéros de version.
+
+    python migrations.py           # applique les migrations en attente
+    python migrations.py --check   # vérifie (EXPLAIN ANALYZE) que chaque combinaison de filtres utilise un index
+"""
+import argparse
+import itertools
+import json
+import sys
+from datetime import date
+
+import database as db
+
+MIGRATIONS_LOCK_ID = 7_401_202  # clé de pg_advisory_xact_lock
+
+MIGRATIONS = [
+    (1, "Schéma initial", """
+        CREATE TABLE IF NOT EXISTS clients (
+            id serial PRIMARY KEY,
+            name text NOT NULL UNIQUE,
+            active boolean NOT NULL DEFAULT true
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            id serial PRIMARY KEY,
+            name text NOT NULL UNIQUE,
+            rate numeric(10, 2) NOT NULL,
+            active boolean NOT NULL DEFAULT true
+        );
+        CREATE TABLE IF NOT EXISTS providers (
+            id serial PRIMARY KEY,
+            name text NOT NULL UNIQUE,
+            active boolean NOT NULL DEFAULT true
+        );
+        CREATE TABLE IF NOT EXISTS prestations (
+            id serial PRIMARY KEY,
+            provider text,
+            client text NOT NULL,
+            task text NOT NULL,
+            description text,
+            start_at timestamp NOT NULL,
+            end_at timestamp NOT NULL,
+            hours numeric(10, 2) NOT NULL,
+            rate numeric(10, 2) NOT NULL,
+            total numeric(12, 2) NOT NULL,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            invoiced boolean NOT NULL DEFAULT false,
+            invoiced_at timestamptz,
+            invoice_ref text
+        );
+    """),
+    (2, "Versions et suppressions pour la synchronisation", """
+        CREATE SEQUENCE IF NOT EXISTS prestations_version_seq;
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS version bigint NOT NULL DEFAULT nextval('prestations_version_seq');
+        CREATE INDEX IF NOT EXISTS prestations_version_idx ON prestations (version);
+        CREATE TABLE IF NOT EXISTS prestations_tombstones (
+            id integer PRIMARY KEY,
+            client text,
+            invoiced boolean,
+            version bigint NOT NULL DEFAULT nextval('prestations_version_seq'),
+            deleted_at timestamptz NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS prestations_tombstones_version_idx ON prestations_tombstones (version);
+    """),
+    (3, "Index des filtres de l'historique et de la facturation", """
+        -- Tri et pagination (start_at, id), avec ou sans archives
+        CREATE INDEX IF NOT EXISTS prestations_start_idx ON prestations (start_at, id);
+        CREATE INDEX IF NOT EXISTS prestations_open_start_idx ON prestations (start_at, id) WHERE NOT invoiced;
+        -- Facturation : client = ? AND invoiced = false
+        CREATE INDEX IF NOT EXISTS prestations_open_client_idx ON prestations (client, start_at, id) WHERE NOT invoiced;
+        -- Filtres par client, prestataire ou tâche, triés par date
+        CREATE INDEX IF NOT EXISTS prestations_client_start_idx ON prestations (client, start_at, id);
+        CREATE INDEX IF NOT EXISTS prestations_provider_start_idx ON prestations (provider, start_at, id);
+        CREATE INDEX IF NOT EXISTS prestations_task_start_idx ON prestations (task, start_at, id);
+        ANALYZE prestations;
+    """),
+    (4, "Timers en cours, un par prestataire", """
+        CREATE TABLE IF NOT EXISTS timers (
+            provider text PRIMARY KEY,
+            client text NOT NULL,
+            task text NOT NULL,
+            description text,
+            rate numeric(10, 2) NOT NULL,
+            started_at timestamp NOT NULL
+        );
+    """),
+    (5, "Version du catalogue (référentiels)", """
+        CREATE TABLE IF NOT EXISTS catalog_state (
+            id integer PRIMARY KEY CHECK (id = 1),
+            version bigint NOT NULL
+        );
+        INSERT INTO catalog_state (id, version) VALUES (1, 1) ON CONFLICT (id) DO NOTHING;
+        CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+        CREATE OR REPLACE TRIGGER clients_catalog_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON clients
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+        CREATE OR REPLACE TRIGGER tasks_catalog_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tasks
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+        CREATE OR REPLACE TRIGGER providers_catalog_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON providers
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+    """),
+    (6, "Numéros de facture", "CREATE SEQUENCE IF NOT EXISTS invoice_number_seq;"),
+    (7, "Cumuls journaliers pour le dashboard", """
+        CREATE TABLE IF NOT EXISTS prestations_daily (
+            day date NOT NULL,
+            client text NOT NULL,
+            task text NOT NULL,
+            provider text NOT NULL,  -- '' sans prestataire
+            invoiced boolean NOT NULL,
+            lines integer NOT NULL,  -- 0 une fois toutes les prestations du jour supprimées
+            hours numeric(14, 2) NOT NULL,
+            total numeric(16, 2) NOT NULL,
+            PRIMARY KEY (day, client, task, provider, invoiced)
+        );
+        -- Triggers par instruction avec tables de transition : un import ou une facturation de
+        -- 100k lignes applique des deltas déjà regroupés par jour, pas 100k mises à jour.
+        CREATE OR REPLACE FUNCTION prestations_daily_apply() RETURNS trigger AS $$
+        DECLARE
+            delta text;
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                TRUNCATE prestations_daily;
+                RETURN NULL;
+            END IF;
+            -- Lignes à ajouter (sign = 1) et à retirer (sign = -1) des cumuls
+            delta := CASE TG_OP
+                WHEN 'INSERT' THEN $q$SELECT n.*, 1 AS sign FROM new_rows n$q$
+                WHEN 'DELETE' THEN $q$SELECT o.*, -1 AS sign FROM old_rows o$q$
+                ELSE $q$
+                    SELECT n.*, 1 AS sign FROM new_rows n JOIN old_rows o ON o.id = n.id
+                    WHERE (n.start_at::date, n.client, n.task, n.provider, n.invoiced, n.hours, n.total)
+                          IS DISTINCT FROM (o.start_at::date, o.client, o.task, o.provider, o.invoiced, o.hours, o.total)
+                    UNION ALL
+                    SELECT o.*, -1 FROM new_rows n JOIN old_rows o ON o.id = n.id
+                    WHERE (n.start_at::date, n.client, n.task, n.provider, n.invoiced, n.hours, n.total)
+                          IS DISTINCT FROM (o.start_at::date, o.client, o.task, o.provider, o.invoiced, o.hours, o.total)
+                $q$
+            END;
+            EXECUTE $q$
+                INSERT INTO prestations_daily AS d (day, client, task, provider, invoiced, lines, hours, total)
+                SELECT start_at::date, client, task, COALESCE(provider, ''), invoiced,
+                       SUM(sign), SUM(sign * hours), SUM(sign * total)
+                FROM ($q$ || delta || $q$) r
+                GROUP BY 1, 2, 3, 4, 5
+                ON CONFLICT (day, client, task, provider, invoiced) DO UPDATE
+                SET lines = d.lines + EXCLUDED.lines, hours = d.hours + EXCLUDED.hours, total = d.total + EXCLUDED.total
+            $q$;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+        CREATE OR REPLACE TRIGGER prestations_daily_insert AFTER INSERT ON prestations
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION prestations_daily_apply();
+        CREATE OR REPLACE TRIGGER prestations_daily_update AFTER UPDATE ON prestations
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION prestations_daily_apply();
+        CREATE OR REPLACE TRIGGER prestations_daily_delete AFTER DELETE ON prestations
+            REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION prestations_daily_apply();
+        CREATE OR REPLACE TRIGGER prestations_daily_truncate AFTER TRUNCATE ON prestations
+            FOR EACH STATEMENT EXECUTE FUNCTION prestations_daily_apply();
+        -- Cumuls de l'existant (les triggers bloquent les écritures jusqu'au commit)
+        TRUNCATE prestations_daily;
+        INSERT INTO prestations_daily (day, client, task, provider, invoiced, lines, hours, total)
+        SELECT start_at::date, client, task, COALESCE(provider, ''), invoiced, COUNT(*), SUM(hours), SUM(total)
+        FROM prestations
+        GROUP BY 1, 2, 3, 4, 5;
+        ANALYZE prestations_daily;
+    """),
+    (8, "Recherche plein texte", """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE EXTENSION IF NOT EXISTS unaccent;
+        -- Configuration française insensible aux accents (« cloture » trouve « clôture »)
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'french_unaccent') THEN
+                CREATE TEXT SEARCH CONFIGURATION french_unaccent (COPY = french);
+                ALTER TEXT SEARCH CONFIGURATION french_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem;
+            END IF;
+        END
+        $$;
+        -- unaccent() n'est pas IMMUTABLE (le dictionnaire peut changer) : enveloppe pour l'index trigramme
+        CREATE OR REPLACE FUNCTION search_text(text) RETURNS text
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            RETURN public.unaccent('public.unaccent'::regdictionary, lower($1));
+        -- La description pèse plus que le nom du client dans le classement
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('french_unaccent', COALESCE(description, '')), 'A') ||
+            setweight(to_tsvector('french_unaccent', client), 'B')
+        ) STORED;
+        -- Texte normalisé stocké : la revérification des trigrammes est un simple LIKE,
+        -- sans recalculer unaccent() sur chaque ligne candidate
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS search_doc text GENERATED ALWAYS AS (
+            search_text(COALESCE(description, '') || ' ' || client)
+        ) STORED;
+        CREATE INDEX IF NOT EXISTS prestations_search_idx ON prestations USING gin (search);
+        -- Trigrammes : mots partiels (« factu », « 2024-0 ») que le plein texte ne trouve pas
+        CREATE INDEX IF NOT EXISTS prestations_search_trgm_idx ON prestations USING gin (search_doc gin_trgm_ops);
+        ANALYZE prestations;
+    """),
+    (9, "Détection des chevauchements", """
+        CREATE EXTENSION IF NOT EXISTS btree_gist;
+        -- Créneaux [début, fin) par prestataire : deux prestations consécutives (9-10 h, 10-11 h)
+        -- ne se chevauchent pas. Pas de contrainte d'exclusion : l'historique contient des
+        -- doubles encodages à trier, ils sont signalés (database.find_overlaps) sans bloquer.
+        CREATE INDEX IF NOT EXISTS prestations_overlap_idx ON prestations
+            USING gist (provider, tsrange(start_at, end_at));
+    """),
+    (10, "Comptes utilisateurs", """
+        CREATE TABLE IF NOT EXISTS users (
+            id serial PRIMARY KEY,
+            username text NOT NULL UNIQUE,
+            password_hash text NOT NULL,  -- scrypt salé, voir auth.py
+            provider text,
+            role text NOT NULL DEFAULT 'user' CHECK (role IN ('admin', 'user')),
+            active boolean NOT NULL DEFAULT true,
+            failed_logins integer NOT NULL DEFAULT 0,
+            locked_until timestamp,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            CHECK (role = 'admin' OR provider IS NOT NULL)  -- un consultant voit les prestations de son prestataire
+        );
+    """),
+    (11, "Identifiant des saisies différées", """
+        -- UUID attribué par le journal local (journal.py) : un lot renvoyé après une coupure
+        -- n'insère chaque saisie qu'une fois (ON CONFLICT DO NOTHING). NULL pour les autres.
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS client_uuid uuid;
+        CREATE UNIQUE INDEX IF NOT EXISTS prestations_client_uuid_idx ON prestations (client_uuid);
+    """),
+    (12, "Transaction d'écriture des versions", """
+        -- Transaction qui a écrit chaque version : un magasin synchronisé relit les lignes des
+        -- transactions encore en cours lors de sa lecture (database.load_prestation_changes),
+        -- au lieu d'attendre qu'aucune écriture ne soit en cours sur le serveur. Les lignes
+        -- existantes restent à NULL (déjà validées) : pas de réécriture de la table.
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS writer_xid xid8;
+        ALTER TABLE prestations ALTER COLUMN writer_xid SET DEFAULT pg_current_xact_id();
+        ALTER TABLE prestations_tombstones ADD COLUMN IF NOT EXISTS writer_xid xid8;
+        ALTER TABLE prestations_tombstones ALTER COLUMN writer_xid SET DEFAULT pg_current_xact_id();
+        CREATE OR REPLACE FUNCTION prestations_writer_xid() RETURNS trigger AS $$
+        BEGIN
+            NEW.writer_xid := pg_current_xact_id();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+        CREATE OR REPLACE TRIGGER prestations_writer_xid BEFORE UPDATE ON prestations
+            FOR EACH ROW EXECUTE FUNCTION prestations_writer_xid();
+        CREATE INDEX IF NOT EXISTS prestations_writer_xid_idx ON prestations (writer_xid);
+        CREATE INDEX IF NOT EXISTS prestations_tombstones_writer_xid_idx ON prestations_tombstones (writer_xid);
+    """),
+]
+
+# DuckDB : pas de serial ni d'index partiels. Les horodatages sont locaux (timestamp) et les
+# filtres de l'historique n'ont pas besoin d'index : le stockage en colonnes et les
+# zonemaps (min/max par bloc) suffisent, un index ART ne servirait qu'aux recherches ponctuelles.
+DUCKDB_MIGRATIONS = [
+    (1, "Schéma initial", """
+        CREATE SEQUENCE IF NOT EXISTS clients_id_seq;
+        CREATE SEQUENCE IF NOT EXISTS tasks_id_seq;
+        CREATE SEQUENCE IF NOT EXISTS providers_id_seq;
+        CREATE SEQUENCE IF NOT EXISTS prestations_id_seq;
+        CREATE TABLE IF NOT EXISTS clients (
+            id integer PRIMARY KEY DEFAULT nextval('clients_id_seq'),
+            name text NOT NULL UNIQUE,
+            active boolean NOT NULL DEFAULT true
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            id integer PRIMARY KEY DEFAULT nextval('tasks_id_seq'),
+            name text NOT NULL UNIQUE,
+            rate numeric(10, 2) NOT NULL,
+            active boolean NOT NULL DEFAULT true
+        );
+        CREATE TABLE IF NOT EXISTS providers (
+            id integer PRIMARY KEY DEFAULT nextval('providers_id_seq'),
+            name text NOT NULL UNIQUE,
+            active boolean NOT NULL DEFAULT true
+        );
+        CREATE TABLE IF NOT EXISTS prestations (
+            id integer PRIMARY KEY DEFAULT nextval('prestations_id_seq'),
+            provider text,
+            client text NOT NULL,
+            task text NOT NULL,
+            description text,
+            start_at timestamp NOT NULL,
+            end_at timestamp NOT NULL,
+            hours numeric(10, 2) NOT NULL,
+            rate numeric(10, 2) NOT NULL,
+            total numeric(12, 2) NOT NULL,
+            created_at timestamp NOT NULL DEFAULT now(),
+            invoiced boolean NOT NULL DEFAULT false,
+            invoiced_at timestamp,
+            invoice_ref text
+        );
+    """),
+    (2, "Versions et suppressions pour la synchronisation", """
+        CREATE SEQUENCE IF NOT EXISTS prestations_version_seq;
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS updated_at timestamp DEFAULT now();
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS version bigint DEFAULT nextval('prestations_version_seq');
+        CREATE TABLE IF NOT EXISTS prestations_tombstones (
+            id integer PRIMARY KEY,
+            client text,
+            invoiced boolean,
+            version bigint NOT NULL DEFAULT nextval('prestations_version_seq'),
+            deleted_at timestamp NOT NULL DEFAULT now()
+        );
+    """),
+    (3, "Statistiques des filtres", "ANALYZE;"),
+    (4, "Timers en cours, un par prestataire", """
+        CREATE TABLE IF NOT EXISTS timers (
+            provider text PRIMARY KEY,
+            client text NOT NULL,
+            task text NOT NULL,
+            description text,
+            rate numeric(10, 2) NOT NULL,
+            started_at timestamp NOT NULL
+        );
+    """),
+    (5, "Version du catalogue (référentiels)", """
+        CREATE TABLE IF NOT EXISTS catalog_state (
+            id integer PRIMARY KEY CHECK (id = 1),
+            version bigint NOT NULL
+        );
+        INSERT INTO catalog_state (id, version) VALUES (1, 1) ON CONFLICT (id) DO NOTHING;
+    """),
+    (6, "Numéros de facture", "CREATE SEQUENCE IF NOT EXISTS invoice_number_seq;"),
+    # Pas de cumuls journaliers (ni de triggers) : les agrégations du dashboard lisent
+    # directement la table prestations, en colonnes
+    (7, "Cumuls journaliers pour le dashboard", "SELECT 1;"),
+    # Ni tsvector ni trigrammes : search_prestations() parcourt les colonnes description et
+    # client (strip_accents + contains), ce qui reste rapide sur une base locale
+    (8, "Recherche plein texte", "SELECT 1;"),
+    # Pas d'index sur intervalles : les chevauchements se cherchent par comparaison des
+    # bornes (rapport complet : voir database.overlap_report)
+    (9, "Détection des chevauchements", "SELECT 1;"),
+    (10, "Comptes utilisateurs", """
+        CREATE SEQUENCE IF NOT EXISTS users_id_seq;
+        CREATE TABLE IF NOT EXISTS users (
+            id integer PRIMARY KEY DEFAULT nextval('users_id_seq'),
+            username text NOT NULL UNIQUE,
+            password_hash text NOT NULL,
+            provider text,
+            role text NOT NULL DEFAULT 'user' CHECK (role IN ('admin', 'user')),
+            active boolean NOT NULL DEFAULT true,
+            failed_logins integer NOT NULL DEFAULT 0,
+            locked_until timestamp,
+            created_at timestamp NOT NULL DEFAULT now(),
+            CHECK (role = 'admin' OR provider IS NOT NULL)
+        );
+    """),
+    (11, "Identifiant des saisies différées", """
+        ALTER TABLE prestations ADD COLUMN IF NOT EXISTS client_uuid uuid;
+        CREATE UNIQUE INDEX IF NOT EXISTS prestations_client_uuid_idx ON prestations (client_uuid);
+    """),
+    # Accès sérialisés par DuckDBStore : aucune écriture n'est en cours pendant une lecture
+    (12, "Transaction d'écriture des versions", "SELECT 1;"),
+]
+
+def apply_migrations():
+    """Applique les migrations manquantes, chacune dans sa transaction. Retourne les versions appliquées."""
+    postgres = db.dialect() == "postgres"
+    applied = []
+    for version, name, sql in MIGRATIONS if postgres else DUCKDB_MIGRATIONS:
+        with db.get_connection() as conn:
+            with conn.cursor() as cur:
+                if postgres:
+                    cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATIONS_LOCK_ID,))
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version integer PRIMARY KEY,
+                        name text NOT NULL,
+                        applied_at timestamptz NOT NULL DEFAULT now()
+                    );
+                    """
+                )
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s;", (version,))
+                if cur.fetchone():
+                    continue
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+            conn.commit()
+        applied.append(version)
+    return applied
+
+# --- Vérification des index ---
+def _filter_combinations(sample):
+    """Toutes les combinaisons de filtres que load_prestations_filtered peut générer."""
+    for provider, client, task, start, end in itertools.product(*[(None, v) for v in sample]):
+        for invoiced in (None, True, False):
+            yield dict(provider=provider, client=client, task=task, start_date=start, end_date=end, invoiced=invoiced)
+
+def _query_shapes(filters):
+    """Requêtes émises pour ces filtres : liste complète triée et page keyset."""
+    conditions, params = db._prestation_filters(**filters)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    yield "liste", db.PRESTATION_SELECT + where + " ORDER BY start_at ASC", params
+    yield "page", db.PRESTATION_SELECT + where + " ORDER BY start_at ASC, id ASC LIMIT 51", params
+
+SELECTIVE_FILTERS = ("provider", "client", "task", "start_date", "end_date")
+
+def _prestation_scans(plan):
+    """Nœuds du plan qui lisent la table prestations."""
+    found = []
+    if plan.get("Relation Name") == "prestations" or plan.get("Index Name", "").startswith("prestations"):
+        found.append(plan)
+    for child in plan.get("Plans", []):
+        found.extend(_prestation_scans(child))
+    return found
+
+def _uses_index(plan, filters):
+    """Vrai si la table est lue par un index, et par une condition d'index dès qu'un filtre sélectif est posé."""
+    selective = any(filters.get(k) is not None for k in SELECTIVE_FILTERS)
+    for node in _prestation_scans(plan):
+        if node["Node Type"] == "Seq Scan":
+            return False
+        if selective and node["Node Type"] in ("Index Scan", "Index Only Scan", "Bitmap Index Scan") and "Index Cond" not in node:
+            return False
+    return True
+
+def check_filter_indexes():
+    """EXPLAIN ANALYZE de chaque combinaison de filtres, parcours séquentiels désactivés.
+
+    Sur une petite base, le planificateur préfère légitimement un parcours séquentiel ;
+    en le désactivant, un « Seq Scan » restant (ou un index parcouru sans condition
+    alors qu'un filtre sélectif est posé) signifie qu'aucun index ne sert la requête.
+    Retourne la liste des (filtres, forme, temps en ms) non couverts.
+    """
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT provider, client, task, start_at::date FROM prestations ORDER BY id DESC LIMIT 1;")
+            sample = cur.fetchone() or ("?", "?", "?", date.today())
+            sample = (sample[0], sample[1], sample[2], sample[3], sample[3])
+            cur.execute("SET LOCAL enable_seqscan = off;")
+            uncovered = []
+            for filters in _filter_combinations(sample):
+                for shape, sql, params in _query_shapes(filters):
+                    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+                    result = cur.fetchone()[0]
+                    result = json.loads(result) if isinstance(result, str) else result
+                    if not _uses_index(result[0]["Plan"], filters):
+                        used = {k: v for k, v in filters.items() if v is not None}
+                        uncovered.append((used, shape, result[0]["Execution Time"]))
+        conn.rollback()
+    return uncovered
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrations du schéma")
+    parser.add_argument("--check", action="store_true", help="Vérifie l'usage des index par les filtres")
+    args = parser.parse_args()
+
+    done = apply_migrations()
+    print(f"Migrations appliquées : {done or 'aucune'}")
+    if args.check and db.dialect() != "postgres":
+        print("La vérification des index ne concerne que PostgreSQL.")
+    elif args.check:
+        missing = check_filter_indexes()
+        for filters, shape, ms in missing:
+            print(f"Sans index ({shape}, {ms:.1f} ms) : {filters}")
+        print("Toutes les combinaisons de filtres utilisent un index." if not missing else f"{len(missing)} requête(s) sans index.")
+        sys.exit(1 if missing else 0)
@@ -0,0 +1,258 @@
+"""Mesures de performance : requêtes SQL, fonctions de database.py et rendu des vues.
+
+Chaque mesure est une « span » (nom, durée, attributs) rattachée à sa parente : une
+exécution complète du script (« rerun », main.py) contient les vues, qui contiennent
+les appels à database.py, qui contiennent leurs requêtes SQL. Les
+durées récentes servent aux percentiles de l'onglet Performance ; les requêtes plus
+lentes que PERF_SLOW_MS sont gardées dans un journal. Si PERF_EXPORT_PATH est
+défini, chaque span est aussi ajoutée à ce fichier, une ligne JSON par span, dans
+un format proche d'OpenTelemetry.
+
+Les paramètres SQL ne sont jamais enregistrés, seulement leur empreinte.
+"""
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from time import perf_counter
+
+import psycopg2.extensions
+import streamlit as st
+
+SAMPLES_PER_NAME = 1000
+SLOW_LOG_SIZE = 200
+
+_current_span = contextvars.ContextVar("perf_span", default=None)
+_count_lock = threading.Lock()
+
+class Span:
+    __slots__ = ("kind", "name", "parent", "trace_id", "span_id", "start_ns", "attributes", "queries", "calls")
+
+    def __init__(self, kind, name, parent):
+        self.kind, self.name, self.parent = kind, name, parent
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.attributes = {}
+        self.queries = 0  # requêtes SQL exécutées pendant la span (et ses enfants)
+        self.calls = 0  # appels à database.py pendant la span
+
+class Recorder:
+    """Collecte les spans terminées : échantillons par nom, journal lent, export fichier."""
+
+    def __init__(self, slow_ms=500.0, export_path=None):
+        self.slow_ms = slow_ms
+        self.export_path = export_path
+        self._samples = defaultdict(lambda: deque(maxlen=SAMPLES_PER_NAME))  # (type, nom) -> [(ms, lignes, cache, requêtes, appels)]
+        self._slow = deque(maxlen=SLOW_LOG_SIZE)
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    def record(self, span, ms, status="ok"):
+        rows = span.attributes.get("rows")
+        cache = span.attributes.get("cache")
+        nested = (span.queries, span.calls) if span.kind in ("rerun", "view") else (None, None)
+        with self._lock:
+            self._samples[(span.kind, span.name)].append((ms, rows, cache) + nested)
+            if span.kind == "sql" and ms >= self.slow_ms:
+                self._slow.append({
+                    "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "ms": round(ms, 1),
+                    "requête": span.name,
+                    "paramètres": span.attributes.get("params_hash"),
+                    "lignes": rows,
+                    "appelant": span.parent.name if span.parent else None,
+                })
+        if self.export_path:
+            self._export(span, status)
+
+    def _export(self, span, status):
+        line = json.dumps({
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent.span_id if span.parent else None,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": span.start_ns,
+            "endTimeUnixNano": time.time_ns(),
+            "attributes": span.attributes,
+            "status": status,
+        }, ensure_ascii=False, default=str)
+        with self._export_lock:
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def summary(self):
+        """Une ligne par (type, nom) : nombre d'appels, percentiles en ms, lignes moyennes, taux de cache."""
+        with self._lock:
+            samples = {key: list(values) for key, values in self._samples.items()}
+        result = []
+        for (kind, name), values in samples.items():
+            durations = sorted(v[0] for v in values)
+            rows = [v[1] for v in values if v[1] is not None]
+            cached = [v[2] for v in values if v[2] is not None]
+            queries = [v[3] for v in values if v[3] is not None]
+            calls = [v[4] for v in values if v[4] is not None]
+            n = len(durations)
+            result.append({
+                "Type": kind,
+                "Nom": name,
+                "Appels": n,
+                "p50 ms": round(durations[n // 2], 2),
+                "p95 ms": round(durations[min(n - 1, int(n * 0.95))], 2),
+                "p99 ms": round(durations[min(n - 1, int(n * 0.99))], 2),
+                "max ms": round(durations[-1], 2),
+                "Lignes (moy.)": round(sum(rows) / len(rows), 1) if rows else None,
+                "Cache": round(cached.count("hit") / len(cached), 3) if cached else None,
+                "Appels DB (moy.)": round(sum(calls) / len(calls), 1) if calls else None,
+                "Requêtes (moy.)": round(sum(queries) / len(queries), 1) if queries else None,
+            })
+        result.sort(key=lambda r: r["p95 ms"], reverse=True)
+        return result
+
+    def slow_queries(self):
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._slow.clear()
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_recorder():
+    """Collecteur du processus, configuré par PERF_SLOW_MS et PERF_EXPORT_PATH (secrets)."""
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                try:
+                    slow_ms = float(st.secrets.get("PERF_SLOW_MS", 500))
+                    export_path = st.secrets.get("PERF_EXPORT_PATH") or None
+                except FileNotFoundError:  # pas de secrets.toml (scripts)
+                    slow_ms, export_path = 500.0, None
+                _recorder = Recorder(slow_ms, export_path)
+    return _recorder
+
+class span:
+    """Mesure le bloc `with` comme une span de type `kind`, enfant de la span courante."""
+
+    def __init__(self, kind, name, **attributes):
+        self.kind, self.name, self.attributes = kind, name, attributes
+
+    def __enter__(self):
+        self._span = Span(self.kind, self.name, _current_span.get())
+        self._span.attributes.update(self.attributes)
+        self._token = _current_span.set(self._span)
+        self._t0 = perf_counter()
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (perf_counter() - self._t0) * 1000
+        _current_span.reset(self._token)
+        current = self._span
+        current.attributes["ms"] = round(ms, 3)
+        if current.kind in ("sql", "db"):
+            parent = current.parent
+            with _count_lock:  # les lectures de prefetch.py comptent dans la même vue depuis d'autres threads
+                while parent is not None:
+                    if current.kind == "sql":
+                        parent.queries += 1
+                    else:
+                        parent.calls += 1
+                    parent = parent.parent
+        if current.kind != "sql":
+            current.attributes.update(queries=current.queries, db_calls=current.calls)
+        get_recorder().record(current, ms, "error" if exc_type else "ok")
+        return False
+
+def _row_count(result):
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    if isinstance(result, dict):
+        return result.get("count")
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+def timed(kind, cached=False):
+    """Décorateur : mesure chaque appel (durée, lignes renvoyées).
+
+    Pour une fonction en cache (`cached=True`), un appel sans requête SQL compte
+    comme un succès du cache.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(kind, func.__name__) as current:
+                result = func(*args, **kwargs)
+                current.attributes["rows"] = _row_count(result)
+                if cached:
+                    current.attributes["cache"] = "miss" if current.queries else "hit"
+                return result
+        if hasattr(func, "clear"):  # st.cache_data : garder .clear()
+            wrapper.clear = func.clear
+        return wrapper
+    return decorator
+
+# --- Démarrage ---
+# Étapes mesurées une fois par processus (imports, bootstrap de main.py) ou au premier
+# affichage de chaque session : spans de type « startup », visibles dans l'onglet
+# Performance. Le secret PROFILE_STARTUP les affiche aussi dans la barre latérale ;
+# benchmarks/startup.py mesure un démarrage à froid complet.
+_startup = {}
+
+def record_startup(name, ms):
+    """Enregistre une étape du démarrage mesurée hors d'une span (imports faits avant celui de perf)."""
+    current = Span("startup", name, None)
+    current.start_ns -= int(ms * 1e6)
+    current.attributes["ms"] = round(ms, 3)
+    _startup[name] = round(ms, 1)
+    get_recorder().record(current, ms)
+
+def startup_times():
+    """Dernière durée (ms) de chaque étape du démarrage : imports, bootstrap, first_render."""
+    return dict(_startup)
+
+# --- Curseur instrumenté ---
+_SPACES = re.compile(r"\s+")
+_VALUES = re.compile(r"\bVALUES\s*\(.*", re.IGNORECASE | re.DOTALL)
+
+def sql_shape(query):
+    """Forme normalisée d'une requête : espaces réduits, listes VALUES (execute_values) tronquées."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    shape = _VALUES.sub("VALUES (…)", _SPACES.sub(" ", str(query)).strip())
+    return shape if len(shape) <= 300 else shape[:299] + "…"
+
+def params_hash(params):
+    return hashlib.blake2b(repr(params).encode("utf-8", "replace"), digest_size=8).hexdigest() if params else None
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Curseur psycopg2 qui mesure chaque requête (à passer en `cursor_factory`)."""
+
+    def execute(self, query, vars=None):
+        with span("sql", sql_shape(query), params_hash=params_hash(vars)) as current:
+            result = super().execute(query, vars)
+            current.attributes["rows"] = self.rowcount if self.rowcount >= 0 else None
+            return result
+
+    def executemany(self, query, vars_list):
+        with span("sql", sql_shape(query), batch=True) as current:
+            result = super().executemany(query, vars_list)
+            current.attributes["rows"] = self.rowcount if self.rowcount >= 0 else None
+            return result
+
+    def copy_expert(self, sql, file, size=8192):
+        with span("sql", sql_shape(sql)) as current:
+            result = super().copy_expert(sql, file, size)
+            current.attributes["rows"] = self.rowcount if self.rowcount >= 0 else None
+            return result
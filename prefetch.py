@@ -0,0 +1,61 @@
+"""Chargement concurrent des lectures indépendantes d'une page.
+
+Une vue déclare les données dont elle a besoin et les demande ensemble :
+
+    ref, summary, page = prefetch.gather(
+        db.reference_data,
+        lambda: db.summarize_prestations(**filters),
+        lambda: db.load_prestations_page(**filters),
+    )
+
+La première lecture s'exécute dans le thread courant, chacune des autres dans son
+propre thread, chacune avec sa connexion du pool : une page froide attend la
+requête la plus lente au lieu de la somme des requêtes. Les threads reçoivent le
+contexte Streamlit de la session (caches) et une copie des contextvars, si bien que
+les spans de perf.py restent rattachées à la vue qui a demandé les données. Les
+fonctions passées ne doivent rien afficher.
+
+Sur DuckDB, les accès à la base sont sérialisés (storage.py) : les lectures sont
+faites l'une après l'autre, sans threads.
+"""
+import contextvars
+import threading
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import database as db
+
+def gather(*loaders):
+    """Appelle les fonctions sans argument `loaders` en parallèle et renvoie leurs résultats dans l'ordre.
+
+    Si une lecture échoue, son exception est relevée une fois toutes les lectures terminées.
+    """
+    if len(loaders) <= 1 or db.dialect() != "postgres":
+        return [load() for load in loaders]
+
+    results = [None] * len(loaders)
+    errors = [None] * len(loaders)
+
+    def run(i):
+        try:
+            results[i] = loaders[i]()
+        except BaseException as exc:
+            errors[i] = exc
+
+    script_ctx = get_script_run_ctx(suppress_warning=True)
+    threads = []
+    for i in range(1, len(loaders)):
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(run, i), name=f"prefetch-{i}", daemon=True)
+        if script_ctx is not None:
+            add_script_run_ctx(thread, script_ctx)
+        thread.start()
+        threads.append(thread)
+    run(0)
+    for thread in threads:
+        thread.join()
+
+    for exc in errors:
+        if exc is not None:
+            raise exc
+    return results
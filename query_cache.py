@@ -0,0 +1,142 @@
+"""Cache des requêtes sur les prestations, invalidé par générations.
+
+Chaque résultat est rattaché aux « portées » (client, facturée ou non) qu'il lit.
+Une écriture incrémente la génération des portées touchées : seules les entrées
+qui en dépendent sont retirées, les autres (archives d'autres clients, etc.) restent.
+
+La mémoire occupée est bornée par un budget en octets : la taille de chaque résultat
+est estimée à l'insertion et les entrées les moins récemment utilisées sont évincées
+jusqu'à repasser sous le budget. Les résultats ne sont jamais copiés (ni sérialisés)
+par session : chaque appelant reçoit une vue qui partage les données de l'entrée.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+import pandas as pd
+
+ALL_CLIENTS = "*"
+
+def query_scopes(client=None, invoiced=None):
+    """Portées lues par une requête filtrée sur `client` et `invoiced` (None = tous)."""
+    clients = [client] if client and client != "(Tous)" else [ALL_CLIENTS]
+    states = [invoiced] if invoiced in (True, False) else [False, True]
+    return tuple((c, s) for c in clients for s in states)
+
+def value_size(value):
+    """Taille approximative d'un résultat en mémoire, en octets."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(value_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_size(v) for v in value.values())
+    return sys.getsizeof(value)
+
+def shared_view(value):
+    """Vue d'un résultat en cache pour un appelant.
+
+    Les DataFrame sont copiés en surface : les données restent partagées, et grâce
+    au copy-on-write de pandas (>= 3) une modification de la vue (colonne ajoutée,
+    valeur changée) ne touche ni l'entrée en cache ni les autres sessions.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, tuple):
+        return tuple(shared_view(v) for v in value)
+    if isinstance(value, dict):
+        return {k: shared_view(v) for k, v in value.items()}
+    return value
+
+class QueryCache:
+    """Cache LRU partagé par le processus, borné en octets, avec durée de vie et compteurs."""
+
+    def __init__(self, max_entries=256, ttl=60.0, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # clé -> (expiration, portées, jeton, valeur, taille)
+        self._bytes = 0
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "oversize": 0}
+
+    def _token(self, scopes):
+        return (self._epoch,) + tuple(self._generations.get(s, 0) for s in scopes)
+
+    def _pop(self, key):
+        self._bytes -= self._entries.pop(key)[4]
+
+    def get_or_load(self, key, scopes, loader):
+        """Renvoie la valeur en cache pour `key`, ou l'obtient via `loader()`."""
+        with self._lock:
+            token = self._token(scopes)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, _, entry_token, value, _ = entry
+                if entry_token == token and expires > monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return shared_view(value)
+                self._pop(key)
+                self._counters["expirations" if entry_token == token else "evictions"] += 1
+            self._counters["misses"] += 1
+
+        value = loader()
+        size = value_size(value)
+
+        with self._lock:
+            # Une écriture pendant le chargement rend le résultat douteux : on ne le garde pas
+            if self._token(scopes) == token:
+                if size > self.max_bytes:
+                    self._counters["oversize"] += 1
+                else:
+                    self._store(key, scopes, token, value, size)
+        return shared_view(value)
+
+    def _store(self, key, scopes, token, value, size):
+        """Insère l'entrée puis évince (expirées d'abord, puis LRU) jusqu'à respecter les limites."""
+        if key in self._entries:  # chargé entre-temps par une autre session
+            self._pop(key)
+        now = monotonic()
+        for stale in [k for k, e in self._entries.items() if e[0] <= now]:
+            self._pop(stale)
+            self._counters["expirations"] += 1
+        self._entries[key] = (now + self.ttl, scopes, token, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def invalidate(self, changes):
+        """Signale des écritures sur des portées (client, facturée)."""
+        with self._lock:
+            touched = set()
+            for client, invoiced in changes:
+                for scope in ((client, bool(invoiced)), (ALL_CLIENTS, bool(invoiced))):
+                    if scope not in touched:
+                        touched.add(scope)
+                        self._generations[scope] = self._generations.get(scope, 0) + 1
+            stale = [key for key, entry in self._entries.items() if touched.intersection(entry[1])]
+            for key in stale:
+                self._pop(key)
+            self._counters["invalidations"] += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._counters["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters, entries=len(self._entries), max_entries=self.max_entries,
+                        bytes=self._bytes, max_bytes=self.max_bytes)
+        lookups = data["hits"] + data["misses"]
+        data["hit_ratio"] = round(data["hits"] / lookups, 3) if lookups else 0.0
+        return data
@@ -0,0 +1,161 @@
+"""Moteur embarqué DuckDB, pour une installation locale sans serveur PostgreSQL.
+
+database.py n'utilise qu'un « magasin de connexions » : un objet qui expose
+`connection()` (contexte : commit en sortie normale, rollback sur exception),
+`stats()`, `close()` et `dialect`. ConnectionPool (database.py) est l'implémentation
+PostgreSQL ; DuckDBStore ci-dessous ouvre un fichier local, démarre instantanément
+et exécute les agrégations (dashboard, exports) en colonnes.
+
+Choix du moteur dans les secrets :
+
+    DB_BACKEND = "duckdb"
+    DB_PATH = "pointage.duckdb"
+
+Les connexions prêtées imitent la petite partie de psycopg2 utilisée par
+l'application (curseurs, paramètres `%s`, fetch*). Les accès sont sérialisés :
+DuckDB est prévu pour un seul utilisateur, et les versions de synchronisation
+(sync.py) sont ainsi validées dans l'ordre.
+"""
+import functools
+import re
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+import duckdb
+
+import perf
+
+_PARAM = re.compile(r"%([s%])")
+
+@functools.lru_cache(maxsize=512)
+def _translate(query):
+    """Paramètres psycopg2 (`%s`, `%%`) vers ceux de DuckDB (`?`, `%`)."""
+    return _PARAM.sub(lambda m: "?" if m.group(1) == "s" else "%", query)
+
+class DuckDBCursor:
+    """Curseur au sens psycopg2 sur une connexion DuckDB."""
+
+    rowcount = -1
+
+    def __init__(self, con):
+        self._con = con
+        self.itersize = 2000
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @property
+    def description(self):
+        return self._con.description
+
+    def execute(self, query, vars=None):
+        with perf.span("sql", perf.sql_shape(query), params_hash=perf.params_hash(vars)):
+            if vars is None:
+                self._con.execute(query)
+            else:
+                self._con.execute(_translate(query), list(vars))
+
+    def executemany(self, query, vars_list):
+        with perf.span("sql", perf.sql_shape(query), batch=True):
+            self._con.executemany(_translate(query), [list(v) for v in vars_list])
+
+    def fetchone(self):
+        return self._con.fetchone()
+
+    def fetchall(self):
+        return self._con.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._con.fetchmany(size or self.itersize)
+
+    def close(self):
+        pass
+
+class DuckDBConnection:
+    """Connexion prêtée par DuckDBStore : une transaction ouverte en permanence."""
+
+    def __init__(self, con):
+        self._con = con
+        self._con.begin()
+
+    def cursor(self, name=None):
+        # Les curseurs nommés (côté serveur) de PostgreSQL n'ont pas d'équivalent : fetchmany suffit
+        return DuckDBCursor(self._con)
+
+    def commit(self):
+        self._con.commit()
+        self._con.begin()
+
+    def rollback(self):
+        self._con.rollback()
+        self._con.begin()
+
+    def register(self, name, df):
+        """Expose un DataFrame comme table temporaire (import en masse)."""
+        self._con.register(name, df)
+
+    def unregister(self, name):
+        self._con.unregister(name)
+
+class DuckDBStore:
+    """Base DuckDB d'un fichier local, partagée par les sessions du processus."""
+
+    dialect = "duckdb"
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._db = duckdb.connect(path)
+        self._access = threading.RLock()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._counters = {"checkouts": 0, "waits": 0, "timeouts": 0, "reconnects": 0, "in_use": 0}
+
+    @contextmanager
+    def connection(self):
+        t0 = perf_counter()
+        if not self._access.acquire(blocking=False):
+            with self._lock:
+                self._counters["waits"] += 1
+            if not self._access.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise TimeoutError("Base locale occupée.")
+        con = self._db.cursor()
+        with self._lock:
+            self._counters["checkouts"] += 1
+            self._counters["in_use"] += 1
+            self._latencies.append(perf_counter() - t0)
+        try:
+            conn = DuckDBConnection(con)
+            try:
+                yield conn
+            except BaseException:
+                con.rollback()
+                raise
+            con.commit()
+        finally:
+            con.close()
+            with self._lock:
+                self._counters["in_use"] -= 1
+            self._access.release()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            latencies = sorted(self._latencies)
+        data.update({"min": 1, "max": 1, "path": self.path})
+        if latencies:
+            data["checkout_ms_p50"] = round(latencies[len(latencies) // 2] * 1000, 2)
+            data["checkout_ms_p95"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2)
+            data["checkout_ms_max"] = round(latencies[-1] * 1000, 2)
+        return data
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,178 @@
+"""Synchronisation incrémentale des prestations non facturées.
+
+Un magasin en mémoire, partagé par toutes les sessions du processus, est chargé une
+fois puis ne relit que les lignes dont la `version` dépasse son filigrane (avec les
+suppressions de `prestations_tombstones`). Un thread écoute le canal NOTIFY publié
+par les écritures de database.py : les autres sessions voient une nouvelle saisie
+en moins d'une seconde, et le cache des requêtes des autres processus est invalidé.
+Sur la base embarquée DuckDB (un seul processus, pas de NOTIFY), le thread relit
+simplement les changements chaque seconde.
+
+Le thread est démarré au lancement du processus (main.bootstrap) : les caches sont
+invalidés dès la première écriture d'un autre processus, que le magasin (chargé par la
+page Facturation) existe ou non.
+
+Pour tester contre un Postgres local (secrets pointant dessus) :
+
+    python sync.py   # affiche chaque changement reçu
+"""
+import json
+import logging
+import select
+import threading
+import time
+
+import psycopg2
+import streamlit as st
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+class PrestationStore:
+    """Copie locale des prestations non facturées, mise à jour par deltas."""
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+        self.watermark = None
+        self.version = 0  # incrémenté à chaque changement visible
+
+    def refresh(self):
+        """Charge tout au premier appel, puis uniquement les changements. Retourne le nombre de lignes touchées."""
+        with self._lock:
+            if self.watermark is None:
+                rows, self.watermark = db.load_prestations_snapshot(invoiced=False)
+                self._rows = {r[0]: r for r in rows}
+                self.version += 1
+                return len(rows)
+
+            changed, deleted, self.watermark = db.load_prestation_changes(self.watermark)
+            touched = 0
+            for r in changed:
+                if not r[10]:
+                    touched += self._rows.get(r[0]) != r
+                    self._rows[r[0]] = r
+                elif self._rows.pop(r[0], None) is not None:  # facturée : sort du magasin
+                    touched += 1
+            for pid in deleted:
+                touched += self._rows.pop(pid, None) is not None
+            if touched:
+                self.version += 1
+            return touched
+
+    def frame(self, client=None):
+        """DataFrame des prestations non facturées (d'un client), triées par début."""
+        with self._lock:
+            rows = [r for r in self._rows.values() if client is None or r[2] == client]
+        rows.sort(key=lambda r: (r[5], r[0]))
+        return db._prestations_dataframe(rows)
+
+class ChangeListener(threading.Thread):
+    """Écoute CHANGES_CHANNEL sur une connexion dédiée (hors pool) et appelle `on_change(payload)`.
+
+    Se reconnecte en cas de coupure ; `on_change(None)` est aussi appelé toutes les
+    `idle_refresh` secondes et après une reconnexion, pour rattraper un éventuel oubli.
+    Sans NOTIFY (DuckDB), `on_change(None)` est appelé toutes les `poll_interval` secondes.
+    """
+
+    def __init__(self, on_change, idle_refresh=30.0, poll_interval=1.0):
+        super().__init__(name="prestations-listener", daemon=True)
+        self.on_change = on_change
+        self.idle_refresh = idle_refresh
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except Exception:
+                logger.exception("Écoute des changements interrompue, reconnexion dans %.0f s", backoff)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    def _listen(self):
+        if db.dialect() != "postgres":
+            while not self._stop_event.wait(self.poll_interval):
+                self._dispatch(None)
+            return
+        conn = psycopg2.connect(**db._connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {db.CHANGES_CHANNEL};")
+            self._dispatch(None)
+            last = time.monotonic()
+            while not self._stop_event.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    if time.monotonic() - last >= self.idle_refresh:
+                        self._dispatch(None)
+                        last = time.monotonic()
+                    continue
+                conn.poll()
+                payloads = [n.payload for n in conn.notifies]
+                conn.notifies.clear()
+                for payload in payloads:
+                    self._dispatch(payload)
+                last = time.monotonic()
+        finally:
+            conn.close()
+
+    def _dispatch(self, payload):
+        try:
+            self.on_change(json.loads(payload) if payload else None)
+        except Exception:
+            logger.exception("Traitement d'une notification en échec")
+
+_store = None  # magasin du processus, créé par la première page qui s'en sert
+
+def _apply_change(change):
+    """Invalide le cache local pour les écritures des autres processus puis rafraîchit le magasin."""
+    if change is not None and change.get("origin") != db.PROCESS_ID:
+        db._forget_all_prestations()  # la notification ne porte pas les ID modifiés
+        scopes = change.get("scopes")
+        if scopes is None:
+            db.clear_prestations_cache()
+        else:
+            db._get_query_cache().invalidate([tuple(s) for s in scopes])
+    if _store is not None:
+        _store.refresh()
+
+@st.cache_resource(show_spinner=False)
+def start_listener():
+    """Thread d'écoute du processus, démarré une fois (main.bootstrap)."""
+    listener = ChangeListener(_apply_change)
+    listener.start()
+    return listener
+
+@st.cache_resource(show_spinner=False)
+def get_store():
+    """Magasin du processus, tenu à jour par le thread d'écoute."""
+    global _store
+    start_listener()
+    store = PrestationStore()
+    store.refresh()
+    _store = store
+    return store
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    demo = PrestationStore()
+    print(f"{demo.refresh()} prestation(s) non facturée(s) chargée(s).")
+
+    def show(change):
+        touched = demo.refresh()
+        print(f"notification={change} lignes_modifiées={touched} filigrane={demo.watermark}")
+
+    listener = ChangeListener(show)
+    listener.start()
+    try:
+        listener.join()
+    except KeyboardInterrupt:
+        listener.stop()
@@ -0,0 +1,82 @@
+"""Fixtures communes : chaque test tourne sur DuckDB (fichier temporaire) et sur la base
+PostgreSQL désignée par les variables TEST_DB_*.
+
+Les tests PostgreSQL (marqueur `postgres` : migrations, triggers de cumul, verrous de la
+facturation, index) sont requis : sans TEST_DB_NAME, la session échoue au lieu de les
+ignorer. Base de test jetable (l'image officielle fournit pg_trgm, unaccent et btree_gist,
+créées par les migrations) :
+
+    docker run -d --rm --name pointage-test-db -p 5433:5432 -e POSTGRES_PASSWORD=test -e POSTGRES_DB=pointage_test postgres:16
+    TEST_DB_PORT=5433 TEST_DB_NAME=pointage_test TEST_DB_PASSWORD=test python -m pytest
+
+Pour ne lancer que DuckDB, exclure explicitement PostgreSQL :
+
+    python -m pytest -m "not postgres"
+
+La base PostgreSQL de test est vidée avant chaque test : ne jamais la faire pointer sur une
+base de production.
+"""
+import os
+
+import pytest
+import streamlit as st
+
+import database as db
+import migrations
+
+POSTGRES_SECRETS = {
+    "DB_HOST": os.environ.get("TEST_DB_HOST", "localhost"),
+    "DB_PORT": os.environ.get("TEST_DB_PORT", "5432"),
+    "DB_NAME": os.environ.get("TEST_DB_NAME"),
+    "DB_USER": os.environ.get("TEST_DB_USER", "postgres"),
+    "DB_PASSWORD": os.environ.get("TEST_DB_PASSWORD", ""),
+    "DB_SSLMODE": os.environ.get("TEST_DB_SSLMODE", "disable"),
+}
+
+TABLES = ["prestations", "prestations_tombstones", "timers", "users", "clients", "tasks", "providers"]
+
+def _reset_process_state():
+    """Oublie le magasin de connexions et les caches du processus (changement de moteur)."""
+    db._get_pool.clear()
+    db._get_query_cache.clear()
+    db._forget_all_prestations()
+    db._reference = None
+    db._reference_checked = 0.0
+
+@pytest.hookimpl(trylast=True)  # après la désélection par -m
+def pytest_collection_modifyitems(config, items):
+    if not POSTGRES_SECRETS["DB_NAME"] and any(item.get_closest_marker("postgres") for item in items):
+        raise pytest.UsageError('TEST_DB_NAME non défini : démarrer une base de test (voir tests/conftest.py)'
+                                ' ou exclure les tests PostgreSQL avec -m "not postgres".')
+
+@pytest.fixture(scope="session", params=["duckdb", pytest.param("postgres", marks=pytest.mark.postgres)])
+def backend(request, tmp_path_factory):
+    """Moteur testé, schéma à jour. Les secrets de l'application sont remplacés le temps des tests."""
+    if request.param == "duckdb":
+        secrets = {"DB_BACKEND": "duckdb", "DB_PATH": str(tmp_path_factory.mktemp("duckdb") / "test.duckdb")}
+    else:
+        secrets = dict(POSTGRES_SECRETS)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(st, "secrets", secrets)
+        _reset_process_state()
+        migrations.apply_migrations()
+        yield request.param
+        db._get_pool().close()
+        _reset_process_state()
+
+@pytest.fixture(autouse=True)
+def clean_db(backend):
+    """Base vide, avec deux clients, deux prestataires et deux tâches."""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            for table in TABLES:
+                cur.execute(f"DELETE FROM {table};")
+        conn.commit()
+    _reset_process_state()
+    for name in ("Alpha", "Béta"):
+        db.add_or_reactivate_client(name)
+    for name in ("Ann", "Bob"):
+        db.add_or_reactivate_provider(name)
+    db.upsert_task("Analyse", 80.0)
+    db.upsert_task("Conseil", 100.0)
+    return backend
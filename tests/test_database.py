@@ -0,0 +1,189 @@
+"""Chemins de database.py (et export.py) écrits différemment pour PostgreSQL et DuckDB :
+mêmes résultats attendus sur les deux moteurs."""
+import csv
+import io
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import psycopg2
+import pytest
+
+import database as db
+import export
+
+def at(day, hour, minute=0):
+    return datetime(2024, 3, day, hour, minute)
+
+def insert(provider, client, start, hours, task="Analyse", rate=80.0):
+    db.insert_prestation(provider, client, task, "", start, start + timedelta(hours=hours), rate)
+
+def ids(**filters):
+    return db.load_prestations_filtered(**filters)["ID"].tolist()
+
+def journal_entry(provider, client, start, end, rate=80.0, timer_started_at=None):
+    hours = round((end - start).total_seconds() / 3600, 2)
+    return {"client_uuid": str(uuid.uuid4()), "provider": provider, "client": client, "task": "Analyse",
+            "description": "", "start_at": start, "end_at": end, "hours": hours, "rate": rate,
+            "total": round(hours * rate, 2), "timer_started_at": timer_started_at}
+
+def test_delete_prestations_records_tombstones():
+    insert("Ann", "Alpha", at(1, 9), 1)
+    insert("Ann", "Alpha", at(2, 9), 1)
+    first, second = ids(client="Alpha")
+    _, watermark = db.load_prestations_snapshot()
+
+    db.delete_prestations([first])
+    db.delete_prestations([first])  # déjà supprimée : rien ne change
+
+    changed, deleted, _ = db.load_prestation_changes(watermark)
+    assert deleted == [first]
+    assert changed == []
+    assert ids(client="Alpha") == [second]
+
+def test_import_prestations():
+    df = pd.DataFrame({
+        "Prestataire": ["Ann", "Bob"],
+        "Client": ["Alpha", "Béta"],
+        "Tâche": ["Analyse", "Conseil"],
+        "Début": ["2024-03-01 09:00", "02/03/2024 14:00"],
+        "Fin": ["2024-03-01 10:30", "02/03/2024 16:00"],
+        "Réf facture": ["", "F-1"],
+    })
+    report = db.import_prestations(df)
+    assert report["errors"].empty
+    assert report["inserted"] == 2
+    assert report["total"] == pytest.approx(1.5 * 80 + 2 * 100)
+
+    rows = db.load_prestations_filtered().set_index("Client")
+    assert rows.loc["Alpha", "Heures"] == 1.5 and not rows.loc["Alpha", "Facturée"]
+    assert rows.loc["Béta", "Total €"] == 200.0 and rows.loc["Béta", "Facturée"]
+    assert rows.loc["Béta", "Réf facture"] == "F-1"
+
+    invalid = db.import_prestations(df.assign(Client=["Alpha", "Inconnu"]))
+    assert invalid["inserted"] == 0
+    assert invalid["errors"]["Erreur"].tolist() == ["Client inconnu"]
+    assert len(ids()) == 2
+
+def test_update_prestation_moves_client():
+    insert("Ann", "Alpha", at(1, 9), 1)
+    (pid,) = ids(client="Alpha")
+
+    assert db.update_prestation(pid, "Ann", "Béta", "Conseil", "revu", at(1, 9), at(1, 11), 100.0) == (2.0, 200.0)
+
+    assert ids(client="Alpha") == []  # le cache de l'ancien client est invalidé
+    row = db.load_prestation(pid)
+    assert (row["Client"], row["Tâche"], row["Description"], row["Total €"]) == ("Béta", "Conseil", "revu", 200.0)
+
+def test_mark_prestations_invoiced_skips_invoiced_rows():
+    insert("Ann", "Alpha", at(1, 9), 1)
+    insert("Ann", "Alpha", at(2, 9), 1)
+    first, second = ids(client="Alpha")
+
+    assert db.mark_prestations_invoiced([first], "F-1") == 1
+    assert db.mark_prestations_invoiced([first, second], "F-2") == 1
+
+    refs = db.load_prestations_by_ids([first, second])["Réf facture"].tolist()
+    assert refs == ["F-1", "F-2"]
+
+def test_run_billing_numbers_each_client():
+    insert("Ann", "Alpha", at(1, 9), 1)
+    insert("Bob", "Alpha", at(2, 9), 2)
+    insert("Ann", "Béta", at(3, 9), 1, task="Conseil", rate=100.0)
+    insert("Ann", "Alpha", datetime(2024, 4, 1, 9), 1)  # hors période
+
+    preview = db.preview_billing_run(date(2024, 3, 1), date(2024, 3, 31))
+    summary = db.run_billing(date(2024, 3, 1), date(2024, 3, 31), prefix="T-")
+
+    assert summary["Client"].tolist() == ["Alpha", "Béta"]
+    assert summary["Prestations"].tolist() == preview["Prestations"].tolist() == [2, 1]
+    assert summary["Total €"].tolist() == preview["Total €"].tolist() == [240.0, 100.0]
+    numbers = [int(ref.removeprefix("T-")) for ref in summary["Facture"]]
+    assert all(ref.startswith("T-") and len(ref) == 7 for ref in summary["Facture"])
+    assert numbers[1] == numbers[0] + 1
+
+    assert db.run_billing(date(2024, 3, 1), date(2024, 3, 31), prefix="T-").empty
+    assert len(ids(invoiced=False)) == 1
+
+def test_run_billing_waits_for_locked_rows(backend):
+    if backend != "postgres":
+        pytest.skip("FOR UPDATE : PostgreSQL uniquement")
+    insert("Ann", "Alpha", at(1, 9), 1)
+    insert("Bob", "Alpha", at(2, 9), 2)
+    first, second = ids(client="Alpha")
+
+    with closing(psycopg2.connect(**db._connection_params())) as other, other.cursor() as cur:
+        cur.execute("SELECT id FROM prestations WHERE id = %s FOR UPDATE;", (first,))  # facturée ailleurs en ce moment
+        with ThreadPoolExecutor(1) as executor:
+            billing = executor.submit(db.run_billing, date(2024, 3, 1), date(2024, 3, 31), prefix="T-")
+            time.sleep(0.5)
+            assert not billing.done()  # attend le verrou
+            cur.execute("UPDATE prestations SET invoiced = true, invoice_ref = 'MAN-1' WHERE id = %s;", (first,))
+            other.commit()
+            summary = billing.result(timeout=10)
+
+    assert summary["Prestations"].tolist() == [1]  # la ligne facturée entre-temps n'est pas refacturée
+    refs = db.load_prestations_by_ids([first, second])["Réf facture"].tolist()
+    assert refs == ["MAN-1", summary["Facture"][0]]
+
+def test_stop_timer_records_prestation_once():
+    started = at(1, 9)
+    assert db.start_timer("Ann", "Alpha", "Analyse", "chrono", 80.0, started)
+    assert not db.start_timer("Ann", "Béta", "Analyse", "", 80.0, started)
+
+    assert db.stop_timer("Ann", started + timedelta(minutes=90)) == (1.5, 120.0)
+    assert db.stop_timer("Ann", started + timedelta(minutes=95)) is None
+
+    assert db.load_timers() == {}
+    row = db.load_prestations_filtered().iloc[0]
+    assert (row["Client"], row["Description"], row["Début"], row["Heures"]) == ("Alpha", "chrono", started, 1.5)
+
+def test_insert_journal_entries_is_idempotent():
+    entry = journal_entry("Ann", "Alpha", at(1, 9), at(1, 10))
+    assert db.insert_journal_entries([entry]) == 1
+    assert db.insert_journal_entries([entry]) == 0  # lot renvoyé après une confirmation perdue
+
+    started = at(2, 9)
+    db.start_timer("Bob", "Béta", "Analyse", "", 80.0, started)
+    stop = journal_entry("Bob", "Béta", started, at(2, 11), timer_started_at=started)
+    assert db.insert_journal_entries([stop]) == 1
+    assert db.load_timers() == {}
+    assert db.insert_journal_entries([stop]) == 0
+    assert len(ids()) == 2
+
+def test_overlap_report_and_find_overlaps():
+    insert("Ann", "Alpha", at(1, 9), 2)     # 9-11
+    insert("Ann", "Béta", at(1, 10), 2)     # 10-12 : chevauche 9-11
+    insert("Ann", "Alpha", at(1, 12), 1)    # 12-13 : bord à bord
+    insert("Bob", "Alpha", at(1, 9), 2)     # autre prestataire
+    first, second, _ = ids(provider="Ann")
+
+    report = db.overlap_report()
+    assert report[["Prestataire", "ID 1", "ID 2"]].values.tolist() == [["Ann", first, second]]
+    assert report["Chevauchement (h)"].tolist() == [1.0]
+
+    assert db.find_overlaps("Ann", at(1, 11), at(1, 12))["ID"].tolist() == [second]
+    assert db.find_overlaps("Ann", at(1, 11), at(1, 12), exclude_id=second).empty
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+def test_export_year(fmt):
+    insert("Ann", "Béta", datetime(2024, 1, 1, 9), 1)
+    insert("Ann", "Alpha", datetime(2024, 12, 31, 22), 1)
+    insert("Ann", "Alpha", datetime(2024, 6, 1, 9), 1)
+    insert("Ann", "Alpha", datetime(2023, 12, 31, 9), 1)
+
+    buffer = io.BytesIO()
+    assert export.export_year(buffer, 2024, fmt=fmt) == 3
+
+    if fmt == "csv":
+        text = buffer.getvalue().decode("utf-8-sig")
+        rows = list(csv.DictReader(io.StringIO(text), delimiter=";"))
+        facturee = {r["Facturée"] for r in rows}
+        assert facturee == {"Non"}
+    else:
+        buffer.seek(0)
+        rows = pd.read_parquet(buffer).to_dict("records")
+    assert [(r["Mois"], r["Client"]) for r in rows] == [("2024-06", "Alpha"), ("2024-12", "Alpha"), ("2024-01", "Béta")]
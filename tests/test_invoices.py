@@ -0,0 +1,33 @@
+"""Factures d'une période : un jeu de fichiers par client, même quand les noms se ressemblent."""
+import io
+import zipfile
+from datetime import date, datetime
+
+import database as db
+import invoices
+
+def test_clients_with_the_same_slug_get_their_own_files(tmp_path):
+    for name in ("Café", "Cafe"):
+        db.add_or_reactivate_client(name)
+        db.insert_prestation("Ann", name, "Analyse", "", datetime(2024, 3, 1, 9), datetime(2024, 3, 1, 10), 80.0)
+
+    results, _ = invoices.generate_invoices(date(2024, 3, 1), date(2024, 3, 31), out_dir=str(tmp_path),
+                                            workers=1, clients=["Café", "Cafe"])
+    assert [r["error"] for r in results] == [None, None]
+    assert invoices.slugify("Café") == invoices.slugify("Cafe")
+    assert len({path for r in results for path in r["files"]}) == 6
+
+    buffer = io.BytesIO()
+    invoices.zip_invoices(buffer, results)
+    assert len(zipfile.ZipFile(buffer).namelist()) == 6
+
+def test_client_names_outside_cp1252_are_invoiced(tmp_path):
+    client = "Łódź Œuvre — Dvořák"
+    db.add_or_reactivate_client(client)
+    db.insert_prestation("Ann", client, "Analyse", "Réunion 🚀 ✓ 東京", datetime(2024, 3, 1, 9), datetime(2024, 3, 1, 10), 80.0)
+
+    (result,), _ = invoices.generate_invoices(date(2024, 3, 1), date(2024, 3, 31), out_dir=str(tmp_path),
+                                              workers=1, clients=[client])
+    assert result["error"] is None
+    pdf = next(path for path in result["files"] if path.endswith(".pdf"))
+    assert b"DejaVuSans" in open(pdf, "rb").read()
@@ -0,0 +1,35 @@
+"""Envoi du journal local : une saisie refusée par la base ne bloque pas les suivantes."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import database as db
+import journal
+
+@pytest.fixture
+def local(tmp_path):
+    j = journal.Journal(str(tmp_path / "journal.sqlite"), batch_size=10)
+    yield j
+    j.close()
+
+def record(j, client, description="", hour=9, rate=80.0):
+    start = datetime(2024, 3, 1, hour)
+    j.record("Ann", client, "Analyse", description, start, start + timedelta(hours=1), rate)
+
+def test_flush_sets_rejected_entries_aside(local, backend):
+    record(local, "Alpha", hour=9)
+    record(local, "Alpha", hour=10, rate=1e10)  # dépasse numeric(10, 2)
+    if backend == "postgres":
+        record(local, "Alpha", "nul \x00 ici", hour=11)  # refusé par psycopg2
+    record(local, "Béta", hour=12)
+
+    assert local.flush() == 2
+    assert local.pending() == 0
+    rejected = local.entries(rejected=True)
+    assert [e["start_at"].hour for e in rejected] == ([10, 11] if backend == "postgres" else [10])
+    assert all(e["attempts"] == 1 and e["last_error"] for e in rejected)
+    assert sorted(db.load_prestations_filtered()["Client"]) == ["Alpha", "Béta"]
+
+    record(local, "Alpha", hour=14)
+    assert local.flush() == 1
+    assert local.pending(rejected=True) == len(rejected)
@@ -0,0 +1,64 @@
+"""Schéma : migrations, cumuls journaliers tenus par triggers (PostgreSQL) et index des filtres."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import database as db
+import migrations
+
+def test_migrations_are_recorded_once(backend):
+    expected = [m[0] for m in (migrations.MIGRATIONS if backend == "postgres" else migrations.DUCKDB_MIGRATIONS)]
+    assert migrations.apply_migrations() == []  # déjà appliquées par la fixture
+
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version FROM schema_migrations ORDER BY version;")
+            assert [r[0] for r in cur.fetchall()] == sorted(expected)
+
+def daily_totals():
+    """Cumuls lus par aggregate_prestations (prestations_daily sous PostgreSQL)."""
+    df = db.aggregate_prestations(by=("day", "client", "task", "provider", "invoiced"))
+    return sorted(tuple(r) for r in df.itertuples(index=False))
+
+def recomputed_totals():
+    """Mêmes cumuls recalculés depuis les prestations."""
+    df = db.load_prestations_filtered()
+    df = df.assign(Jour=df["Début"].dt.normalize(), Prestataire=df["Prestataire"].fillna(""))
+    grouped = df.groupby(["Jour", "Client", "Tâche", "Prestataire", "Facturée"], as_index=False).agg(
+        Prestations=("ID", "count"), Heures=("Heures", "sum"), Total=("Total €", "sum"))
+    return sorted(tuple(r) for r in grouped.itertuples(index=False))
+
+def test_daily_rollup_follows_every_write(backend):
+    start = datetime(2024, 3, 1, 9)
+    for day, client in ((0, "Alpha"), (0, "Alpha"), (1, "Béta")):
+        db.insert_prestation("Ann", client, "Analyse", "", start + timedelta(days=day), start + timedelta(days=day, hours=2), 80.0)
+    first, second, third = db.load_prestations_filtered()["ID"].tolist()
+    assert daily_totals() == recomputed_totals()
+    assert daily_totals()[0][5:] == (2, 4.0, 320.0)
+
+    db.update_prestation(second, "Bob", "Béta", "Conseil", "", start + timedelta(days=2), start + timedelta(days=2, hours=1), 100.0)
+    assert daily_totals() == recomputed_totals()
+
+    db.mark_prestations_invoiced([first, third], "F-1")
+    assert daily_totals() == recomputed_totals()
+
+    db.delete_prestations([first])
+    assert daily_totals() == recomputed_totals()
+    assert len(daily_totals()) == 2  # jour sans prestation restante : plus de ligne
+
+def test_filters_are_served_by_indexes(backend):
+    if backend != "postgres":
+        pytest.skip("EXPLAIN : PostgreSQL uniquement")
+    # Assez de lignes pour que le planificateur choisisse l'index du filtre plutôt que celui du tri
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO prestations (provider, client, task, description, start_at, end_at, hours, rate, total, invoiced)
+                SELECT 'P' || i % 12, 'C' || i % 300, 'T' || i % 8, '', at, at + interval '1 hour', 1, 80, 80, i % 30 <> 0
+                FROM generate_series(1, 2000) i, LATERAL (SELECT timestamp '2022-01-01' + i * interval '37 minutes' AS at) t;
+                ANALYZE prestations;
+                """
+            )
+        conn.commit()
+    assert migrations.check_filter_indexes() == []
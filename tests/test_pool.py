@@ -0,0 +1,42 @@
+"""Pool de connexions PostgreSQL : connexions neuves, inactives et mortes."""
+from contextlib import ExitStack
+
+import psycopg2
+import pytest
+
+import database as db
+from conftest import POSTGRES_SECRETS
+
+@pytest.fixture
+def pool(backend):
+    if backend != "postgres":
+        pytest.skip("pool PostgreSQL")
+    params = dict(host=POSTGRES_SECRETS["DB_HOST"], port=POSTGRES_SECRETS["DB_PORT"], dbname=POSTGRES_SECRETS["DB_NAME"],
+                  user=POSTGRES_SECRETS["DB_USER"], password=POSTGRES_SECRETS["DB_PASSWORD"],
+                  sslmode=POSTGRES_SECRETS["DB_SSLMODE"])
+    pool = db.ConnectionPool(minconn=2, maxconn=3, check_after=30, **params)
+    pool.params = params
+    yield pool
+    pool.close()
+
+def borrow_all(pool, n):
+    """Emprunte puis rend n connexions (toutes inactives ensuite). Retourne les connexions."""
+    with ExitStack() as stack:
+        return [stack.enter_context(pool.connection()) for _ in range(n)]
+
+def test_new_connections_are_not_pinged(pool):
+    borrow_all(pool, 3)  # deux ouvertes au départ, une à la demande
+    assert pool.stats()["reconnects"] == 0
+
+def test_dead_idle_connections_are_all_replaced(pool):
+    idle = borrow_all(pool, 2)
+    with psycopg2.connect(**pool.params) as admin, admin.cursor() as cur:  # redémarrage simulé
+        cur.execute("SELECT pg_terminate_backend(pid) FROM unnest(%s::int[]) pid;", ([c.get_backend_pid() for c in idle],))
+    for conn in idle:
+        conn.last_used -= 60
+
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1;")
+        assert cur.fetchone() == (1,)
+    assert conn not in idle
+    assert pool.stats()["reconnects"] == 2
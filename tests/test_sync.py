@@ -0,0 +1,42 @@
+"""Écoute des écritures des autres processus (PostgreSQL : LISTEN/NOTIFY)."""
+import json
+import time
+from contextlib import closing
+
+import psycopg2
+import pytest
+
+import database as db
+import main
+import sync
+
+@pytest.fixture
+def bootstrapped(backend):
+    if backend != "postgres":
+        pytest.skip("NOTIFY : PostgreSQL uniquement")
+    main.bootstrap.clear()
+    sync.start_listener.clear()
+    main.bootstrap()
+    yield
+    listener = sync.start_listener()
+    listener.stop()
+    listener.join(5)
+    sync.start_listener.clear()
+    main.bootstrap.clear()
+
+def test_notify_invalidates_cache_without_the_store(bootstrapped):
+    assert sync._store is None  # page Facturation jamais ouverte
+    cache = db._get_query_cache()
+    scope = [("Alpha", False)]
+    before = cache._token(scope)
+    payload = json.dumps({"origin": "autre-processus", "scopes": [["Alpha", False]]})
+
+    with closing(psycopg2.connect(**db._connection_params())) as other:
+        other.autocommit = True
+        deadline = time.monotonic() + 10
+        while cache._token(scope) == before and time.monotonic() < deadline:  # le thread se connecte encore
+            with other.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, %s);", (db.CHANGES_CHANNEL, payload))
+            time.sleep(0.1)
+
+    assert cache._token(scope) != before
@@ -1,10 +1,77 @@
+import tempfile
+
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, time
+import auth
 import database as db
-import plotly.express as px
+import export
+import journal
+import perf
+import prefetch
+import sync
+
+# plotly (graphiques du dashboard) et invoices (fpdf, PDF des factures) sont importés par les
+# seules pages qui s'en servent : ils ne ralentissent pas le premier affichage.
+
+# --- 1. SAISIE (manuelle ou timer) ---
+def ui_saisie():
+    # Onglets « paresseux » : seul l'onglet ouvert est exécuté
+    manual, timer = st.tabs(["Manuel", "Timer"], key="saisie_tab", on_change="rerun")
+    if manual.open:
+        with manual: ui_manual_entry()
+    if timer.open:
+        with timer: ui_timer()
+
+def _rerun_section():
+    """Réexécute le fragment courant ; toute la page si l'on est dans une exécution complète."""
+    try:
+        st.rerun(scope="fragment")
+    except st.errors.StreamlitAPIException:
+        st.rerun()
+
+def _overlap_warning(overlaps, intro, shown=5):
+    """Liste les prestations existantes dont le créneau chevauche celui saisi."""
+    lines = [f"- {r['Client']} — {r['Tâche']} : {r['Début']:%d/%m/%Y %H:%M} → {r['Fin']:%d/%m/%Y %H:%M} (ID {r['ID']})"
+             for _, r in overlaps.head(shown).iterrows()]
+    if len(overlaps) > shown:
+        lines.append(f"- … et {len(overlaps) - shown} autre(s)")
+    st.warning(f"⚠️ {intro}\n" + "\n".join(lines))
+
+def _write_behind():
+    """Enregistrement différé (option du mode mobile) : les saisies passent par journal.py."""
+    return st.session_state.get("write_behind", False)
+
+def _database_unreachable():
+    """Enregistrement différé et dernier envoi du journal en échec : les lectures facultatives
+    sont sautées au lieu d'attendre, à chaque interaction, le délai de connexion."""
+    return _write_behind() and journal.get_journal().last_error is not None
+
+def _find_overlaps(provider, start_dt, end_dt):
+    """Chevauchements du créneau ; en enregistrement différé, None si la base est injoignable."""
+    if not _write_behind():
+        return db.find_overlaps(provider, start_dt, end_dt)
+    if _database_unreachable():
+        return None
+    try:
+        return db.find_overlaps(provider, start_dt, end_dt)
+    except db.CONNECTION_ERRORS:
+        return None
+
+def _timer_data():
+    """(clients, timers en cours) ; en enregistrement différé, None si la base est injoignable."""
+    if not _write_behind():
+        return prefetch.gather(db.load_clients, db.load_timers)
+    if _database_unreachable():
+        return None
+    try:
+        return prefetch.gather(db.load_clients, db.load_timers)
+    except db.CONNECTION_ERRORS:
+        return None
 
-# --- 1. ENCODAGE MANUEL ---
+# Chaque section interactive est un fragment : un clic ne réexécute que la section
+@st.fragment
+@perf.timed("view")
 def ui_manual_entry():
     # On utilise un conteneur avec bordure pour délimiter la zone de saisie
     with st.container(border=True):
@@ -48,79 +115,162 @@ def ui_manual_entry():
             
             description = st.text_area("Description / Notes", height=100, key="desc_man")
 
+        start_dt = datetime.combine(start_date, start_time)
+        end_dt = datetime.combine(end_date, end_time)
+
+        # Avertissement dès la saisie si le prestataire a déjà encodé ce créneau (en différé :
+        # à l'enregistrement seulement, pour ne pas attendre la base à chaque modification)
+        if not _write_behind():
+            overlaps = db.find_overlaps(provider, start_dt, end_dt)
+            if not overlaps.empty:
+                _overlap_warning(overlaps, f"{provider} a déjà {len(overlaps)} prestation(s) sur ce créneau :")
+
         # Bouton large et coloré (type 'primary')
         if st.button("💾 Enregistrer la prestation", type="primary", use_container_width=True):
             if not all([provider, client, task]):
                 st.error("⚠️ Veuillez remplir le Prestataire, le Client et la Tâche.")
             else:
-                start_dt = datetime.combine(start_date, start_time)
-                end_dt = datetime.combine(end_date, end_time)
-                
                 if end_dt <= start_dt:
                     st.error("⚠️ La date de fin doit être après le début.")
+                elif _write_behind():
+                    h, t = journal.get_journal().record(provider, client, task, description, start_dt, end_dt, rate)
+                    st.success(f"✅ Prestation enregistrée : **{h} h** pour **{t} €** (envoi en arrière-plan)")
+                    overlaps = _find_overlaps(provider, start_dt, end_dt)
+                    if overlaps is None:
+                        st.caption("📴 Base injoignable : chevauchements non vérifiés.")
+                    elif not overlaps.empty:
+                        _overlap_warning(overlaps, "La prestation enregistrée chevauche :")
                 else:
                     h, t = db.insert_prestation(provider, client, task, description, start_dt, end_dt, rate)
                     st.success(f"✅ Prestation enregistrée : **{h} h** pour **{t} €**")
-                    db.clear_prestations_cache()
 
 # --- 2. TIMER ---
+# Les timers sont en base (un par prestataire) : ils survivent à la fermeture de l'onglet
+# et se voient depuis le téléphone. Seule l'horloge est redessinée chaque seconde.
+@st.fragment
+@perf.timed("view")
 def ui_timer():
-    clients = db.load_clients()
+    data = _timer_data()
+    if data is None:
+        st.warning("📴 Base injoignable : les timers sont en base et indisponibles hors connexion. "
+                   "La saisie manuelle reste possible (envoi en arrière-plan).")
+        return
+    clients, timers = data
     tasks = db.load_tasks()
     providers = db.load_providers()
+    if _write_behind():  # arrêtés ici, encore en base tant que le journal n'est pas envoyé
+        stopped = journal.get_journal().pending_timer_stops()
+        timers = {p: t for p, t in timers.items() if (p, t["started_at"]) not in stopped}
+
+    if "timer_flash" in st.session_state:
+        st.success(st.session_state.pop("timer_flash"))
+    if "timer_error" in st.session_state:
+        st.error(st.session_state.pop("timer_error"))
+    if "timer_overlaps" in st.session_state:
+        _overlap_warning(st.session_state.pop("timer_overlaps"), "La prestation enregistrée chevauche :")
 
-    if "timer_running" not in st.session_state: st.session_state.timer_running = False
+    prov = st.selectbox("Prestataire", options=providers, key="t_prov_sel") if providers else st.text_input("Prestataire", key="t_prov_txt")
+    running = timers.get(prov)
 
     # Affichage différent selon l'état du timer
-    if not st.session_state.timer_running:
+    if running is None:
         with st.container(border=True):
             st.subheader("⏱️ Lancer le chrono")
             c1, c2 = st.columns(2)
             with c1:
-                prov = st.selectbox("Prestataire", options=providers, key="t_prov_sel") if providers else st.text_input("Prestataire", key="t_prov_txt")
                 cli = st.selectbox("Client", options=[""] + clients, key="t_cli_sel")
             with c2:
                 tsk = st.selectbox("Tâche", options=[""] + list(tasks.keys()), key="t_task_sel")
-                desc = st.text_input("Description rapide", key="t_desc_in")
+            desc = st.text_input("Description rapide", key="t_desc_in")
             
             st.write("") # Espace
             if st.button("▶️ Démarrer", type="primary", use_container_width=True):
                 if all([prov, cli, tsk]):
-                    st.session_state.update({
-                        "timer_running": True, "timer_start": datetime.now(),
-                        "t_prov": prov, "t_cli": cli, "t_task": tsk, "t_desc": desc
-                    })
-                    st.rerun()
+                    try:
+                        if _write_behind():  # un arrêt pas encore envoyé bloquerait le nouveau timer
+                            journal.get_journal().flush()
+                        if not db.start_timer(prov, cli, tsk, desc, float(tasks.get(tsk, 0.0)), datetime.now().replace(microsecond=0)):
+                            st.session_state.timer_flash = f"Un timer est déjà en cours pour {prov}."
+                    except db.CONNECTION_ERRORS:
+                        if not _write_behind():
+                            raise
+                        st.session_state.timer_error = "📴 Base injoignable : timer non démarré, réessayez plus tard."
+                    _rerun_section()
                 else:
                     st.error("Champs manquants")
     else:
         # ÉTAT EN COURS
-        st.info(f"⏳ **Timer en cours** pour **{st.session_state.t_cli}** ({st.session_state.t_task})")
-        
-        col_metric1, col_metric2 = st.columns(2)
-        start_time = st.session_state.timer_start
-        elapsed = datetime.now() - start_time
-        
-        # On enlève les microsecondes pour l'affichage
-        elapsed_clean = str(elapsed).split('.')[0] 
-        
-        col_metric1.metric("Heure de début", start_time.strftime("%H:%M"))
-        col_metric2.metric("Temps écoulé", elapsed_clean)
-
-        if st.button("⏹️ Arrêter et Enregistrer", type="primary", use_container_width=True):
-            rate = float(tasks.get(st.session_state.t_task, 0.0))
-            end_time = datetime.now()
-            h, t = db.insert_prestation(
-                st.session_state.t_prov, st.session_state.t_cli, st.session_state.t_task, 
-                st.session_state.t_desc, st.session_state.timer_start, end_time, rate
-            )
-            st.balloons() # Petit effet sympa
-            st.success(f"✅ Terminé : {h} h — {t} €")
-            st.session_state.timer_running = False
-            db.clear_prestations_cache()
-            st.rerun()
+        st.info(f"⏳ **Timer en cours** pour **{running['client']}** ({running['task']})")
+        _timer_clock(running["started_at"])
+
+        c_stop, c_cancel = st.columns([3, 1])
+        if c_stop.button("⏹️ Arrêter et Enregistrer", type="primary", use_container_width=True):
+            end_dt = datetime.now().replace(microsecond=0)
+            overlaps = _find_overlaps(prov, running["started_at"], end_dt)
+            if _write_behind():
+                result = journal.get_journal().record(prov, running["client"], running["task"], running["description"],
+                                                      running["started_at"], end_dt, running["rate"],
+                                                      timer_started_at=running["started_at"])
+            else:
+                result = db.stop_timer(prov, end_dt)
+            if result is None:
+                st.session_state.timer_flash = "Ce timer a déjà été arrêté depuis un autre appareil."
+            else:
+                st.balloons() # Petit effet sympa
+                st.session_state.timer_flash = f"✅ Terminé : {result[0]} h — {result[1]} €" + (" (envoi en arrière-plan)" if _write_behind() else "")
+                if overlaps is not None and not overlaps.empty:
+                    st.session_state.timer_overlaps = overlaps
+            _rerun_section()
+        if c_cancel.button("Abandonner", use_container_width=True):
+            try:
+                db.cancel_timer(prov)
+            except db.CONNECTION_ERRORS:
+                if not _write_behind():
+                    raise
+                st.session_state.timer_error = "📴 Base injoignable : timer non abandonné, réessayez plus tard."
+            _rerun_section()
+
+    others = {p: t for p, t in timers.items() if p != prov}
+    if others:
+        with st.expander(f"Autres timers en cours ({len(others)})"):
+            st.dataframe(pd.DataFrame([
+                {"Prestataire": p, "Client": t["client"], "Tâche": t["task"], "Début": t["started_at"]}
+                for p, t in others.items()
+            ]), use_container_width=True, hide_index=True)
+
+@st.fragment(run_every=1)
+def _timer_clock(started_at):
+    """Heure de début et temps écoulé, recalculés chaque seconde sans requête."""
+    col_metric1, col_metric2 = st.columns(2)
+    elapsed = datetime.now() - started_at
+    
+    # On enlève les microsecondes pour l'affichage
+    elapsed_clean = str(elapsed).split('.')[0] 
+    
+    col_metric1.metric("Heure de début", started_at.strftime("%H:%M"))
+    col_metric2.metric("Temps écoulé", elapsed_clean)
+
+@st.fragment(run_every=5)
+def ui_journal_status():
+    """Saisies différées pas encore envoyées (barre latérale du mode mobile)."""
+    local = journal.get_journal()
+    pending = local.pending(db.session_provider())
+    if pending:
+        st.warning(f"📤 {pending} saisie(s) en attente d'envoi")
+        if local.last_error:
+            st.caption(f"Base injoignable, nouvel essai automatique ({local.last_error})")
+    else:
+        st.caption("✅ Toutes les saisies sont envoyées")
+    if rejected := local.entries(db.session_provider(), rejected=True):
+        st.error(f"⚠️ {len(rejected)} saisie(s) refusée(s) par la base, à ressaisir")
+        for e in rejected:
+            st.caption(f"{e['client']} — {e['task']} : {e['start_at']:%d/%m %H:%M} → {e['end_at']:%H:%M} ({e['last_error']})")
 
 # --- 3. HISTORIQUE (Mode Édition par sélection de ligne) ---
+SEARCH_LIMIT = 200  # résultats affichés pour une recherche
+
+@st.fragment
+@perf.timed("view")
 def ui_historique():
     st.subheader("📚 Historique des prestations")
     
@@ -133,29 +283,60 @@ def ui_historique():
         ui_edit_form(st.session_state.edit_id)
         return # Arrêter l'exécution pour ne pas afficher le tableau en dessous
 
+    # Logique de chargement : les filtres appliqués sont mémorisés pour pouvoir paginer. Ils sont
+    # lus dans la session avant d'afficher les widgets, pour lancer toutes les lectures ensemble.
+    invoiced_filter = None if st.session_state.get("hist_archives", False) else False
+    page_size = st.session_state.get("hist_page_size", 50)
+    filters = dict(st.session_state.get("hist_filters", {}), invoiced=invoiced_filter)
+    if filters != st.session_state.get("hist_last_filters"):
+        st.session_state.hist_last_filters = filters
+        st.session_state.hist_cursor = {}
+    cursor = st.session_state.hist_cursor
+    search = st.session_state.get("hist_search", "").strip()
+
+    if search:
+        # Recherche : les prestations filtrées les plus pertinentes, sans pagination
+        clients, df = prefetch.gather(
+            db.load_clients,
+            lambda: db.search_prestations(search, filters, limit=SEARCH_LIMIT),
+        )
+        summary = {"count": len(df), "total": float(df["Total €"].sum())}
+        prev_cursor = next_cursor = None
+    else:
+        clients, summary, (df, prev_cursor, next_cursor) = prefetch.gather(
+            db.load_clients,
+            lambda: db.summarize_prestations(**filters),
+            lambda: db.load_prestations_page(**filters, page_size=page_size, **cursor),
+        )
+
+    st.text_input("🔎 Rechercher (description, client)", key="hist_search",
+                  placeholder='réunion TVA, "bilan annuel", factu, -paie')
+
     # --- Zone de filtres repliable ---
     with st.expander("🔍 Filtres et Options", expanded=False):
-        include_invoiced = st.checkbox("Voir aussi les archives (facturées)", value=False)
-        invoiced_filter = None if include_invoiced else False
+        st.checkbox("Voir aussi les archives (facturées)", value=False, key="hist_archives")
 
         c1, c2, c3 = st.columns(3)
-        prov = c1.selectbox("Prestataire", ["(Tous)"] + db.load_providers(), key="hist_prov")
-        cli = c2.selectbox("Client", ["(Tous)"] + db.load_clients(), key="hist_cli")
-        tsk = c3.selectbox("Tâche", ["(Tous)"] + list(db.load_tasks().keys()), key="hist_task")
+        c1.selectbox("Prestataire", ["(Tous)"] + db.load_providers(), key="hist_prov")
+        c2.selectbox("Client", ["(Tous)"] + clients, key="hist_cli")
+        c3.selectbox("Tâche", ["(Tous)"] + list(db.load_tasks().keys()), key="hist_task")
         
         c4, c5 = st.columns(2)
-        d_start = c4.date_input("Du", value=date.today(), key="hist_start")
-        d_end = c5.date_input("Au", value=date.today(), key="hist_end")
+        c4.date_input("Du", value=date.today(), key="hist_start")
+        c5.date_input("Au", value=date.today(), key="hist_end")
         
-        apply_filters = st.button("Appliquer les filtres")
+        st.selectbox("Lignes par page", [25, 50, 100, 200], index=1, key="hist_page_size")
+        st.button("Appliquer les filtres", on_click=_apply_hist_filters)
 
-    # Logique de chargement
-    if apply_filters:
-        df = db.load_prestations_filtered(provider=prov, client=cli, task=tsk, start_date=d_start, end_date=d_end, invoiced=invoiced_filter)
-    else:
-        df = db.load_prestations_filtered(invoiced=invoiced_filter)
+    if df.empty and st.session_state.hist_cursor and not search:
+        # Curseur périmé (lignes supprimées entre-temps) : retour à la première page
+        st.session_state.hist_cursor = {}
+        st.rerun()
 
-    st.write(f"**{len(df)} prestation(s) trouvée(s).**")
+    if search and summary["count"] >= SEARCH_LIMIT:
+        st.write(f"**Les {SEARCH_LIMIT} prestations les plus pertinentes.**")
+    else:
+        st.write(f"**{summary['count']} prestation(s) trouvée(s).**")
 
     # --- Affichage des résultats ---
     if not df.empty:
@@ -189,40 +370,53 @@ def ui_historique():
         # 1. Vérification si le retour est le dictionnaire interactif (Version Streamlit Moderne)
         if isinstance(selected_data, dict) and selected_data.get("selection", {}).get("rows"):
             selected_row_index = selected_data["selection"]["rows"][0]
-            selected_id = df.iloc[selected_row_index]["ID"]
+            selected_id = int(df.iloc[selected_row_index]["ID"])
             selection_made = True
             
         # 2. Vérification si le retour est un DataFrame (Ancien comportement Streamlit)
         # Note : On suppose que l'import de pandas est fait au début de views.py
         elif isinstance(selected_data, pd.DataFrame) and not selected_data.empty:
             # Si Streamlit renvoie directement le DataFrame des lignes sélectionnées
-            selected_id = selected_data.iloc[0]["ID"]
+            selected_id = int(selected_data.iloc[0]["ID"])
             selection_made = True
 
         if selection_made:
             # On active le mode édition avec l'ID sélectionné
             st.session_state.edit_id = selected_id
             st.session_state.edit_mode = True
-            st.rerun()
-
-        # ... (Le reste de la fonction continue ici) ...
+            _rerun_section()
+
+        # Navigation entre les pages
+        if not search:
+            c_prev, c_info, c_next = st.columns([1, 2, 1])
+            if c_prev.button("◀ Précédent", disabled=prev_cursor is None, use_container_width=True, key="hist_prev"):
+                st.session_state.hist_cursor = {"before": prev_cursor}
+                _rerun_section()
+            c_info.caption(f"{len(df)} ligne(s) affichée(s) sur {summary['count']}")
+            if c_next.button("Suivant ▶", disabled=next_cursor is None, use_container_width=True, key="hist_next"):
+                st.session_state.hist_cursor = {"after": next_cursor}
+                _rerun_section()
 
         # ... (Le reste de la fonction: Totaux, Export CSV, et Suppression) ...
         st.markdown("---")
         
         # Totals et Export CSV
         col_export, col_total = st.columns([1, 2])
-        total_global = df["Total €"].sum()
+        total_global = summary["total"]
         
         with col_total:
             st.info(f"💰 **Total pour la sélection : {total_global:.2f} €**")
         with col_export:
-            csv_data = df.to_csv(index=False, sep=";").encode("utf-8-sig")
+            # L'export relit toutes les lignes filtrées (pas seulement la page) en flux, au clic
+            if search:
+                st.caption("L'export reprend les filtres, sans la recherche.")
+            fmt = st.radio("Format", ["csv", "parquet"], format_func=str.upper, horizontal=True,
+                           label_visibility="collapsed", key="hist_export_fmt")
             st.download_button(
-                "📥 Télécharger CSV",
-                data=csv_data,
-                file_name="prestations_filtrees.csv",
-                mime="text/csv",
+                f"📥 Télécharger {fmt.upper()}",
+                data=db.bind_scope(lambda: _export_file(export.export_prestations, fmt=fmt, **filters)),
+                file_name=f"prestations_filtrees.{fmt}",
+                mime=EXPORT_MIME[fmt],
             )
             
         st.markdown("---")
@@ -246,32 +440,61 @@ def ui_historique():
                     st.error("Veuillez sélectionner au moins une ligne.")
                 else:
                     db.delete_prestations(selected_for_delete)
-                    db.clear_prestations_cache()
                     st.success(f"{len(selected_for_delete)} prestation(s) supprimée(s).")
-                    st.rerun()
+                    _rerun_section()
 
     else:
         st.warning("Aucune prestation trouvée avec ces critères.")
+
+    # Export comptable de l'année complète (facturé ou non), pour les administrateurs
+    if not auth.is_admin():
+        return
+    with st.expander("📒 Export annuel (comptable)"):
+        c_year, c_fmt = st.columns(2)
+        year = c_year.number_input("Année", min_value=2000, max_value=2100, value=date.today().year, step=1, key="year_export")
+        year_fmt = c_fmt.radio("Format", ["csv", "parquet"], format_func=str.upper, horizontal=True, key="year_export_fmt")
+        st.download_button(
+            f"📥 Télécharger l'année {year}",
+            data=db.bind_scope(lambda: _export_file(export.export_year, int(year), fmt=year_fmt)),
+            file_name=f"prestations_{year}.{year_fmt}",
+            mime=EXPORT_MIME[year_fmt],
+        )
+
+EXPORT_MIME = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+def _export_file(export_func, *args, **kwargs):
+    """Produit l'export dans un fichier temporaire sur disque et le renvoie pour téléchargement."""
+    tmp = tempfile.TemporaryFile()
+    export_func(tmp, *args, **kwargs)
+    tmp.seek(0)
+    return tmp
         
+def _apply_hist_filters():
+    # Callback : exécuté avant la vue, qui relit les filtres dans la session
+    state = st.session_state
+    state.hist_filters = {"provider": state.hist_prov, "client": state.hist_cli, "task": state.hist_task,
+                          "start_date": state.hist_start, "end_date": state.hist_end}
+
 # --- NOUVELLE FONCTION : FORMULAIRE D'ÉDITION ---
 def ui_edit_form(prestation_id):
     st.subheader(f"✏️ Modification de la prestation ID: {prestation_id}")
     
-    # Chargement de la ligne à éditer (on réutilise load_prestations_filtered pour ne pas surcharger database.py)
-    df_single = db.load_prestations_filtered(provider=None, start_date=None, end_date=None, invoiced=None)
+    # Chargement de la seule ligne à éditer, en même temps que les référentiels
+    data, tasks = prefetch.gather(lambda: db.load_prestation(prestation_id), db.load_tasks)
     
-    try:
-        data = df_single[df_single["ID"] == prestation_id].iloc[0]
-    except IndexError:
+    if data is None:
         st.error("Prestation non trouvée.")
         st.session_state.edit_mode = False
         st.session_state.edit_id = None
         return
 
     clients = db.load_clients()
-    tasks = db.load_tasks()
     providers = db.load_providers()
-    task_rates = db.load_tasks()
+    task_rates = tasks
+
+    overlaps = db.find_overlaps(data["Prestataire"], data["Début"], data["Fin"], exclude_id=prestation_id)
+    if not overlaps.empty:
+        _overlap_warning(overlaps, f"Cette prestation chevauche {len(overlaps)} autre(s) prestation(s) de {data['Prestataire']} :")
     
     # --- Formulaire d'édition ---
     with st.form("edit_prestation_form", border=True):
@@ -307,54 +530,105 @@ def ui_edit_form(prestation_id):
             new_start_dt = datetime.combine(e_start_date, e_start_time)
             new_end_dt = datetime.combine(e_end_date, e_end_time)
             
+            # Un nouveau créneau qui chevauche d'autres prestations doit être confirmé (second clic)
+            slot = (prestation_id, e_provider, new_start_dt, new_end_dt)
+            moved = (e_provider, new_start_dt, new_end_dt) != (data["Prestataire"], data["Début"], data["Fin"])
+            new_overlaps = db.find_overlaps(e_provider, new_start_dt, new_end_dt, exclude_id=prestation_id) if moved else overlaps
+
             if new_end_dt <= new_start_dt:
                 st.error("⚠️ La date de fin doit être après le début.")
+            elif moved and not new_overlaps.empty and st.session_state.get("edit_overlap_ack") != slot:
+                st.session_state.edit_overlap_ack = slot
+                _overlap_warning(new_overlaps, "Le nouveau créneau chevauche (cliquez à nouveau sur Enregistrer pour confirmer) :")
             else:
                 h, t = db.update_prestation(
                     prestation_id, e_provider, e_client, e_task, e_description, 
                     new_start_dt, new_end_dt, e_rate
                 )
                 st.success(f"✅ Prestation mise à jour : {h} h — {t} €")
-                db.clear_prestations_cache()
                 # Sortir du mode édition
                 st.session_state.edit_mode = False
                 st.session_state.edit_id = None
-                st.rerun()
+                _rerun_section()
 
         if col_b2.form_submit_button("Annuler et revenir à l'historique"):
             # Sortir du mode édition sans sauvegarder
             st.session_state.edit_mode = False
             st.session_state.edit_id = None
-            st.rerun()
+            _rerun_section()
 # --- 4. DASHBOARD ---
+DASHBOARD_GRAINS = {"week": "Semaine", "month": "Mois"}
+
+@st.fragment
+@perf.timed("view")
 def ui_dashboard():
+    import plotly.express as px
+
     st.subheader("📊 Tableau de bord")
-    df = db.load_prestations_filtered(invoiced=None) # On charge tout
-    
-    if df.empty:
-        st.warning("Pas assez de données pour afficher le dashboard.")
+
+    # Période analysée : les agrégats sont calculés par la base (cumuls journaliers)
+    today = date.today()
+    c1, c2, c3 = st.columns(3)
+    start = c1.date_input("Du", value=date(today.year - 1, today.month, 1), key="dash_start")
+    end = c2.date_input("Au", value=today, key="dash_end")
+    grain = c3.radio("Regrouper par", list(DASHBOARD_GRAINS), format_func=DASHBOARD_GRAINS.get,
+                     index=1, horizontal=True, key="dash_grain")
+    period = {"start_date": start, "end_date": end}
+
+    series, by_client, by_task, by_provider = prefetch.gather(
+        lambda: db.aggregate_prestations((grain, "invoiced"), **period),
+        lambda: db.aggregate_prestations(("client",), **period),
+        lambda: db.aggregate_prestations(("task",), **period),
+        lambda: db.aggregate_prestations(("provider",), **period),
+    )
+
+    if by_client.empty:
+        st.warning("Aucune prestation sur cette période.")
         return
 
     # Gros chiffres clés
     col1, col2, col3 = st.columns(3)
-    col1.metric("Chiffre d'Affaires", f"{df['Total €'].sum():.2f} €", delta="Global")
-    col2.metric("Heures Totales", f"{df['Heures'].sum():.2f} h")
-    col3.metric("Prestations", len(df))
+    col1.metric("Chiffre d'Affaires", f"{by_client['Total €'].sum():.2f} €")
+    col2.metric("Heures Totales", f"{by_client['Heures'].sum():.2f} h")
+    col3.metric("Prestations", int(by_client["Prestations"].sum()))
 
     st.markdown("---")
-    
+
+    # Évolution dans le temps, facturé / à facturer
+    label = DASHBOARD_GRAINS[grain]
+    series["Statut"] = series["Facturée"].map({True: "Facturé", False: "À facturer"})
+    fig = px.bar(series, x=label, y="Total €", color="Statut", hover_data=["Heures", "Prestations"],
+                 color_discrete_map={"Facturé": "#4CAF50", "À facturer": "#FF9800"})
+    fig.update_layout(margin=dict(t=10, b=10), legend_title_text="")
+    st.plotly_chart(fig, use_container_width=True)
+
     # Graphiques
     c_chart1, c_chart2 = st.columns(2)
     
     with c_chart1:
-        st.write("**Par Client (€)**")
-        st.bar_chart(df.groupby("Client")["Total €"].sum(), color="#4CAF50") # Vert
+        st.write("**Par Client (€), 15 premiers**")
+        top = by_client.nlargest(15, "Total €").sort_values("Total €")
+        fig = px.bar(top, x="Total €", y="Client", orientation="h", color_discrete_sequence=["#4CAF50"])
+        fig.update_layout(margin=dict(t=10, b=10), yaxis_title=None)
+        st.plotly_chart(fig, use_container_width=True)
         
     with c_chart2:
         st.write("**Par Tâche (€)**")
-        st.bar_chart(df.groupby("Tâche")["Total €"].sum(), color="#2196F3") # Bleu
+        fig = px.bar(by_task.sort_values("Total €", ascending=False), x="Tâche", y="Total €",
+                     color_discrete_sequence=["#2196F3"])
+        fig.update_layout(margin=dict(t=10, b=10), xaxis_title=None)
+        st.plotly_chart(fig, use_container_width=True)
+
+    st.write("**Par Prestataire (h)**")
+    by_provider["Prestataire"] = by_provider["Prestataire"].replace("", "(aucun)")
+    fig = px.bar(by_provider.sort_values("Heures", ascending=False), x="Prestataire", y="Heures",
+                 color_discrete_sequence=["#9C27B0"])
+    fig.update_layout(margin=dict(t=10, b=10), xaxis_title=None)
+    st.plotly_chart(fig, use_container_width=True)
 
 # --- 5. FACTURATION ---
+@st.fragment
+@perf.timed("view")
 def ui_facturation():
     st.subheader("💶 Facturation")
     clients = db.load_clients()
@@ -363,91 +637,334 @@ def ui_facturation():
     with col_sel:
         cli = st.selectbox("Client à facturer", ["(Choisir)"] + clients)
     
+    if "invoice_flash" in st.session_state:
+        st.success(st.session_state.pop("invoice_flash"))
+
     if cli != "(Choisir)":
-        df = db.load_prestations_filtered(client=cli, invoiced=False)
-        if df.empty:
-            st.success("Rien à facturer pour ce client ! 🎉")
-        else:
-            st.dataframe(
-                df, 
-                use_container_width=True,
-                column_config={"Total €": st.column_config.NumberColumn(format="%.2f €")},
-                hide_index=True
-            )
-            
+        _ui_facturation_live(cli)
+
+        # Les prestations à facturer viennent du magasin synchronisé (pas de requête)
+        df = sync.get_store().frame(client=cli)
+        if not df.empty:
             with st.container(border=True):
-                st.write(f"**Total à facturer : {df['Total €'].sum():.2f} €**")
                 sel_ids = st.multiselect("Sélectionner manuellement (si partiel)", df["ID"].tolist(), default=df["ID"].tolist())
                 ref_facture = st.text_input("Numéro de facture (ex: 2025-01)")
                 
                 if st.button("✅ Marquer comme FACTURÉ", type="primary"):
                     if ref_facture and sel_ids:
-                        db.mark_prestations_invoiced(sel_ids, ref_facture)
-                        db.clear_prestations_cache()
+                        marked = db.mark_prestations_invoiced(sel_ids, ref_facture)
+                        # Le magasin est relu tout de suite : sans cela, le thread d'écoute n'a pas encore
+                        # vu l'écriture et les lignes facturées reviendraient présélectionnées
+                        sync.get_store().refresh()
                         st.balloons()
-                        st.success("Prestations archivées avec succès !")
-                        st.rerun()
+                        skipped = len(sel_ids) - marked
+                        st.session_state.invoice_flash = f"✅ {marked} prestation(s) archivée(s) sous {ref_facture}." + (
+                            f" {skipped} étaient déjà facturée(s)." if skipped else "")
+                        _rerun_section()
                     else:
                         st.error("Indiquez une référence de facture.")
 
+    with st.expander("🧾 Générer les factures de la période (tous les clients)"):
+        _ui_invoice_batch()
+    with st.expander("📅 Facturer la période (tous les clients)"):
+        _ui_billing_run()
+
+@st.fragment
+def _ui_invoice_batch():
+    """Brouillons de factures (PDF, CSV, UBL) pour chaque client ayant des prestations non facturées."""
+    import invoices
+
+    first_of_month = date.today().replace(day=1)
+    last_month_end = first_of_month - pd.Timedelta(days=1)
+    c1, c2 = st.columns(2)
+    start = c1.date_input("Du", value=last_month_end.replace(day=1), key="inv_batch_start")
+    end = c2.date_input("Au", value=last_month_end, key="inv_batch_end")
+
+    if st.button("🧾 Générer les factures", key="inv_batch_run"):
+        bar = st.progress(0.0, text="Lecture des prestations…")
+
+        def progress(done, total, result):
+            bar.progress(done / total, text=f"{done}/{total} – {result['client']}")
+
+        results, seconds = invoices.generate_invoices(start, end, progress=progress)
+        bar.empty()
+        st.session_state.invoice_batch = {"period": invoices.period_label(start, end), "results": results, "seconds": seconds}
+
+    batch = st.session_state.get("invoice_batch")
+    if not batch:
+        return
+    results = batch["results"]
+    if not results:
+        st.info("Aucune prestation à facturer sur cette période.")
+        return
+    errors = [r for r in results if r["error"]]
+    st.success(f"{len(results) - len(errors)} facture(s) générée(s) en {batch['seconds']:.1f} s.")
+    if errors:
+        st.error(f"{len(errors)} client(s) en erreur.")
+    st.dataframe(
+        pd.DataFrame([{"Client": r["client"], "Lignes": r["lines"], "Heures": r["hours"], "HTVA €": r["net"],
+                       "TVA €": r["vat"], "TVAC €": r["gross"], "Erreur": r["error"]} for r in results]),
+        use_container_width=True, hide_index=True,
+        column_config={c: st.column_config.NumberColumn(format="%.2f €") for c in ("HTVA €", "TVA €", "TVAC €")},
+    )
+    st.download_button(
+        "📥 Télécharger toutes les factures (zip)",
+        data=db.bind_scope(lambda: _export_file(invoices.zip_invoices, results)),
+        file_name=f"factures_{batch['period']}.zip",
+        mime="application/zip",
+    )
+
+@st.fragment
+def _ui_billing_run():
+    """Numérote et marque comme facturées toutes les prestations ouvertes de la période, après aperçu."""
+    last_month_end = date.today().replace(day=1) - pd.Timedelta(days=1)
+    c1, c2, c3 = st.columns(3)
+    start = c1.date_input("Du", value=last_month_end.replace(day=1), key="bill_start")
+    end = c2.date_input("Au", value=last_month_end, key="bill_end")
+    prefix = c3.text_input("Préfixe des numéros", value=f"{end.year}-", key="bill_prefix")
+
+    result = st.session_state.get("billing_result")
+    if result is not None:
+        st.success(f"{len(result)} facture(s) numérotée(s), {result['Total €'].sum():.2f} € HTVA.")
+        st.dataframe(result, use_container_width=True, hide_index=True,
+                     column_config={"Total €": st.column_config.NumberColumn(format="%.2f €")})
+
+    # Aperçu calculé par la base : ce que la facturation marquerait maintenant
+    preview = db.preview_billing_run(start, end)
+    if preview.empty:
+        st.info("Aucune prestation à facturer sur cette période.")
+        return
+    st.write(f"**Aperçu : {len(preview)} client(s), {preview['Prestations'].sum()} prestation(s), "
+             f"{preview['Total €'].sum():.2f} € HTVA**")
+    st.dataframe(preview, use_container_width=True, hide_index=True,
+                 column_config={"Total €": st.column_config.NumberColumn(format="%.2f €")})
+    confirm = st.checkbox("Je confirme la facturation de ces prestations", key="bill_confirm")
+    st.button(f"✅ Facturer {len(preview)} client(s)", type="primary", disabled=not confirm, key="bill_run",
+              on_click=_run_billing, args=(start, end, prefix))
+
+def _run_billing(start, end, prefix):
+    # Callback : exécuté avant le fragment, la case de confirmation peut encore être décochée
+    st.session_state.billing_result = db.run_billing(start, end, prefix=prefix)
+    st.session_state.bill_confirm = False
+
+@st.fragment(run_every=1)
+def _ui_facturation_live(cli):
+    """Tableau à facturer, redessiné chaque seconde : les nouvelles saisies apparaissent sans recharger la page."""
+    df = sync.get_store().frame(client=cli)
+    if df.empty:
+        st.success("Rien à facturer pour ce client ! 🎉")
+        return
+    st.dataframe(
+        df, 
+        use_container_width=True,
+        column_config={"Total €": st.column_config.NumberColumn(format="%.2f €")},
+        hide_index=True
+    )
+    st.write(f"**Total à facturer : {df['Total €'].sum():.2f} €**")
+
 # --- 6. GESTION (ADMIN) ---
+@perf.timed("view")
 def ui_gestion():
     st.subheader("⚙️ Administration")
     
-    tab1, tab2, tab3 = st.tabs(["👥 Clients", "🛠️ Tâches", "👷 Prestataires"])
-    
-    with tab1:
-        c1, c2 = st.columns([1, 2])
-        with c1:
-            st.write("Ajouter un client")
-            with st.form("add_cli"):
-                new_c = st.text_input("Nom")
-                if st.form_submit_button("Ajouter"):
-                    if new_c:
-                        db.add_or_reactivate_client(new_c)
-                        st.success("Ajouté")
-                        db.load_clients.clear()
-                        db.load_all_clients.clear()
-                        st.rerun()
-        with c2:
-            st.dataframe(db.load_all_clients(), use_container_width=True, hide_index=True)
-
-    with tab2:
-        c1, c2 = st.columns([1, 2])
-        with c1:
-            st.write("Ajouter/Modifier Tâche")
-            with st.form("add_task"):
-                n_t = st.text_input("Nom")
-                r_t = st.number_input("Taux horaire", min_value=0.0)
-                if st.form_submit_button("Sauvegarder"):
-                    if n_t and r_t > 0:
-                        db.upsert_task(n_t, r_t)
-                        st.success("Sauvegardé")
-                        db.load_tasks.clear()
-                        db.load_all_tasks.clear()
-                        st.rerun()
-        with c2:
-            st.dataframe(db.load_all_tasks(), use_container_width=True, hide_index=True)
-            
-    with tab3:
-        c1, c2 = st.columns([1, 2])
-        with c1:
-            st.write("Ajouter Prestataire")
-            with st.form("add_prov"):
-                n_p = st.text_input("Nom")
-                if st.form_submit_button("Ajouter"):
-                    if n_p:
-                        db.add_or_reactivate_provider(n_p)
-                        st.success("Ajouté")
-                        db.load_providers.clear()
-                        db.load_all_providers.clear()
-                        st.rerun()
-        with c2:
-            st.dataframe(db.load_all_providers(), use_container_width=True, hide_index=True)
-
-
-
+    # Onglets « paresseux » : seul l'onglet ouvert est exécuté
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["👥 Clients", "🛠️ Tâches", "👷 Prestataires", "👤 Utilisateurs",
+                                                       "📥 Import", "🔁 Chevauchements", "⏱️ Performance"],
+                                                      key="admin_tab", on_change="rerun")
+    for tab, section in ((tab1, _ui_admin_clients), (tab2, _ui_admin_tasks), (tab3, _ui_admin_providers),
+                         (tab4, _ui_admin_users), (tab5, ui_import), (tab6, _ui_admin_overlaps), (tab7, ui_performance)):
+        if tab.open:
+            with tab: section()
+
+@st.fragment
+def _ui_admin_clients():
+    c1, c2 = st.columns([1, 2])
+    with c1:
+        st.write("Ajouter un client")
+        with st.form("add_cli"):
+            new_c = st.text_input("Nom")
+            if st.form_submit_button("Ajouter"):
+                if new_c:
+                    db.add_or_reactivate_client(new_c)
+                    st.success("Ajouté")
+                    _rerun_section()
+    with c2:
+        st.dataframe(db.load_all_clients(), use_container_width=True, hide_index=True)
+
+@st.fragment
+def _ui_admin_tasks():
+    c1, c2 = st.columns([1, 2])
+    with c1:
+        st.write("Ajouter/Modifier Tâche")
+        with st.form("add_task"):
+            n_t = st.text_input("Nom")
+            r_t = st.number_input("Taux horaire", min_value=0.0)
+            if st.form_submit_button("Sauvegarder"):
+                if n_t and r_t > 0:
+                    db.upsert_task(n_t, r_t)
+                    st.success("Sauvegardé")
+                    _rerun_section()
+    with c2:
+        st.dataframe(db.load_all_tasks(), use_container_width=True, hide_index=True)
+
+@st.fragment
+def _ui_admin_providers():
+    c1, c2 = st.columns([1, 2])
+    with c1:
+        st.write("Ajouter Prestataire")
+        with st.form("add_prov"):
+            n_p = st.text_input("Nom")
+            if st.form_submit_button("Ajouter"):
+                if n_p:
+                    db.add_or_reactivate_provider(n_p)
+                    st.success("Ajouté")
+                    _rerun_section()
+    with c2:
+        st.dataframe(db.load_all_providers(), use_container_width=True, hide_index=True)
+
+@st.fragment
+def _ui_admin_users():
+    st.caption("Un compte « user » ne voit et n'encode que les prestations de son prestataire ; "
+               "« admin » voit tout et accède à la facturation et à l'administration.")
+    c1, c2 = st.columns([1, 2])
+    with c1:
+        st.write("Créer ou modifier un compte")
+        with st.form("save_user"):
+            username = st.text_input("Utilisateur").strip()
+            role = st.selectbox("Rôle", auth.ROLES)
+            provider = st.selectbox("Prestataire", [""] + db.load_providers())
+            active = st.checkbox("Actif", value=True)
+            password = st.text_input("Mot de passe (vide : inchangé)", type="password")
+            if st.form_submit_button("Enregistrer"):
+                if not username:
+                    st.error("Nom d'utilisateur manquant.")
+                elif role == "user" and not provider:
+                    st.error("Un compte user doit être rattaché à un prestataire.")
+                elif role != "admin" and db.count_users() == 0:
+                    st.error("Le premier compte doit être administrateur.")
+                elif password and len(password) < 8:
+                    st.error("Mot de passe trop court (8 caractères minimum).")
+                elif not db.save_user(username, provider, role, active, auth.hash_password(password) if password else None):
+                    st.error("Nouveau compte : le mot de passe est obligatoire.")
+                else:
+                    st.success("Enregistré")
+                    _rerun_section()
+    with c2:
+        st.dataframe(db.load_users(), use_container_width=True, hide_index=True)
+
+OVERLAP_LIMIT = 1000  # paires affichées dans le rapport
+
+@st.fragment
+def _ui_admin_overlaps():
+    st.caption("Prestations d'un même prestataire dont les créneaux se chevauchent (doubles encodages). "
+               "Chaque paire est listée une fois, la prestation qui commence en premier à gauche.")
+    c1, c2, c3 = st.columns(3)
+    prov = c1.selectbox("Prestataire", ["(Tous)"] + db.load_providers(), key="ovl_prov")
+    start = c2.date_input("Du", value=None, key="ovl_start")
+    end = c3.date_input("Au", value=None, key="ovl_end")
+
+    report = db.overlap_report(provider=prov, start_date=start, end_date=end, limit=OVERLAP_LIMIT)
+    if report.empty:
+        st.success("✅ Aucun chevauchement.")
+        return
+    if len(report) >= OVERLAP_LIMIT:
+        st.write(f"**Les {OVERLAP_LIMIT} premières paires** (réduisez la période pour voir la suite).")
+    else:
+        st.write(f"**{len(report)} paire(s) de prestations qui se chevauchent.**")
+    st.dataframe(report, use_container_width=True, hide_index=True, column_config={
+        column: st.column_config.DatetimeColumn(column, format="DD/MM/YYYY HH:mm")
+        for column in ("Début 1", "Fin 1", "Début 2", "Fin 2")
+    })
+
+@st.fragment
+def ui_performance():
+    recorder = perf.get_recorder()
+    summary = pd.DataFrame(recorder.summary())
+    kinds = {"Démarrage (imports, bootstrap, premier affichage)": "startup",
+             "Exécutions complètes (par mode de navigation)": "rerun", "Vues et sections": "view",
+             "Fonctions database.py": "db", "Requêtes SQL": "sql"}
+    st.caption("Durées des derniers appels depuis le démarrage du serveur (1000 par nom au plus). "
+               "Cache : part des appels servis sans requête SQL.")
+    for label, kind in kinds.items():
+        st.write(f"**{label}**")
+        rows = summary[summary["Type"] == kind].drop(columns="Type").dropna(axis=1, how="all") if not summary.empty else summary
+        if rows.empty:
+            st.info("Aucune mesure pour l'instant.")
+        else:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
 
+    st.write(f"**Requêtes lentes (≥ {recorder.slow_ms:.0f} ms)**")
+    slow = recorder.slow_queries()
+    if slow:
+        st.dataframe(pd.DataFrame(slow), use_container_width=True, hide_index=True)
+    else:
+        st.info("Aucune requête lente.")
+    if recorder.export_path:
+        st.caption(f"Export des mesures : `{recorder.export_path}`")
+    if st.button("Réinitialiser les mesures", key="reset_perf"):
+        recorder.reset()
+        _rerun_section()
+
+    with st.expander("🔌 Connexions à la base de données"):
+        stats = db.pool_stats()
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("En cours d'utilisation", f"{stats['in_use']} / {stats['max']}")
+        m2.metric("Attentes", stats["waits"])
+        m3.metric("Reconnexions", stats["reconnects"])
+        m4.metric("Emprunt p95", f"{stats.get('checkout_ms_p95', 0.0):.1f} ms")
+        st.json(stats)
+
+    with st.expander("🧠 Cache des requêtes"):
+        cache = db.query_cache_stats()
+        m1, m2, m3, m4, m5 = st.columns(5)
+        m1.metric("Taux de succès", f"{cache['hit_ratio']:.0%}")
+        m2.metric("Mémoire", f"{cache['bytes'] / 2**20:.1f} / {cache['max_bytes'] / 2**20:.0f} Mo")
+        m3.metric("Entrées", f"{cache['entries']} / {cache['max_entries']}")
+        m4.metric("Évictions", cache["evictions"], help=f"{cache['oversize']} résultat(s) trop gros pour le budget")
+        m5.metric("Invalidations", cache["invalidations"], help=f"{cache['expirations']} expiration(s)")
+        if st.button("Vider le cache", key="clear_query_cache"):
+            db.clear_prestations_cache()
+            _rerun_section()
+
+def _report_import(report):
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Lignes valides", f"{report['valid']} / {report['rows']}")
+    m2.metric("Heures", f"{report['hours']:.2f} h")
+    m3.metric("Montant", f"{report['total']:.2f} €")
+    m4.metric("Débit", f"{report['rows_per_second']:.0f} lignes/s")
+    if not report["errors"].empty:
+        st.error(f"{len(report['errors'])} erreur(s) : rien n'a été importé.")
+        st.dataframe(report["errors"], use_container_width=True, hide_index=True)
+
+@st.fragment
+def ui_import():
+    st.write("Importer des prestations depuis un fichier CSV ou Excel")
+    st.caption("Colonnes : Prestataire, Client, Tâche, Début, Fin, et en option Description, Tarif €/h, Réf facture. "
+               "Les clients, tâches et prestataires doivent déjà exister.")
+    uploaded = st.file_uploader("Fichier", type=["csv", "xlsx"], key="import_file")
+    if uploaded is None:
+        return
 
+    try:
+        if uploaded.name.lower().endswith(".xlsx"):
+            df = pd.read_excel(uploaded)
+        else:
+            df = pd.read_csv(uploaded, sep=None, engine="python", encoding="utf-8-sig")
+    except Exception as e:
+        st.error(f"Fichier illisible : {e}")
+        return
 
+    st.write(f"**{len(df)} ligne(s) lue(s).**")
+    st.dataframe(df.head(20), use_container_width=True, hide_index=True)
 
+    c1, c2 = st.columns(2)
+    try:
+        if c1.button("🔎 Vérifier (simulation)", use_container_width=True):
+            _report_import(db.import_prestations(df, dry_run=True))
+        if c2.button("📥 Importer", type="primary", use_container_width=True):
+            report = db.import_prestations(df)
+            _report_import(report)
+            if report["inserted"]:
+                st.success(f"✅ {report['inserted']} prestation(s) importée(s) en {report['seconds']:.2f} s.")
+    except ValueError as e:
+        st.error(str(e))